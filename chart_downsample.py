@@ -0,0 +1,88 @@
+# ============================================
+# Downsampling of long series before plotting
+# The renderer gets at most `max_points` points per series, so the cost of a
+# chart stays flat however long the selected range is:
+#   - min_max: the lowest and highest point of every bucket, so peaks and
+#     troughs survive exactly (and all-NaN buckets keep their gap)
+#   - lttb: Largest-Triangle-Three-Buckets, the point of each bucket spanning
+#     the largest triangle with its neighbours (smooth single series)
+# Buckets are sized from the visible range only: the pages cut the data to
+# the selected dates first, so a narrower range is drawn from finer buckets.
+# ============================================
+import numpy as np
+import pandas as pd
+
+MAX_POINTS = 2000        # per series, for full-width charts
+PREVIEW_POINTS = 300     # per series, for the small dashboard previews
+
+
+def min_max_indices(y, max_points=MAX_POINTS) -> np.ndarray:
+    """Sorted row numbers of the min and max of each of max_points // 2 buckets"""
+    n = len(y)
+    if n <= max_points:
+        return np.arange(n)
+    size = -(-n // max(max_points // 2, 1))
+    buckets = -(-n // size)
+    missing = np.isnan(y)
+    low = np.full(buckets * size, np.inf)
+    low[:n] = np.where(missing, np.inf, y)
+    high = np.full(buckets * size, -np.inf)
+    high[:n] = np.where(missing, -np.inf, y)
+    starts = np.arange(buckets) * size
+    # an all-NaN bucket gives its first row both times: the line stays broken there
+    lo = starts + low.reshape(buckets, size).argmin(axis=1)
+    hi = starts + high.reshape(buckets, size).argmax(axis=1)
+    return np.unique(np.r_[lo, hi])
+
+
+def lttb_indices(x, y, max_points=MAX_POINTS) -> np.ndarray:
+    """Sorted row numbers picked by LTTB (first and last row always kept); NaN rows are skipped"""
+    valid = np.flatnonzero(~np.isnan(y))
+    if len(valid) <= max_points or max_points < 3:
+        return valid
+    x, y = np.asarray(x, dtype=float)[valid], np.asarray(y, dtype=float)[valid]
+    n = len(y)
+    edges = np.linspace(1, n - 1, max_points - 1).astype(np.int64)   # max_points - 2 inner buckets
+    sum_x, sum_y = np.r_[0.0, np.cumsum(x)], np.r_[0.0, np.cumsum(y)]
+    counts = np.diff(edges)
+    # the average point of each bucket, the last point after the final bucket
+    mean_x = np.r_[(sum_x[edges[1:]] - sum_x[edges[:-1]]) / counts, x[-1]]
+    mean_y = np.r_[(sum_y[edges[1:]] - sum_y[edges[:-1]]) / counts, y[-1]]
+    picks = np.empty(max_points, dtype=np.int64)
+    picks[0], picks[-1] = 0, n - 1
+    a = 0
+    for b in range(max_points - 2):
+        lo, hi = edges[b], edges[b + 1]
+        nx, ny = mean_x[b + 1], mean_y[b + 1]
+        area = np.abs((x[a] - nx) * (y[lo:hi] - y[a]) - (x[a] - x[lo:hi]) * (ny - y[a]))
+        a = lo + int(area.argmax())
+        picks[b + 1] = a
+    return valid[picks]
+
+
+def _positions(index):
+    """Dates / times of an index as datetime64[ns] (e.g. the date objects of the daily rollup)"""
+    return pd.to_datetime(pd.Index(index)).to_numpy("datetime64[ns]")
+
+
+def downsample(series: pd.Series, max_points=MAX_POINTS, method="min_max") -> pd.Series:
+    """At most ~max_points rows of a time-indexed series ("min_max" or "lttb")"""
+    y = series.to_numpy(dtype=float)
+    if method == "lttb":
+        rows = lttb_indices(_positions(series.index).astype(np.int64), y, max_points)
+    else:
+        rows = min_max_indices(y, max_points)
+    return series.iloc[rows]
+
+
+def plot_lines(ax, data, max_points=MAX_POINTS, method="min_max", **line_kwargs):
+    """
+    Plot a series, or every column of a frame, downsampled per series.
+    Each column keeps its own extremes; returns the Line2D objects.
+    """
+    frame = data.to_frame() if isinstance(data, pd.Series) else data
+    lines = []
+    for col in frame.columns:
+        shown = downsample(frame[col], max_points, method)
+        lines += ax.plot(_positions(shown.index), shown.to_numpy(dtype=float), label=col, **line_kwargs)
+    return lines
@@ -0,0 +1,36 @@
+# ============================================
+# Electricity tariff configuration (time-of-use prices + demand charge)
+# Prices in yuan/kWh, demand charge in yuan per kW of the month's highest
+# 15-minute average load. Spans are "HH:MM" local time, end exclusive;
+# "24:00" closes the day.
+# ============================================
+
+TARIFFS = {
+    "industrial_tou": {
+        "prices": {"sharp": 1.27, "peak": 1.05, "flat": 0.66, "valley": 0.31},
+        "demand_charge": 40.0,
+        "calendars": {
+            "standard": [
+                ("00:00", "08:00", "valley"), ("08:00", "11:00", "peak"), ("11:00", "13:00", "flat"),
+                ("13:00", "17:00", "peak"), ("17:00", "22:00", "flat"), ("22:00", "24:00", "valley"),
+            ],
+            # July / August: critical peak around the late morning and afternoon load
+            "summer": [
+                ("00:00", "08:00", "valley"), ("08:00", "10:00", "peak"), ("10:00", "11:00", "sharp"),
+                ("11:00", "13:00", "flat"), ("13:00", "14:00", "peak"), ("14:00", "16:00", "sharp"),
+                ("16:00", "17:00", "peak"), ("17:00", "22:00", "flat"), ("22:00", "24:00", "valley"),
+            ],
+        },
+        "months": {7: "summer", 8: "summer"},   # other months use "standard"
+        "weekend_calendar": None,               # e.g. "standard"; None = same as weekdays
+    },
+    "flat_rate": {
+        "prices": {"flat": 0.72},
+        "demand_charge": 0.0,
+        "calendars": {"standard": [("00:00", "24:00", "flat")]},
+        "months": {},
+        "weekend_calendar": None,
+    },
+}
+
+DEFAULT_TARIFF = "industrial_tou"
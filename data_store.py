@@ -0,0 +1,619 @@
+# ============================================
+# Columnar on-disk cache for the energy meter workbook
+# The workbook is converted once into one .npy file per column plus a
+# fingerprint sidecar, and rebuilt only when the source file changes.
+# Layout: fixed-width binary columns (int64 epoch-ns time + one float64 array
+# per meter), sorted by time, opened memory-mapped so only touched pages are read.
+# Each rewrite goes to a new generation folder, so live memory maps stay valid.
+# ============================================
+import io
+import os
+import json
+import shutil
+import hashlib
+import weakref
+import itertools
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass, asdict
+
+import numpy as np
+import pandas as pd
+
+from time_utils import normalize_time, date_range_slice
+from rollups_energy import EnergyRollups
+from models_energy import EnergyTable
+from config_equipment import equip_dic
+from config_tariff import DEFAULT_TARIFF
+from energy_cost import Tariff, compute_costs
+from meter_hierarchy import Reconciliation
+from meter_watch import replay
+from resample_energy import resample
+
+CACHE_DIR_NAME = ".energy_cache"
+META_FILE = "meta.json"
+TIME_FILE = "time.npy"
+STORE_VERSION = 4
+_dataset_versions = itertools.count(1)   # every SharedDataset (load, reload, append) gets a new number
+SOURCE_EXTENSIONS = (".xlsx", ".xls", ".csv")
+COST_CACHE_ENTRIES = 16   # cost breakdowns kept per dataset (date range x meters x tariff)
+
+
+def _file_hash(path, chunk_size=1 << 20):
+    """sha256 of the source file, read in chunks"""
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def _fingerprint(path, with_hash=True):
+    """mtime / size (and optionally content hash) of the source file"""
+    st = os.stat(path)
+    fp = {"mtime_ns": st.st_mtime_ns, "size": st.st_size}
+    if with_hash:
+        fp["sha256"] = _file_hash(path)
+    return fp
+
+
+def store_dir_for(path, cache_dir=None):
+    """Directory of the columnar store belonging to a source workbook"""
+    path = os.path.abspath(path)
+    base = cache_dir or os.path.join(os.path.dirname(path), CACHE_DIR_NAME)
+    stem = os.path.splitext(os.path.basename(path))[0]
+    return os.path.join(base, stem)
+
+
+def _read_meta(store_dir):
+    try:
+        with open(os.path.join(store_dir, META_FILE), "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _write_meta(store_dir, meta):
+    """meta.json is written last and atomically, so it marks a complete store"""
+    tmp = os.path.join(store_dir, META_FILE + ".tmp")
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(meta, f, indent=1)
+    os.replace(tmp, os.path.join(store_dir, META_FILE))
+
+
+def _column_file(col):
+    return f"col_{col}.npy"
+
+
+def _generation_dir(store_dir, meta):
+    return os.path.join(store_dir, f"g{meta['generation']}")
+
+
+def _drop_old_generations(store_dir, keep):
+    """Remove older generation folders; a folder still mapped (Windows) is left for next time"""
+    for name in os.listdir(store_dir):
+        if name.startswith("g") and name[1:].isdigit() and name != keep:
+            shutil.rmtree(os.path.join(store_dir, name), ignore_errors=True)
+
+
+def _normalize_frame(df):
+    """First column is the time, the others are meter readings as float64"""
+    df = df.rename(columns={df.columns[0]: "time"})
+    df["time"], report = normalize_time(df["time"])
+    df.attrs["time_parse"] = report.as_dict()
+    for col in df.columns[1:]:
+        df[col] = pd.to_numeric(df[col], errors="coerce").astype("float64")
+    return df
+
+
+def read_source(path):
+    """Read a raw export (Excel or CSV): first column is the time, others are meter readings"""
+    name = str(getattr(path, "name", path)).lower()
+    if name.endswith(".csv"):
+        return _normalize_frame(pd.read_csv(path))
+    return _normalize_frame(pd.read_excel(path))
+
+
+def _month_offsets(times):
+    """{"YYYY-MM": [first row, end row]} of a time array sorted ascending (NaT last)"""
+    valid = times[~np.isnat(times)]
+    if not len(valid):
+        return {}
+    months = np.unique(valid.astype("datetime64[M]"))
+    bounds = np.searchsorted(valid, np.append(months, months[-1] + 1).astype("datetime64[ns]"))
+    return {str(m): [int(lo), int(hi)] for m, lo, hi in zip(months, bounds[:-1], bounds[1:])}
+
+
+def _new_generation(store_dir):
+    """Invalidate the current store and return (generation number, empty folder)"""
+    os.makedirs(store_dir, exist_ok=True)
+    previous = _read_meta(store_dir) or {}
+    generation = int(previous.get("generation", 0)) + 1
+    # Invalidate first, so a half-written store is never picked up
+    meta_path = os.path.join(store_dir, META_FILE)
+    if os.path.exists(meta_path):
+        os.remove(meta_path)
+    gen_dir = os.path.join(store_dir, f"g{generation}")
+    shutil.rmtree(gen_dir, ignore_errors=True)
+    os.makedirs(gen_dir)
+    return generation, gen_dir
+
+
+def _commit_generation(store_dir, generation, times, columns, meta):
+    meta.update({"version": STORE_VERSION, "generation": generation, "columns": columns,
+                 "rows": int(len(times)), "months": _month_offsets(times)})
+    _write_meta(store_dir, meta)
+    _drop_old_generations(store_dir, keep=f"g{generation}")
+
+
+def _write_store(store_dir, df, meta):
+    """Write every column of the frame sorted by time (rows without time dropped), then the metadata"""
+    df = df[df["time"].notna()]
+    if not df["time"].is_monotonic_increasing:
+        df = df.sort_values("time", kind="stable", ignore_index=True)
+    generation, gen_dir = _new_generation(store_dir)
+
+    times = df["time"].to_numpy("datetime64[ns]")
+    np.save(os.path.join(gen_dir, TIME_FILE), times.view("int64"))
+    columns = [str(c) for c in df.columns[1:]]
+    for col in columns:
+        np.save(os.path.join(gen_dir, _column_file(col)), df[col].to_numpy("float64"))
+    _commit_generation(store_dir, generation, times, columns, meta)
+
+
+def _append_store_rows(store_dir, meta, chunk, block_rows=1_000_000):
+    """
+    Fast path for readings newer than everything stored: write the next generation
+    by streaming the old columns and the chunk into new memory-mapped files,
+    so the whole store never has to fit in memory.
+    """
+    old_dir, n_old = _generation_dir(store_dir, meta), int(meta["rows"])
+    columns = list(meta["columns"])
+    generation, gen_dir = _new_generation(store_dir)
+    n_new = n_old + len(chunk)
+    sources = [(TIME_FILE, chunk["time"].to_numpy("datetime64[ns]").view("int64"), "int64")]
+    sources += [(_column_file(c), chunk[c].to_numpy("float64") if c in chunk else np.full(len(chunk), np.nan), "float64")
+                for c in columns]
+    for name, tail, dtype in sources:
+        old = np.load(os.path.join(old_dir, name), mmap_mode="r")
+        out = np.lib.format.open_memmap(os.path.join(gen_dir, name), mode="w+", dtype=dtype, shape=(n_new,))
+        for lo in range(0, n_old, block_rows):
+            hi = min(n_old, lo + block_rows)
+            out[lo:hi] = old[lo:hi]
+        out[n_old:] = tail
+        out.flush()
+        del out, old
+    times = np.load(os.path.join(gen_dir, TIME_FILE), mmap_mode="r").view("datetime64[ns]")
+    _commit_generation(store_dir, generation, times, columns, meta)
+
+
+def build_store(path, store_dir, fingerprint=None):
+    """Convert the workbook into the columnar store and return the frame"""
+    df = read_source(path)
+    _write_store(store_dir, df, {
+        "source": os.path.abspath(path),
+        "fingerprint": fingerprint or _fingerprint(path),
+        "time_parse": df.attrs.get("time_parse", {}),
+        "appended_rows": 0,
+    })
+    return df
+
+
+def _store_is_fresh(path, store_dir, meta):
+    """Cheap mtime/size check first; the content hash is only used when they differ"""
+    if not meta or meta.get("version") != STORE_VERSION:
+        return False
+    stored = meta.get("fingerprint", {})
+    quick = _fingerprint(path, with_hash=False)
+    if quick["mtime_ns"] == stored.get("mtime_ns") and quick["size"] == stored.get("size"):
+        return True
+    if quick["size"] != stored.get("size"):
+        return False
+    # Touched but maybe unchanged (e.g. copied back): compare the content
+    if _file_hash(path) != stored.get("sha256"):
+        return False
+    meta["fingerprint"] = dict(stored, **quick)
+    _write_meta(store_dir, meta)
+    return True
+
+
+def _open_columns(store_dir, meta, columns=None):
+    """Memory-mapped (read-only) time and meter arrays of the current generation"""
+    gen_dir = _generation_dir(store_dir, meta)
+    times = np.load(os.path.join(gen_dir, TIME_FILE), mmap_mode="r").view("datetime64[ns]")
+    arrays = {col: np.load(os.path.join(gen_dir, _column_file(col)), mmap_mode="r")
+              for col in (meta["columns"] if columns is None else columns)}
+    return times, arrays
+
+
+def _load_store(store_dir, meta, rows=None, columns=None):
+    """Read the store (or only a row range of it) into memory as a DataFrame"""
+    rows = slice(None) if rows is None else rows
+    times, arrays = _open_columns(store_dir, meta, columns)
+    data = {"time": np.array(times[rows])}
+    data.update({col: np.array(values[rows]) for col, values in arrays.items()})
+    df = pd.DataFrame(data, copy=False)
+    df.attrs["time_parse"] = meta.get("time_parse", {})
+    return df
+
+
+def open_table(path, cache_dir=None):
+    """
+    EnergyTable over the memory-mapped store of a source file: nothing is read
+    until a page touches it, so the dataset may be larger than RAM.
+    """
+    store_dir, meta = ensure_store(path, cache_dir)
+    times, arrays = _open_columns(store_dir, meta)
+    table = EnergyTable(times, arrays)
+    table.attrs["time_parse"] = meta.get("time_parse", {})
+    return table
+
+
+def ensure_store(path, cache_dir=None):
+    """(store directory, metadata) of a source file, building the store if it is missing or stale"""
+    store_dir = store_dir_for(path, cache_dir)
+    meta = _read_meta(store_dir)
+    if not _store_is_fresh(path, store_dir, meta):
+        build_store(path, store_dir)
+        meta = _read_meta(store_dir)
+    return store_dir, meta
+
+
+def load_store_rows(path, rows, columns=None, cache_dir=None):
+    """Only a row range (e.g. one month from meta["months"]) of a source file's store"""
+    store_dir, meta = ensure_store(path, cache_dir)
+    return _load_store(store_dir, meta, rows, columns)
+
+
+def load_dataset(path, cache_dir=None):
+    """
+    Load the meter workbook through the columnar store.
+    - First call (or source changed): parse the workbook and write the store
+    - Later calls: read the .npy columns directly, no Excel parsing
+    """
+    store_dir = store_dir_for(path, cache_dir)
+    meta = _read_meta(store_dir)
+    if _store_is_fresh(path, store_dir, meta):
+        try:
+            return _load_store(store_dir, meta)
+        except (OSError, ValueError):
+            pass  # damaged store → rebuild below
+    df = build_store(path, store_dir)
+    return df.sort_values("time", kind="stable", ignore_index=True)
+
+
+# ============================================
+# Incremental append of new readings
+# ============================================
+@dataclass
+class AppendReport:
+    rows_received: int = 0
+    rows_added: int = 0          # new timestamps
+    rows_merged: int = 0         # timestamps already present, values filled / overwritten
+    rows_dropped: int = 0        # rows without a readable time or without any reading
+    meters: tuple = ()
+    first_day: object = None
+    last_day: object = None
+
+    def as_dict(self):
+        return asdict(self)
+
+
+def read_chunk(source):
+    """New readings from a DataFrame, a CSV / Excel path or an uploaded file object"""
+    if isinstance(source, pd.DataFrame):
+        df = source.copy()
+        if "time" in df.columns:
+            df = df[["time"] + [c for c in df.columns if c != "time"]]
+        return _normalize_frame(df)
+    return read_source(source)
+
+
+def validate_chunk(df, allowed_meters=None):
+    """
+    Check a chunk of new readings:
+    - every meter column must belong to equip_dic (ValueError otherwise)
+    - rows without a readable time or without any reading are dropped
+    Returns (clean frame, number of dropped rows)
+    """
+    allowed = set(equip_dic if allowed_meters is None else allowed_meters)
+    meters = [str(c) for c in df.columns[1:]]
+    unknown = [m for m in meters if m not in allowed]
+    if unknown:
+        raise ValueError(f"Unknown meter columns: {', '.join(unknown)}")
+    if not meters:
+        raise ValueError("The chunk has no meter columns")
+    keep = df["time"].notna() & df[meters].notna().any(axis=1)
+    # Several rows for one timestamp inside the chunk: the last non-empty value wins
+    clean = df[keep].groupby("time", sort=True).last().reset_index()
+    clean.attrs = dict(df.attrs)
+    return clean, int((~keep).sum())
+
+
+def merge_readings(base, chunk):
+    """
+    Merge a validated chunk into a frame sorted by time.
+    New timestamps are inserted; for existing ones the chunk's non-empty values win.
+    Returns (merged frame sorted by time, rows added, rows merged).
+    """
+    columns = list(base.columns) + [c for c in chunk.columns if c not in base.columns]
+    chunk = chunk.reindex(columns=columns)
+    base_times = base["time"].to_numpy("datetime64[ns]")
+    chunk_times = chunk["time"].to_numpy("datetime64[ns]")
+    if len(base_times) == 0 or chunk_times[0] > base_times[-1]:
+        # Usual case for a growing export: pure append, no sort
+        merged = pd.concat([base.reindex(columns=columns), chunk], ignore_index=True)
+        return merged, len(chunk), 0
+    existing = int(np.isin(chunk_times, base_times).sum())
+    merged = pd.concat([base.reindex(columns=columns), chunk], ignore_index=True)
+    merged = merged.groupby("time", sort=True).last().reset_index()
+    return merged, len(chunk) - existing, existing
+
+
+def append_to_store(path, chunk, cache_dir=None):
+    """
+    Merge a validated chunk into the columnar store of a workbook, so a fresh
+    process sees it too. The store keeps the appended rows until the workbook
+    itself changes; a new full export then replaces them.
+    """
+    store_dir, meta = ensure_store(path, cache_dir)
+    times, _ = _open_columns(store_dir, meta, columns=[])
+    newer = len(times) == 0 or chunk["time"].iloc[0] > times[-1]
+    if newer and set(chunk.columns[1:]) <= set(meta["columns"]):
+        del times
+        meta["appended_rows"] = int(meta.get("appended_rows", 0)) + len(chunk)
+        _append_store_rows(store_dir, meta, chunk)
+        return len(chunk), 0
+    del times
+    merged, added, merged_rows = merge_readings(_load_store(store_dir, meta), chunk)
+    meta["appended_rows"] = int(meta.get("appended_rows", 0)) + added
+    _write_store(store_dir, merged, meta)
+    return added, merged_rows
+
+
+# ============================================
+# Process-wide registry: one read-only dataset per source, shared by all sessions
+# ============================================
+class SharedDataset:
+    """
+    Immutable dataset held once per source file for every session.
+    The data lives in a read-only EnergyTable sorted by time; df is a pandas
+    view on the same arrays, so date ranges are cut by binary search (slice_dates).
+    """
+
+    def __init__(self, key, data, fingerprint=None, rollups=None):
+        """`rollups` builds the rollups from the sorted table (default: from scratch)"""
+        self.key = key
+        attrs = dict(data.attrs)
+        if isinstance(data, EnergyTable):
+            # e.g. a memory-mapped store: used in place, nothing is copied
+            table = data.sorted()
+        else:
+            table = EnergyTable.from_frame(data, copy=True).sorted()
+        has_time = ~np.isnat(table.timestamps)
+        if not has_time.all():
+            table = table.take(has_time)  # readings without a time cannot be placed
+        self.table = table.freeze()
+        self.df = self.table.to_frame()
+        self.df.attrs = attrs
+        self.fingerprint = fingerprint
+        self.version = next(_dataset_versions)
+        # Materialized once per dataset; date range / energy filters only slice it
+        self.rollups = (rollups or EnergyRollups.from_table)(self.table)
+        self.reconciliation = Reconciliation.from_rollups(self.rollups)
+        self._watch = None
+        self._resampled = {}
+        self._costs = OrderedDict()
+
+    @property
+    def nbytes(self):
+        return self.table.nbytes + sum(r.nbytes for r in list(self._resampled.values()))
+
+    def appended(self, chunk, table=None):
+        """
+        New version of this dataset with a validated chunk merged in.
+        `table` is the already merged data (e.g. the rewritten memory-mapped store);
+        without it the chunk is merged in memory. Only the days touched by the chunk
+        are re-aggregated. Returns (dataset, rows added, rows merged).
+        """
+        if table is None:
+            merged, added, merged_rows = merge_readings(self.df, chunk)
+            table = EnergyTable.from_frame(merged, copy=True)
+        else:
+            added = len(table) - len(self.table)
+            merged_rows = len(chunk) - added
+        days = chunk["time"].to_numpy("datetime64[D]")
+        table.attrs = dict(self.df.attrs)
+        new = SharedDataset(self.key, table, self.fingerprint,
+                            rollups=lambda merged: self.rollups.updated(merged, days.min(), days.max()))
+        if self._watch is not None:
+            # the detector goes on from where it stopped: only the new readings are scored
+            watch, events = self._watch
+            watch, fresh = replay(new.table, watch=watch.copy(), since=watch.last_seen)
+            new._watch = watch, pd.concat([events, fresh], ignore_index=True) if len(fresh) else events
+        return new, added, merged_rows
+
+    def watch(self):
+        """(anomaly detector, events) over the whole dataset, replayed on first use"""
+        if self._watch is None:
+            self._watch = replay(self.table)
+        return self._watch
+
+    def resampled(self, minutes):
+        """Consumption on a fixed grid of `minutes` slots, built once per resolution"""
+        if minutes not in self._resampled:
+            self._resampled[minutes] = resample(self.table, minutes)
+        return self._resampled[minutes]
+
+    def costs(self, start=None, end=None, columns=None, tariff=DEFAULT_TARIFF):
+        """Electricity cost breakdown of [start, end], kept for the last COST_CACHE_ENTRIES requests"""
+        key = (str(start), str(end), None if columns is None else tuple(columns), tariff)
+        if key in self._costs:
+            self._costs.move_to_end(key)
+        else:
+            self._costs[key] = compute_costs(self.slice_dates(start, end), Tariff.from_config(tariff), columns)
+            if len(self._costs) > COST_CACHE_ENTRIES:
+                self._costs.popitem(last=False)
+        return self._costs[key]
+
+    def slice_dates(self, start=None, end=None):
+        """Readings whose day lies in [start, end]: O(log n), a view of the shared frame"""
+        return self.df.iloc[date_range_slice(self.table.timestamps, start, end)]
+
+
+class DatasetLease:
+    """
+    A session's reference to a shared dataset.
+    Released explicitly when the session switches source, or automatically
+    when the session state holding it is garbage collected.
+    """
+
+    def __init__(self, registry, key):
+        self.key = key
+        self._registry = registry
+        self._finalizer = weakref.finalize(self, registry._release, key)
+
+    @property
+    def dataset(self):
+        return self._registry.get(self.key)
+
+    @property
+    def df(self):
+        return self.dataset.df
+
+    @property
+    def released(self):
+        return not self._finalizer.alive
+
+    def release(self):
+        self._finalizer()
+
+
+class DatasetRegistry:
+    """
+    Reference-counted holder of SharedDataset objects.
+    - acquire(): load once (or reload when the fingerprint changed) and hand out a lease
+    - Unreferenced datasets are kept for reuse, at most max_idle of them (LRU)
+    """
+
+    def __init__(self, max_idle=2):
+        self.max_idle = max_idle
+        self._lock = threading.RLock()
+        self._entries = OrderedDict()  # key -> [SharedDataset, refcount]
+
+    def _ensure(self, key, loader, fingerprint):
+        entry = self._entries.get(key)
+        if entry is None:
+            entry = self._entries[key] = [SharedDataset(key, loader(), fingerprint), 0]
+        elif fingerprint is not None and entry[0].fingerprint != fingerprint:
+            entry[0] = SharedDataset(key, loader(), fingerprint)
+        self._entries.move_to_end(key)
+        return entry
+
+    def acquire(self, key, loader, fingerprint=None):
+        with self._lock:
+            entry = self._ensure(key, loader, fingerprint)
+            entry[1] += 1
+            return DatasetLease(self, key)
+
+    def refresh(self, key, loader, fingerprint=None):
+        """Reload the entry in place if its source changed; existing leases see the new data"""
+        with self._lock:
+            return self._ensure(key, loader, fingerprint)[0]
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                raise KeyError(f"Dataset {key!r} is not loaded")
+            return entry[0]
+
+    def append(self, key, chunk, table=None):
+        """Swap in a new version of a loaded dataset; leases see it on their next access"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            entry[0], added, merged_rows = entry[0].appended(chunk, table)
+            return added, merged_rows
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self._entries
+
+    def _release(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return
+            entry[1] = max(0, entry[1] - 1)
+            self._evict_idle()
+
+    def _evict_idle(self):
+        idle = [k for k, (_, refs) in self._entries.items() if refs == 0]
+        for k in idle[:max(0, len(idle) - self.max_idle)]:
+            del self._entries[k]
+
+    def stats(self):
+        """key -> (reference count, bytes) for every loaded dataset"""
+        with self._lock:
+            return {k: (refs, ds.nbytes) for k, (ds, refs) in self._entries.items()}
+
+
+registry = DatasetRegistry()
+
+
+def _quick_fingerprint(path):
+    fp = _fingerprint(path, with_hash=False)
+    return fp["mtime_ns"], fp["size"]
+
+
+def dataset_file_source(path):
+    """(key, loader, fingerprint) of a workbook on disk"""
+    path = os.path.abspath(path)
+    return "file:" + path, (lambda: open_table(path)), _quick_fingerprint(path)
+
+
+def dataset_bytes_source(data):
+    """(key, loader, fingerprint) of an uploaded workbook; its content hash is its identity"""
+    digest = hashlib.sha256(data).hexdigest()
+    return "upload:" + digest, (lambda: read_source(io.BytesIO(data))), digest
+
+
+def _prepare_chunk(source, allowed_meters=None):
+    chunk = read_chunk(source)
+    received = len(chunk)
+    chunk, dropped = validate_chunk(chunk, allowed_meters)
+    report = AppendReport(rows_received=received, rows_dropped=dropped, meters=tuple(chunk.columns[1:]))
+    if not chunk.empty:
+        report.first_day = chunk["time"].iloc[0].date()
+        report.last_day = chunk["time"].iloc[-1].date()
+    return chunk, report
+
+
+def append_readings(path, source, cache_dir=None, allowed_meters=None):
+    """
+    Append new readings (DataFrame, CSV or Excel) for any subset of meters to a workbook's dataset:
+    the columnar store is updated on disk and, if the dataset is loaded, the shared
+    copy is swapped for the merged version without reloading the workbook.
+    """
+    chunk, report = _prepare_chunk(source, allowed_meters)
+    if chunk.empty:
+        return report
+    report.rows_added, report.rows_merged = append_to_store(path, chunk, cache_dir)
+    key = dataset_file_source(path)[0]
+    if key in registry:
+        registry.append(key, chunk, open_table(path, cache_dir))
+    return report
+
+
+def append_readings_to(key, source, allowed_meters=None):
+    """Append new readings to a loaded in-memory dataset (e.g. an upload); nothing is persisted"""
+    chunk, report = _prepare_chunk(source, allowed_meters)
+    if chunk.empty:
+        return report
+    result = registry.append(key, chunk)
+    if result is None:
+        raise KeyError(f"Dataset {key!r} is not loaded")
+    report.rows_added, report.rows_merged = result
+    return report
@@ -0,0 +1,141 @@
+# ============================================
+# Directory of monthly / yearly exports, partitioned by month
+# Only the months overlapping the selected date range are read.
+# ============================================
+import os
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+from data_store import SOURCE_EXTENSIONS, ensure_store, load_store_rows, merge_readings
+from time_utils import to_day, date_range_slice
+
+
+def scan_sources(data_dir):
+    """Export files directly inside a directory (Excel / CSV), sorted by name"""
+    names = sorted(os.listdir(data_dir))
+    return [os.path.join(data_dir, n) for n in names
+            if n.lower().endswith(SOURCE_EXTENSIONS) and not n.startswith(("~$", "."))]
+
+
+class PartitionedDataset:
+    """
+    Month-partitioned view over every export file of a directory.
+    - Each file is converted once into its columnar store, whose metadata lists
+      the row range of every month, so the index is built without reading data
+    - load_range() reads only the months overlapping [start, end] (memory-mapped
+      row ranges) and keeps the most recently used months in memory
+    """
+
+    def __init__(self, data_dir, cache_dir=None, max_cached_months=6):
+        self.data_dir = os.path.abspath(data_dir)
+        self.cache_dir = cache_dir
+        self.max_cached_months = max_cached_months
+        self._lock = threading.RLock()
+        self._months = OrderedDict()   # "YYYY-MM" -> DataFrame (LRU)
+        self.rescan()
+
+    def _listing(self):
+        return tuple((p, os.stat(p).st_mtime_ns, os.stat(p).st_size) for p in scan_sources(self.data_dir))
+
+    def rescan(self):
+        """(Re)build the month -> [(file, row slice)] index; cheap when the stores are current"""
+        with self._lock:
+            self.listing = self._listing()
+            index, columns = {}, []
+            for path, _, _ in self.listing:
+                _, meta = ensure_store(path, self.cache_dir)
+                columns += [c for c in meta["columns"] if c not in columns]
+                for month, (lo, hi) in meta.get("months", {}).items():
+                    index.setdefault(month, []).append((path, slice(lo, hi)))
+            self.index = dict(sorted(index.items()))
+            self.columns = columns
+            self._months.clear()
+
+    def is_current(self):
+        """False when a file was added, removed or changed since the last scan"""
+        return self._listing() == self.listing
+
+    @property
+    def months(self):
+        return list(self.index)
+
+    def bounds(self):
+        """(first day, last day) covered by the directory, from the month index"""
+        if not self.index:
+            return None, None
+        first = np.datetime64(self.months[0], "D")
+        last = (np.datetime64(self.months[-1], "M") + 1).astype("datetime64[D]") - 1
+        return pd.Timestamp(first).date(), pd.Timestamp(last).date()
+
+    def default_range(self):
+        """The most recent month: opening the dashboard only loads one partition"""
+        if not self.index:
+            return None, None
+        return pd.Timestamp(np.datetime64(self.months[-1], "D")).date(), self.bounds()[1]
+
+    def months_between(self, start=None, end=None):
+        keys = np.array(self.months, dtype="datetime64[M]")
+        lo = 0 if start is None else int(np.searchsorted(keys, to_day(start).astype("datetime64[M]"), "left"))
+        hi = len(keys) if end is None else int(np.searchsorted(keys, to_day(end).astype("datetime64[M]"), "right"))
+        return self.months[lo:hi]
+
+    def load_month(self, month):
+        """All readings of one month, merged across files and sorted by time"""
+        with self._lock:
+            if month in self._months:
+                self._months.move_to_end(month)
+                return self._months[month]
+        parts = [load_store_rows(path, rows, cache_dir=self.cache_dir) for path, rows in self.index.get(month, [])]
+        if not parts:
+            return pd.DataFrame(columns=["time"] + self.columns)
+        df = parts[0].reindex(columns=["time"] + self.columns)
+        for part in parts[1:]:
+            # Overlapping exports of the same month: later files fill / overwrite earlier ones
+            df, _, _ = merge_readings(df, part)
+        with self._lock:
+            self._months[month] = df
+            while len(self._months) > self.max_cached_months:
+                self._months.popitem(last=False)
+        return df
+
+    def load_range(self, start=None, end=None):
+        """Readings whose day lies in [start, end], reading only the overlapping months"""
+        frames = [self.load_month(m) for m in self.months_between(start, end)]
+        if not frames:
+            return pd.DataFrame(columns=["time"] + self.columns)
+        df = pd.concat(frames, ignore_index=True) if len(frames) > 1 else frames[0]
+        return df.iloc[date_range_slice(df["time"].to_numpy("datetime64[ns]"), start, end)].reset_index(drop=True)
+
+
+_open_lock = threading.Lock()
+_open = {}
+
+
+def open_partitioned(data_dir, cache_dir=None):
+    """Process-wide PartitionedDataset per directory, rescanned when its files change"""
+    key = os.path.abspath(data_dir)
+    with _open_lock:
+        ds = _open.get(key)
+        if ds is None:
+            ds = _open[key] = PartitionedDataset(key, cache_dir)
+        elif not ds.is_current():
+            ds.rescan()
+        return ds
+
+
+def dataset_dir_source(data_dir, start=None, end=None):
+    """
+    (key, loader, fingerprint) for the registry: the whole months of a directory
+    overlapping [start, end]. Sessions looking at the same months share one dataset.
+    """
+    parts = open_partitioned(data_dir)
+    months = parts.months_between(start, end)
+    if not months:
+        return f"dir:{parts.data_dir}|-", (lambda: parts.load_range(start, start)), parts.listing
+    first = np.datetime64(months[0], "D")
+    last = (np.datetime64(months[-1], "M") + 1).astype("datetime64[D]") - 1
+    key = f"dir:{parts.data_dir}|{months[0]}..{months[-1]}"
+    return key, (lambda: parts.load_range(first, last)), parts.listing
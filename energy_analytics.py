@@ -0,0 +1,314 @@
+# ============================================
+# Headless energy analytics
+# Pure functions behind the dashboard pages: load, filter, rollup, rank, KPI
+# and parallel saving. No Streamlit here, so they can run in batch jobs,
+# be profiled, or be cached; the pages only render what these return.
+# ============================================
+import os
+from dataclasses import dataclass, asdict
+from datetime import date, datetime
+from typing import Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+
+from config_equipment import equip_dic, utility_system, equipments
+from data_store import SharedDataset, open_table
+from dataset_partitions import open_partitioned
+from meter_hierarchy import leaf_columns
+from resample_energy import ResampledTable
+from rollups_energy import EnergyRollups
+
+ENERGY_TYPES = ["elec", "water", "steam", "gas"]
+SYSTEM_TYPES = ["all_equipments", "utility_system", "equipments"]
+# Data preview / report column names of the period index
+PERIOD_LABELS = {"time": "Time", "date": "Date", "week_start": "Week Start", "month": "Month"}
+
+
+# ============================================
+# Load / filter
+# ============================================
+def load(path, start=None, end=None, cache_dir=None) -> SharedDataset:
+    """
+    Readings within [start, end] of an export file (memory-mapped store, only
+    the rows of the range are touched) or of a partitioned directory (only the
+    overlapping months are read)
+    """
+    if os.path.isdir(path):
+        parts = open_partitioned(path, cache_dir)
+        df = parts.load_range(start, end)
+        return SharedDataset(f"dir:{parts.data_dir}", df, parts.listing)
+    table = open_table(path, cache_dir)
+    if start is not None or end is not None:
+        table = table.between(start, end)
+    return SharedDataset("file:" + os.path.abspath(path), table)
+
+
+def energy_columns(columns: Iterable[str], energy_filter: Sequence[str],
+                   system_type: Optional[str] = None) -> List[str]:
+    """Meter columns of the selected energy types, optionally limited to one system"""
+    cols = [c for c in columns if c != "time" and any(c.startswith(e) for e in energy_filter)]
+    if system_type == "utility_system":
+        cols = [c for c in cols if c in utility_system]
+    elif system_type == "equipments":
+        cols = [c for c in cols if c in equipments]
+    return cols
+
+
+def filter_readings(dataset: SharedDataset, columns: Sequence[str], start=None, end=None) -> pd.DataFrame:
+    """Raw readings of some meters within [start, end] (no copy of the rows)"""
+    return dataset.slice_dates(start, end)[["time"] + list(columns)]
+
+
+# ============================================
+# Rollups / ranking / KPI
+# ============================================
+def daily_energy(rollups: EnergyRollups, columns: Sequence[str], start=None, end=None) -> pd.DataFrame:
+    """Daily consumption per meter plus a total_energy column (leaf meters only, no double counting)"""
+    daily = rollups.consumption("Daily", columns, start, end)
+    daily["total_energy"] = daily[leaf_columns(columns, daily.sum())].sum(axis=1)
+    return daily
+
+
+def period_table(rollups: EnergyRollups, period: str, columns: Sequence[str], start=None, end=None) -> pd.DataFrame:
+    """Consumption per Daily / Weekly / Monthly period with the period as first column"""
+    table = rollups.consumption(period, columns, start, end).reset_index()
+    return table.rename(columns=PERIOD_LABELS)
+
+
+def interval_energy(resampled: ResampledTable, columns: Sequence[str], start=None, end=None) -> pd.DataFrame:
+    """Consumption per fixed-interval slot plus a total_energy column (leaf meters only)"""
+    slots = resampled.consumption(columns, start, end)
+    slots["total_energy"] = slots[leaf_columns(columns, slots.sum())].sum(axis=1, min_count=1)
+    return slots
+
+
+def interval_table(resampled: ResampledTable, columns: Sequence[str], start=None, end=None) -> pd.DataFrame:
+    """Consumption per 1 min / 15 min / hourly slot with the slot start as first column"""
+    return resampled.consumption(columns, start, end).reset_index().rename(columns=PERIOD_LABELS)
+
+
+def load_profile(resampled: ResampledTable, columns: Sequence[str], start=None, end=None) -> pd.DataFrame:
+    """Average load per slot of the day of each meter plus total_load (leaf meters only)"""
+    profile = resampled.load_profile(columns, start, end)
+    profile["total_load"] = profile[leaf_columns(columns, profile.sum())].sum(axis=1, min_count=1)
+    return profile
+
+
+def peak_demand(resampled: ResampledTable, columns: Sequence[str], start=None, end=None) -> pd.DataFrame:
+    """Peak slot load and its time per meter; the "total" row is the coincident peak of the leaf meters"""
+    peaks = resampled.peak_demand(columns, start, end).drop(index="total")
+    totals = resampled.consumption(columns, start, end).sum()
+    site = resampled.peak_demand(leaf_columns(columns, totals), start, end).loc[["total"]]
+    return pd.concat([peaks, site])
+
+
+def rank_devices(rollups: EnergyRollups, columns: Sequence[str], start=None, end=None) -> pd.Series:
+    """Total consumption per meter within the range, largest first"""
+    return rollups.cumulative.totals(columns, start, end).sort_values(ascending=False)
+
+
+def data_quality(rollups: EnergyRollups, columns: Sequence[str], start=None, end=None) -> pd.DataFrame:
+    """Days per quality flag (gap, reset, ...) of the meters with any flagged day in the range"""
+    quality = rollups.level("D").slice(start, end).quality(columns)
+    quality = quality[quality.sum(axis=1) > 0]
+    quality.insert(0, "name", [equip_dic.get(c, c) for c in quality.index])
+    return quality
+
+
+@dataclass
+class EnergyKPI:
+    total_energy: float
+    avg_daily: float
+    n_days: int
+    top_device: Optional[str]
+    top_device_name: Optional[str]
+    top_value: float
+
+    def as_dict(self):
+        return asdict(self)
+
+
+def kpis(rollups: EnergyRollups, columns: Sequence[str], start=None, end=None) -> EnergyKPI:
+    """
+    Total, average daily and top consuming device of the selected leaf meters;
+    no top device when nothing was consumed in the range
+    """
+    totals = rollups.cumulative.totals(columns, start, end)
+    ranked = totals[leaf_columns(columns, totals)].sort_values(ascending=False)
+    n_days = rollups.cumulative.n_days(start, end)
+    total = float(ranked.sum())
+    top = ranked.index[0] if (ranked > 0).any() else None
+    return EnergyKPI(
+        total_energy=total,
+        avg_daily=total / n_days if n_days else float("nan"),
+        n_days=n_days,
+        top_device=top,
+        top_device_name=None if top is None else equip_dic.get(top, top),
+        top_value=float(ranked.iloc[0]) if top is not None else float("nan"),
+    )
+
+
+# ============================================
+# Process parallel saving
+# ============================================
+def parse_equips(equip_str) -> List[str]:
+    """Parse the device field into a list"""
+    if not equip_str or str(equip_str).strip() == "":
+        return ["<Unnamed device>"]
+    parts = [p.strip() for p in str(equip_str).replace("，", ",").split(",") if p.strip()]
+    return parts or ["<Unnamed device>"]
+
+
+def process_day(p) -> Optional[date]:
+    """Calendar day of a process (process_date, else the day of its start time)"""
+    for value in (p.process_date, p.start_time):
+        if isinstance(value, datetime):   # also pd.Timestamp
+            return value.date()
+        if isinstance(value, date):
+            return value
+    return None
+
+
+def _interval(p) -> Optional[Tuple[pd.Timestamp, pd.Timestamp]]:
+    s = pd.to_datetime(p.start_time, errors="coerce")
+    e = pd.to_datetime(p.end_time, errors="coerce")
+    if pd.isna(s) or pd.isna(e) or e <= s:
+        return None
+    return s, e
+
+
+def equipment_hours(processes) -> dict:
+    """
+    Total hours per device. A process using several devices counts
+    towards each of them (the same device cannot run two processes at once).
+    """
+    hours = {}
+    for p in processes:
+        iv = _interval(p)
+        if iv is None:
+            continue
+        dur_h = (iv[1] - iv[0]).total_seconds() / 3600
+        for equip in parse_equips(getattr(p, "equipments", "")):
+            hours[equip] = hours.get(equip, 0.0) + dur_h
+    return hours
+
+
+@dataclass
+class ProcessArrays:
+    """Columnar view of a process list, one entry per process (times parsed once)"""
+    days: np.ndarray          # datetime64[D], NaT when unknown
+    starts: np.ndarray        # datetime64[ns]
+    ends: np.ndarray          # datetime64[ns]
+    equips: List[List[str]]   # parse_equips() of every process
+
+    @classmethod
+    def from_processes(cls, processes):
+        processes = list(processes)
+
+        def times(attr):
+            values = pd.Series([getattr(p, attr, None) for p in processes], dtype=object)
+            return pd.to_datetime(values, errors="coerce").to_numpy("datetime64[ns]")
+
+        starts, ends = times("start_time"), times("end_time")
+        days = times("process_date").astype("datetime64[D]")
+        # like process_day(): fall back to the day of the start time
+        days = np.where(np.isnat(days), starts.astype("datetime64[D]"), days)
+        equips = [parse_equips(getattr(p, "equipments", "")) for p in processes]
+        return cls(days, starts, ends, equips)
+
+    def __len__(self):
+        return len(self.days)
+
+    @property
+    def valid(self):
+        """Processes with a day and a positive duration"""
+        return ~np.isnat(self.days) & ~np.isnat(self.starts) & ~np.isnat(self.ends) & (self.ends > self.starts)
+
+
+def day_hours(arrays: ProcessArrays) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    (days, union hours, max per-equipment hours) of the valid processes, in one
+    sorted pass: interval unions from a per-day running max of end times, busy
+    hours per (day, equipment) from one bincount.
+    """
+    rows = np.flatnonzero(arrays.valid)
+    day = arrays.days[rows]
+    start = arrays.starts[rows].view("int64")
+    end = arrays.ends[rows].view("int64")
+    order = np.lexsort((start, day))
+    rows, day, start, end = rows[order], day[order], start[order], end[order]
+    days, g = np.unique(day, return_inverse=True)
+    if len(days) == 0:
+        return days, np.zeros(0), np.zeros(0)
+
+    # Union: a new merged interval starts where a start lies after every earlier end of the day
+    run_end = pd.Series(end).groupby(g).cummax().to_numpy()
+    new_day = np.r_[True, g[1:] != g[:-1]]
+    seg = np.flatnonzero(new_day | (start > np.r_[0, run_end[:-1]]))
+    seg_last = np.r_[seg[1:], len(start)] - 1
+    union_h = np.bincount(g[seg], weights=run_end[seg_last] - start[seg], minlength=len(days)) / 3.6e12
+
+    # Busy hours per (day, equipment); a process counts towards each of its devices
+    equips = [arrays.equips[i] for i in rows]
+    counts = np.fromiter(map(len, equips), dtype=np.int64, count=len(equips))
+    codes, names = pd.factorize(pd.Index([e for eq in equips for e in eq], dtype=object))
+    cell = np.repeat(g, counts) * len(names) + codes
+    busy = np.bincount(cell, weights=np.repeat((end - start) / 3.6e12, counts),
+                       minlength=len(days) * len(names)).reshape(len(days), len(names))
+    return days, union_h, busy.max(axis=1)
+
+
+def day_energy(energy_rollups: EnergyRollups, utility_cols: Sequence[str]) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """(days, utility consumption, total electricity of the leaf meters) per day, straight from the daily rollup"""
+    daily = energy_rollups.level("D")
+    use = daily.stats["use"]
+    util = [daily.col_pos[c] for c in utility_cols if c in daily.col_pos]
+    elec_cols = energy_columns(daily.columns, ["elec"])
+    totals = dict(zip(elec_cols, np.nansum(use[:, [daily.col_pos[c] for c in elec_cols]], axis=0)))
+    elec = [daily.col_pos[c] for c in leaf_columns(elec_cols, totals)]
+    return daily.keys, np.nansum(use[:, util], axis=1), np.nansum(use[:, elec], axis=1)
+
+
+def compute_parallel_saving_by_day(processes, energy_rollups: Optional[EnergyRollups],
+                                   utility_cols: Sequence[str]) -> Tuple[pd.DataFrame, float]:
+    """
+    - Parallel duration: The union length of all process time periods within a day (ignoring equipment constraints)
+    - Fully parallel duration: When the same equipment cannot be concurrently operated → Add up the process durations of each equipment for the day; Optimized duration = The maximum value of the total durations of all equipment
+    - Energy saving rate = 1 - (Fully parallel / Original parallel)
+    - Utility system energy consumption: daily consumption from the delta engine, read from the daily rollups
+    `processes` is a list of Process or a ProcessArrays; days without energy data are skipped.
+    """
+    if energy_rollups is None or len(energy_rollups.level("D")) == 0:
+        return pd.DataFrame(), 0.0
+    if not any(c in energy_rollups.columns for c in utility_cols):
+        return pd.DataFrame(), 0.0
+    arrays = processes if isinstance(processes, ProcessArrays) else ProcessArrays.from_processes(processes)
+    days, original_hours, optimized_hours = day_hours(arrays)
+
+    # Join against the per-day energy table by binary search
+    keys, public_kwh, total_kwh = day_energy(energy_rollups, utility_cols)
+    pos = np.minimum(np.searchsorted(keys, days), max(len(keys) - 1, 0))
+    hit = keys[pos] == days
+    days, original_hours, optimized_hours = days[hit], original_hours[hit], optimized_hours[hit]
+    public_kwh, total_kwh = public_kwh[pos[hit]], total_kwh[pos[hit]]
+    if len(days) == 0:
+        return pd.DataFrame(), 0.0
+
+    # Energy-saving conversion
+    ratio = np.maximum(0.0, 1.0 - optimized_hours / original_hours)
+    saving_kwh = public_kwh * ratio
+    public_ratio = np.divide(public_kwh * 100.0, total_kwh, out=np.zeros_like(total_kwh), where=total_kwh > 0)
+
+    result = pd.DataFrame({
+        "date": days.astype(object),
+        "Original parallel duration(h)": original_hours.round(2),
+        "Total parallel duration(h)": optimized_hours.round(2),
+        "Total parallel duration(%)": (ratio * 100.0).round(2),
+        "Energy consumption of public system(kWh)": public_kwh.round(2),
+        "Total plant energy consumption(kWh)": total_kwh.round(2),
+        "The proportion of public systems(%)": public_ratio.round(2),
+        "Save electricity(kWh)": saving_kwh.round(2),
+        "Optimized expected energy consumption(kWh)": (public_kwh - saving_kwh).round(2),
+    })
+    return result, float(saving_kwh.sum())
@@ -0,0 +1,237 @@
+# ============================================
+# Electricity cost engine: time-of-use prices + monthly demand charge
+# Works on the per-interval deltas of the cumulative elec* meters:
+#   - every interval is priced with the band (sharp/peak/flat/valley) of its start
+#   - demand = average kW per 15-minute block, the billed value is the month's
+#     highest block of the site (sum of the leaf meters, see meter_hierarchy)
+# All steps are array operations over (intervals x meters).
+# ============================================
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Sequence
+
+import numpy as np
+import pandas as pd
+
+from config_equipment import utility_system, equipments
+from config_tariff import TARIFFS, DEFAULT_TARIFF
+from meter_deltas import meter_deltas
+from meter_hierarchy import leaf_columns
+from models_energy import EnergyTable
+
+SLOT_MINUTES = 15
+SLOTS_PER_DAY = 24 * 60 // SLOT_MINUTES
+DEMAND_MINUTES = 15
+# Cost rollup groups; the rest are main / section meters (elec32-38)
+COST_GROUPS = {"utility_system": utility_system, "equipments": equipments}
+# Group of the meters measured again by their sub-meters (not part of the site)
+NOT_ADDITIVE = "main meters (not additive)"
+
+
+@dataclass
+class Tariff:
+    name: str
+    prices: Dict[str, float]                 # band -> yuan/kWh
+    demand_charge: float                     # yuan per kW of the month's peak
+    calendars: Dict[str, list]               # calendar -> [(start, end, band), ...]
+    months: Dict[int, str]                   # month (1-12) -> calendar, default "standard"
+    weekend_calendar: Optional[str] = None
+
+    @classmethod
+    def from_config(cls, name=DEFAULT_TARIFF):
+        return cls(name=name, **TARIFFS[name])
+
+    @property
+    def bands(self) -> List[str]:
+        return list(self.prices)
+
+    def _calendar_slots(self, name):
+        """Band code of every 15-minute slot of a day"""
+        slots = np.full(SLOTS_PER_DAY, -1, dtype=np.int8)
+        for start, end, band in self.calendars[name]:
+            if band not in self.prices:
+                raise ValueError(f"Tariff {self.name!r}: calendar {name!r} uses unpriced band {band!r}")
+            lo, hi = (int(h) * 60 // SLOT_MINUTES + int(m) // SLOT_MINUTES
+                      for h, m in (start.split(":"), end.split(":")))
+            slots[lo:hi] = self.bands.index(band)
+        if (slots < 0).any():
+            raise ValueError(f"Tariff {self.name!r}: calendar {name!r} does not cover the whole day")
+        return slots
+
+    def slot_table(self) -> np.ndarray:
+        """Band codes as (month 0-11, weekday/weekend, slot of day)"""
+        table = np.empty((12, 2, SLOTS_PER_DAY), dtype=np.int8)
+        for month in range(12):
+            weekday = self._calendar_slots(self.months.get(month + 1, "standard"))
+            table[month, 0] = weekday
+            table[month, 1] = self._calendar_slots(self.weekend_calendar) if self.weekend_calendar else weekday
+        return table
+
+    def band_codes(self, times) -> np.ndarray:
+        """Band code of each timestamp (datetime64[ns])"""
+        times = np.asarray(times, dtype="datetime64[ns]")
+        days = times.astype("datetime64[D]")
+        slot = (times - days).astype("timedelta64[m]").astype(np.int64) // SLOT_MINUTES
+        month = times.astype("datetime64[M]").astype(np.int64) % 12
+        weekend = ((days.astype(np.int64) + 3) % 7 >= 5).astype(np.int64)   # 1970-01-01 was a Thursday
+        return self.slot_table()[month, weekend, slot]
+
+
+def meter_group(meter):
+    for group, meters in COST_GROUPS.items():
+        if meter in meters:
+            return group
+    return "main meters"
+
+
+def interval_deltas(table: EnergyTable, columns: Sequence[str]):
+    """
+    (interval starts, interval hours, kWh matrix intervals x meters) from the
+    delta engine: resets, rollovers and dropouts are corrected, missing
+    readings interpolated in time.
+    """
+    return meter_deltas(table, columns).intervals()
+
+
+def _runs(keys):
+    """Start index of every run of equal values in a sorted key array"""
+    if len(keys) == 0:
+        return np.empty(0, dtype=np.int64)
+    return np.flatnonzero(np.r_[True, keys[1:] != keys[:-1]])
+
+
+@dataclass
+class CostBreakdown:
+    tariff: Tariff
+    meters: List[str]
+    days: np.ndarray             # datetime64[D]
+    day_kwh: np.ndarray          # days x bands x meters
+    day_peak_kw: np.ndarray      # days x meters, highest 15-minute block
+    day_site_peak_kw: np.ndarray # days, highest 15-minute block of the site
+    months: np.ndarray           # datetime64[M]
+    month_peak_kw: np.ndarray    # months x meters, each meter's own peak
+    site_peak_kw: np.ndarray     # months, billed demand
+    site_peak_time: np.ndarray   # months, datetime64[ns] start of the peak block
+    coincident_kw: np.ndarray    # months x meters, load at the site peak
+
+    @property
+    def prices(self):
+        return np.array([self.tariff.prices[b] for b in self.tariff.bands])
+
+    @property
+    def site(self):
+        """Column mask of the meters billed as the site (leaf meters)"""
+        totals = dict(zip(self.meters, self.day_kwh.sum(axis=(0, 1))))
+        return np.isin(self.meters, leaf_columns(self.meters, totals))
+
+    def energy_cost(self):
+        """days x meters"""
+        return np.einsum("dbm,b->dm", self.day_kwh, self.prices)
+
+    def by_meter(self) -> pd.DataFrame:
+        """
+        kWh, energy charge, own peak and share of the demand charge (load at the
+        site peak) per meter. Meters outside the site are in the NOT_ADDITIVE
+        group: their load is already counted by the meters below them.
+        """
+        demand_cost = self.coincident_kw.sum(axis=0) * self.tariff.demand_charge
+        energy_cost = self.energy_cost().sum(axis=0)
+        df = pd.DataFrame({
+            "group": [meter_group(m) if site else NOT_ADDITIVE for m, site in zip(self.meters, self.site)],
+            "kWh": self.day_kwh.sum(axis=(0, 1)),
+            "energy cost": energy_cost,
+            "peak kW": self.month_peak_kw.max(axis=0, initial=0.0),
+            "demand cost": np.where(self.site, demand_cost, 0.0),
+        }, index=pd.Index(self.meters, name="meter"))
+        df["total cost"] = df["energy cost"] + df["demand cost"]
+        return df
+
+    def by_group(self) -> pd.DataFrame:
+        """Cost per group; the groups add up to totals() except the NOT_ADDITIVE row, listed last"""
+        df = self.by_meter().groupby("group").agg({"kWh": "sum", "energy cost": "sum", "peak kW": "max",
+                                                   "demand cost": "sum", "total cost": "sum"})
+        df = df.sort_values("total cost", ascending=False)
+        return pd.concat([df.drop(index=NOT_ADDITIVE, errors="ignore"), df.loc[df.index == NOT_ADDITIVE]])
+
+    def by_day(self, columns: Optional[Sequence[str]] = None) -> pd.DataFrame:
+        """kWh and cost per band, plus the day's peak, for some meters (default: the site)"""
+        mask = self.site if columns is None else np.isin(self.meters, list(columns))
+        kwh = self.day_kwh[:, :, mask].sum(axis=2)
+        df = pd.DataFrame(kwh, columns=[f"{b} kWh" for b in self.tariff.bands],
+                          index=pd.Index(self.days.astype("datetime64[ns]"), name="date"))
+        df["kWh"] = kwh.sum(axis=1)
+        df["energy cost"] = kwh @ self.prices
+        if columns is None:
+            df["peak kW"] = self.day_site_peak_kw
+        else:
+            df["peak kW"] = self.day_peak_kw[:, mask].sum(axis=1)   # upper bound when meters peak apart
+        return df
+
+    def demand(self) -> pd.DataFrame:
+        """Billed demand per month"""
+        return pd.DataFrame({
+            "peak kW": self.site_peak_kw,
+            "peak at": self.site_peak_time,
+            "demand cost": self.site_peak_kw * self.tariff.demand_charge,
+        }, index=pd.Index(self.months.astype("datetime64[ns]"), name="month"))
+
+    def totals(self) -> dict:
+        energy = float(self.energy_cost()[:, self.site].sum())
+        demand = float(self.site_peak_kw.sum() * self.tariff.demand_charge)
+        return {"kWh": float(self.day_kwh[:, :, self.site].sum()), "energy cost": energy,
+                "demand cost": demand, "total cost": energy + demand,
+                "peak kW": float(self.site_peak_kw.max(initial=0.0))}
+
+
+def compute_costs(data, tariff: Optional[Tariff] = None, columns: Optional[Sequence[str]] = None) -> CostBreakdown:
+    """
+    Cost breakdown of the elec meters of an EnergyTable (or a frame with a
+    "time" column), sorted by time. Demand charges cover the months the data
+    touches, whole or not.
+    """
+    table = data if isinstance(data, EnergyTable) else EnergyTable.from_frame(data)
+    tariff = tariff or Tariff.from_config()
+    meters = [c for c in (columns or table.columns) if c.startswith("elec") and c in table.columns]
+    starts, hours, kwh = interval_deltas(table, meters)
+    n_bands = len(tariff.bands)
+
+    # Energy: runs of (day, band) -> one reduceat, then into the day x band grid
+    days_of = starts.astype("datetime64[D]")
+    days, day_idx = np.unique(days_of, return_inverse=True)
+    key = day_idx * n_bands + tariff.band_codes(starts)
+    runs = _runs(key)
+    day_kwh = np.zeros((len(days) * n_bands, len(meters)))
+    if len(runs):
+        np.add.at(day_kwh, key[runs], np.add.reduceat(kwh, runs, axis=0))
+    day_kwh = day_kwh.reshape(len(days), n_bands, len(meters))
+
+    # Demand: average kW per 15-minute block (a longer interval is its own block)
+    block = starts.astype(np.int64) // (DEMAND_MINUTES * 60 * 10**9)
+    bruns = _runs(block)
+    block_kwh = np.add.reduceat(kwh, bruns, axis=0) if len(bruns) else np.zeros((0, len(meters)))
+    block_h = np.add.reduceat(hours, bruns) if len(bruns) else np.zeros(0)
+    block_kw = block_kwh / np.maximum(block_h, DEMAND_MINUTES / 60)[:, None]
+    block_start = starts[bruns]
+
+    site = np.isin(meters, leaf_columns(meters, dict(zip(meters, np.nansum(kwh, axis=0)))))
+    site_kw = block_kw[:, site].sum(axis=1)
+
+    block_day = np.searchsorted(days, block_start.astype("datetime64[D]"))
+    druns = _runs(block_day)
+    day_peak_kw = np.zeros((len(days), len(meters)))
+    day_site_peak_kw = np.zeros(len(days))
+    if len(druns):
+        day_peak_kw[block_day[druns]] = np.maximum.reduceat(block_kw, druns, axis=0)
+        day_site_peak_kw[block_day[druns]] = np.maximum.reduceat(site_kw, druns)
+
+    block_month = block_start.astype("datetime64[M]")
+    mruns = _runs(block_month)
+    months = block_month[mruns]
+    month_peak_kw = np.maximum.reduceat(block_kw, mruns, axis=0) if len(mruns) else np.zeros((0, len(meters)))
+    bounds = np.r_[mruns, len(block_kw)]
+    peak_rows = np.array([lo + int(np.argmax(site_kw[lo:hi])) for lo, hi in zip(bounds[:-1], bounds[1:])],
+                         dtype=np.int64)
+    site_peak_kw = site_kw[peak_rows]
+    coincident_kw = block_kw[peak_rows] * site
+
+    return CostBreakdown(tariff, meters, days, day_kwh, day_peak_kw, day_site_peak_kw, months, month_peak_kw,
+                         site_peak_kw, block_start[peak_rows], coincident_kw)
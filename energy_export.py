@@ -0,0 +1,120 @@
+# ============================================
+# Streaming export of the selected readings
+# Rows are written chunk by chunk into a spooled buffer (memory first, a
+# private temp file once it grows), so every request gets its own output
+# and the work scales with the exported rows, not with the whole dataset.
+# ============================================
+import importlib.util
+import tempfile
+from dataclasses import dataclass
+from typing import Optional, Sequence
+
+import pandas as pd
+
+from energy_analytics import period_table, interval_table
+from resample_energy import RESOLUTIONS
+
+# label -> (file extension, MIME type)
+EXPORT_FORMATS = {
+    "Excel": ("xlsx", "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"),
+    "CSV": ("csv", "text/csv"),
+    "Parquet": ("parquet", "application/vnd.apache.parquet"),
+}
+CHUNK_ROWS = 20_000
+SPOOL_BYTES = 32 * 1024 * 1024   # kept in memory up to this size
+
+
+@dataclass
+class ExportFile:
+    buffer: tempfile.SpooledTemporaryFile   # positioned at 0
+    file_name: str
+    mime: str
+    rows: int
+
+    def read(self):
+        """The whole file as bytes; closes the buffer"""
+        with self.buffer:
+            return self.buffer.read()
+
+
+def available_formats():
+    """Export formats usable here (Parquet needs pyarrow)"""
+    return [f for f in EXPORT_FORMATS if f != "Parquet" or importlib.util.find_spec("pyarrow")]
+
+
+def _chunks(frame, columns, chunk_rows):
+    """Row blocks of the selected columns; only one block is copied at a time"""
+    for lo in range(0, len(frame), chunk_rows):
+        yield frame.iloc[lo:lo + chunk_rows][columns]
+
+
+def _write_csv(frame, columns, out, chunk_rows):
+    out.write(frame.iloc[:0][columns].to_csv(index=False).encode("utf-8"))
+    for chunk in _chunks(frame, columns, chunk_rows):
+        out.write(chunk.to_csv(index=False, header=False).encode("utf-8"))
+
+
+def _write_parquet(frame, columns, out, chunk_rows):
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    # Schema from the first rows: an empty object column (dates) would infer as null
+    schema = pa.Schema.from_pandas(frame.iloc[:chunk_rows][columns], preserve_index=False)
+    with pq.ParquetWriter(out, schema) as writer:
+        for chunk in _chunks(frame, columns, chunk_rows):
+            writer.write_table(pa.Table.from_pandas(chunk, schema=schema, preserve_index=False))
+
+
+def _write_xlsx(frame, columns, out, chunk_rows):
+    from openpyxl import Workbook
+
+    # write-only workbook: rows are serialized as they are appended
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet("energy_data")
+    ws.append([str(c) for c in columns])
+    for chunk in _chunks(frame, columns, chunk_rows):
+        values = chunk.astype(object).where(chunk.notna(), None)
+        for row in values.itertuples(index=False, name=None):
+            ws.append(row)
+    wb.save(out)
+
+
+WRITERS = {"csv": _write_csv, "parquet": _write_parquet, "xlsx": _write_xlsx}
+
+
+def write_export(frame, fmt, columns=None, chunk_rows=CHUNK_ROWS):
+    """Spooled buffer holding `frame` (or some of its columns) in one of EXPORT_FORMATS (label or extension)"""
+    ext = EXPORT_FORMATS[fmt][0] if fmt in EXPORT_FORMATS else fmt
+    columns = list(frame.columns if columns is None else columns)
+    out = tempfile.SpooledTemporaryFile(max_size=SPOOL_BYTES)
+    try:
+        WRITERS[ext](frame, columns, out, chunk_rows)
+    except BaseException:
+        out.close()
+        raise
+    out.seek(0)
+    return out
+
+
+def export_selection(readings, rollups, columns: Sequence[str], start=None, end=None,
+                     fmt="Excel", period: Optional[str] = None, chunk_rows=CHUNK_ROWS,
+                     resampled=None) -> ExportFile:
+    """
+    Export of the selected meters and date range.
+    - period None: the raw readings (`readings` is the date-range view of the dataset)
+    - "1 min" / "15 min" / "Hourly": consumption per slot, read from `resampled`
+      (the dataset's ResampledTable at that resolution)
+    - "Daily" / "Weekly" / "Monthly": consumption per period, read from the rollups
+    """
+    ext, mime = EXPORT_FORMATS[fmt]
+    if period is None:
+        frame, columns, suffix = readings, ["time"] + list(columns), ""
+    elif period in RESOLUTIONS:
+        frame = interval_table(resampled, columns, start, end)
+        columns, suffix = None, f"_{period.lower().replace(' ', '')}"
+    else:
+        frame = period_table(rollups, period, columns, start, end)
+        columns, suffix = None, f"_{period.lower()}"
+    span = "" if start is None or end is None else f"_{pd.Timestamp(start):%Y%m%d}-{pd.Timestamp(end):%Y%m%d}"
+    buffer = write_export(frame, ext, columns, chunk_rows)
+    return ExportFile(buffer, f"energy_data{span}{suffix}.{ext}", mime, len(frame))
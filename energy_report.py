@@ -0,0 +1,252 @@
+# ============================================
+# Batch energy report generator (command line)
+# Produces the dashboard numbers without a browser: KPI summary, per-meter
+# daily table, device ranking and parallel-saving table, per site and / or
+# per month, written as CSV / Parquet / XLSX.
+#
+#   python energy_report.py DATA_DIR --start 2024-01-01 --end 2024-07-31 \
+#       --energy elec water --system utility_system --format csv xlsx \
+#       --split month --workers 4 --out reports
+# ============================================
+import os
+import sys
+import argparse
+import importlib.util
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from typing import List, Optional
+
+import numpy as np
+import pandas as pd
+
+import energy_analytics as ea
+from config_equipment import equip_dic, utility_system
+from data_store import ensure_store
+from dataset_partitions import open_partitioned, scan_sources
+from process_table import import_schedule
+from rollups_energy import EnergyRollups
+from time_utils import to_day, date_range_slice
+
+FORMATS = ("csv", "parquet", "xlsx")
+SPLITS = ("none", "month")
+
+
+@dataclass
+class ReportJob:
+    label: str                     # output sub-folder, e.g. "site_a/2024-01"
+    source: str                    # export file or partitioned directory
+    start: Optional[str]
+    end: Optional[str]
+    energy: List[str]
+    system: Optional[str]
+    formats: List[str]
+    out_dir: str
+    processes: Optional[ea.ProcessArrays] = None
+
+
+# ============================================
+# Job planning
+# ============================================
+def find_sites(data_path):
+    """
+    (site name, source) pairs. A directory whose sub-folders hold exports is a
+    set of sites; otherwise the path itself (file or directory) is one site.
+    """
+    if os.path.isdir(data_path):
+        subdirs = sorted(d for d in os.listdir(data_path)
+                         if os.path.isdir(os.path.join(data_path, d)) and not d.startswith("."))
+        sites = [(d, os.path.join(data_path, d)) for d in subdirs if scan_sources(os.path.join(data_path, d))]
+        if sites:
+            return sites
+    name = os.path.splitext(os.path.basename(os.path.normpath(data_path)))[0]
+    return [(name, data_path)]
+
+
+def source_months(source, start=None, end=None):
+    """"YYYY-MM" keys of a source overlapping [start, end], read from the store metadata"""
+    if os.path.isdir(source):
+        return open_partitioned(source).months_between(start, end)
+    _, meta = ensure_store(source)
+    months = sorted(meta.get("months", {}))
+    lo = None if start is None else str(to_day(start).astype("datetime64[M]"))
+    hi = None if end is None else str(to_day(end).astype("datetime64[M]"))
+    return [m for m in months if (lo is None or m >= lo) and (hi is None or m <= hi)]
+
+
+def _clip_month(month, start, end):
+    """[start, end] limited to one month, as ISO day strings"""
+    first = np.datetime64(month, "D")
+    last = (np.datetime64(month, "M") + 1).astype("datetime64[D]") - 1
+    if start is not None:
+        first = max(first, to_day(start))
+    if end is not None:
+        last = min(last, to_day(end))
+    return str(first), str(last)
+
+
+def plan_jobs(args, processes=None):
+    jobs = []
+    for site, source in find_sites(args.data):
+        common = dict(energy=args.energy, system=args.system, formats=args.format, processes=processes)
+        if args.split == "month":
+            for month in source_months(source, args.start, args.end):
+                start, end = _clip_month(month, args.start, args.end)
+                jobs.append(ReportJob(f"{site}/{month}", source, start, end,
+                                      out_dir=os.path.join(args.out, site, month), **common))
+        else:
+            jobs.append(ReportJob(site, source, args.start, args.end,
+                                  out_dir=os.path.join(args.out, site), **common))
+    return jobs
+
+
+@dataclass
+class SourceRollups:
+    """Rollups of a whole source, plus its readings per day"""
+    rollups: EnergyRollups
+    days: np.ndarray          # datetime64[D] days with readings
+    day_rows: np.ndarray      # readings per day
+
+    @classmethod
+    def load(cls, source):
+        """Rollups over the full memory-mapped store (or every partition), so jobs share the range edges"""
+        dataset = ea.load(source)
+        days, day_rows = np.unique(dataset.table.timestamps.astype("datetime64[D]"), return_counts=True)
+        return cls(dataset.rollups, days, day_rows)
+
+    def rows(self, start=None, end=None):
+        return int(self.day_rows[date_range_slice(self.days, start, end)].sum())
+
+
+# ============================================
+# One report
+# ============================================
+def build_report(rollups, energy, system=None, start=None, end=None, processes=None):
+    """Report tables (name -> DataFrame) of [start, end] of some rollups, the same numbers as the dashboard"""
+    cols = ea.energy_columns(rollups.columns, energy, system)
+    if not cols:
+        raise ValueError(f"No meters for energy types {energy} / system {system}")
+    kpi = ea.kpis(rollups, cols, start, end)
+    ranking = ea.rank_devices(rollups, cols, start, end).rename("energy").rename_axis("meter").reset_index()
+    ranking.insert(1, "name", ranking["meter"].map(lambda m: equip_dic.get(m, m)))
+    tables = {
+        "summary": pd.DataFrame([kpi.as_dict()]),
+        "daily": ea.daily_energy(rollups, cols, start, end).reset_index(),
+        "ranking": ranking,
+    }
+    if processes is not None:
+        tables["parallel_saving"], _ = ea.compute_parallel_saving_by_day(processes, rollups, utility_system)
+    return tables
+
+
+def write_report(tables, out_dir, formats):
+    """One file per table for CSV / Parquet, one workbook with a sheet per table for XLSX"""
+    os.makedirs(out_dir, exist_ok=True)
+    written = []
+    for fmt in formats:
+        if fmt == "xlsx":
+            path = os.path.join(out_dir, "report.xlsx")
+            with pd.ExcelWriter(path, engine="openpyxl") as writer:
+                for name, table in tables.items():
+                    table.to_excel(writer, sheet_name=name, index=False)
+            written.append(path)
+            continue
+        for name, table in tables.items():
+            path = os.path.join(out_dir, f"{name}.{fmt}")
+            if fmt == "csv":
+                table.to_csv(path, index=False)
+            else:
+                table.to_parquet(path, index=False)
+            written.append(path)
+    return written
+
+
+# Per-worker read-only state (source -> SourceRollups), set once by the pool initializer
+_sources = {}
+
+
+def _init_worker(sources):
+    _sources.update(sources)
+
+
+def source_rollups(source) -> SourceRollups:
+    """Rollups of a source, built on first use"""
+    if source not in _sources:
+        _sources[source] = SourceRollups.load(source)
+    return _sources[source]
+
+
+def run_job(job):
+    """
+    Worker entry point: slices the rollups of the job's source (built once
+    over the whole source), so a month's first and last day still count the
+    interval across the month edge. Returns the KPI row of the job.
+    """
+    source = source_rollups(job.source)
+    rows = source.rows(job.start, job.end)
+    if rows == 0:
+        return {"report": job.label, "rows": 0}
+    tables = build_report(source.rollups, job.energy, job.system, job.start, job.end, job.processes)
+    write_report(tables, job.out_dir, job.formats)
+    return {"report": job.label, "rows": rows, **tables["summary"].iloc[0].to_dict()}
+
+
+# ============================================
+# Command line
+# ============================================
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Generate energy reports without the dashboard.")
+    parser.add_argument("data", help="export file, directory of exports, or directory of site folders")
+    parser.add_argument("--start", help="first day (YYYY-MM-DD), default: first day of the data")
+    parser.add_argument("--end", help="last day (YYYY-MM-DD), default: last day of the data")
+    parser.add_argument("--energy", nargs="+", choices=ea.ENERGY_TYPES, default=["elec"])
+    parser.add_argument("--system", choices=ea.SYSTEM_TYPES, default="all_equipments")
+    parser.add_argument("--format", nargs="+", choices=FORMATS, default=["csv"])
+    parser.add_argument("--split", choices=SPLITS, default="none", help="one report per site, or per site and month")
+    parser.add_argument("--processes", help="CSV / Excel of process records for the parallel-saving table")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--out", default="reports")
+    args = parser.parse_args(argv)
+
+    if not os.path.exists(args.data):
+        parser.error(f"{args.data} does not exist")
+    if "parquet" in args.format and not (importlib.util.find_spec("pyarrow") or importlib.util.find_spec("fastparquet")):
+        parser.error("--format parquet needs pyarrow or fastparquet installed")
+    if args.system == "equipments" and any(e != "elec" for e in args.energy):
+        parser.error("workshop equipments only support --energy elec")
+    return args
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    processes = None
+    if args.processes:
+        table, report = import_schedule(args.processes)
+        if report.rows_rejected:
+            print(f"{report.rows_rejected} of {report.rows_read} process rows rejected:")
+            print(report.errors.to_string(index=False))
+        processes = table.arrays()
+    jobs = plan_jobs(args, processes)
+    if not jobs:
+        print("No data in the selected range.")
+        return 1
+
+    if args.workers > 1 and len(jobs) > 1:
+        # Rollups are built up front, once per source, and handed to each worker once
+        sources = {source: source_rollups(source) for source in dict.fromkeys(job.source for job in jobs)}
+        with ProcessPoolExecutor(max_workers=min(args.workers, len(jobs)), initializer=_init_worker,
+                                 initargs=(sources,)) as pool:
+            rows = list(pool.map(run_job, jobs))
+    else:
+        rows = [run_job(job) for job in jobs]
+
+    index = pd.DataFrame(rows)
+    os.makedirs(args.out, exist_ok=True)
+    index.to_csv(os.path.join(args.out, "index.csv"), index=False)
+    for row in rows:
+        total = row.get("total_energy", float("nan"))
+        print(f"{row['report']}: {row['rows']} readings, total {total:.1f}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,82 @@
+# ============================================
+# Rendered-figure cache for the dashboard charts
+# A chart is drawn once per set of inputs (dataset version, date range,
+# energy filter, devices, period) and kept as PNG / SVG bytes, shared by all
+# sessions of the process. Reruns that do not change the inputs (export,
+# page switches, other widgets) only send the stored bytes. Entries are
+# evicted least recently used first to stay under a byte budget, and every
+# figure is closed right after it is rendered.
+# ============================================
+import io
+import threading
+from collections import OrderedDict
+
+import matplotlib.pyplot as plt
+
+FIGURE_CACHE_BYTES = 32 * 1024 * 1024
+# Same output as st.pyplot
+SAVEFIG_OPTIONS = {"dpi": 200, "bbox_inches": "tight"}
+
+
+def figure_key(chart, dataset, start=None, end=None, energy_filter=(), devices=(), period=None):
+    """Hashable cache key of one chart; `dataset` is the (key, version) of the shared dataset"""
+    return (chart, dataset, str(start), str(end), tuple(energy_filter), tuple(devices), period)
+
+
+def render_figure(fig, fmt="png") -> bytes:
+    """Bytes of a figure in `fmt`; the figure is closed in any case"""
+    try:
+        buffer = io.BytesIO()
+        fig.savefig(buffer, format=fmt, **SAVEFIG_OPTIONS)
+        return buffer.getvalue()
+    finally:
+        plt.close(fig)
+
+
+class FigureCache:
+    """LRU of rendered figures with a byte budget, safe to share between sessions"""
+
+    def __init__(self, max_bytes=FIGURE_CACHE_BYTES):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()   # key -> bytes
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = self.misses = 0
+
+    def get(self, key, draw, fmt="png") -> bytes:
+        """
+        Stored bytes of `key`, or draw() (a function returning a new figure)
+        rendered now. Two sessions missing the same key at once both draw it.
+        """
+        key = (key, fmt)
+        with self._lock:
+            data = self._entries.get(key)
+            if data is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return data
+            self.misses += 1
+        data = render_figure(draw(), fmt)
+        with self._lock:
+            if key not in self._entries and len(data) <= self.max_bytes:
+                self._entries[key] = data
+                self._bytes += len(data)
+                while self._bytes > self.max_bytes:
+                    _, old = self._entries.popitem(last=False)
+                    self._bytes -= len(old)
+        return data
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    @property
+    def nbytes(self):
+        return self._bytes
+
+    def __len__(self):
+        return len(self._entries)
+
+
+figure_cache = FigureCache()
@@ -3,13 +3,21 @@
 # Left parameter bar + Large screen visualization layout on the right
 # ============================================
 import os
-from typing import List
 import streamlit as st
-import pandas as pd
 import matplotlib.pyplot as plt
-from datetime import datetime
-from models_energy import Energy
-from config_equipment import equip_dic, utility_system, equipments
+from time_utils import date_bounds
+from session_data import (use_dataset_file, use_dataset_dir, use_uploaded_file, session_df, session_slice,
+                          session_rollups, session_reconciliation, session_resampled, session_dataset_version,
+                          session_costs, append_to_session)
+from dataset_partitions import open_partitioned
+from energy_analytics import (ENERGY_TYPES, SYSTEM_TYPES, energy_columns, daily_energy, period_table,
+                              interval_table, rank_devices, kpis, data_quality)
+from energy_export import available_formats, export_selection
+from energy_cost import NOT_ADDITIVE
+from meter_hierarchy import RECONCILE_TOLERANCE
+from resample_energy import RESOLUTIONS
+from chart_downsample import plot_lines, PREVIEW_POINTS
+from figure_cache import figure_cache, figure_key
 
 st.set_page_config(page_title="Drug Green Manufacturing Energy Consumption System", layout="wide")
 
@@ -45,34 +53,7 @@ hide_pages_css = """
 st.markdown(hide_pages_css, unsafe_allow_html=True)
 
 
-# Time analysis function
-def parse_time(value):
-    if pd.isna(value):
-        return None
-    for fmt in ["%Y-%m-%d %I:%M:%S %p", "%Y/%m/%d %I:%M:%S %p",
-                "%Y-%m-%d %H:%M:%S", "%Y/%m/%d %H:%M:%S"]:
-        try:
-            return datetime.strptime(str(value), fmt)
-        except Exception:
-            continue
-    return pd.to_datetime(value, errors="coerce")
-
-
-def filter_by_date(records_or_df, start_date, end_date):
-    """Unified filtering function, compatible with Energy object list and DataFrame"""
-    if isinstance(records_or_df, list) and all(hasattr(r, "timestamp") for r in records_or_df):
-        filtered = [r for r in records_or_df if start_date <= r.timestamp.date() <= end_date]
-        df = pd.DataFrame([vars(r) for r in filtered])
-        df["time"] = pd.to_datetime(df["timestamp"])
-        df.drop(columns=["timestamp"], inplace=True, errors="ignore")
-        return df
-    else:
-        df = records_or_df.copy()
-        df["time"] = pd.to_datetime(df["time"], errors="coerce")
-        return df[(df["time"].dt.date >= start_date) & (df["time"].dt.date <= end_date)]
-
-
-# Fixed path
+# Fixed path: a single export file, or a directory of monthly / yearly exports
 DATA_PATH = r"E:\homework\9001\9001-final\energy_data_2024.xlsx"
 
 # layout
@@ -84,41 +65,59 @@ with left:
         st.markdown("#### 📂 Data Source")
 
         # Read from the local directory first
-        if os.path.exists(DATA_PATH):
-            df = pd.read_excel(DATA_PATH)
-            st.session_state["df"] = df
+        partitions = None
+        if os.path.isdir(DATA_PATH):
+            # Partitioned directory: only the months of the selected range are loaded (below)
+            partitions = open_partitioned(DATA_PATH)
+            st.success(f" {len(partitions.months)} monthly partitions found in: `{os.path.basename(DATA_PATH)}`")
+        elif os.path.exists(DATA_PATH):
+            df = use_dataset_file(DATA_PATH)
             st.success(f" Data loaded automatically from: `{os.path.basename(DATA_PATH)}`")
-            try:
-                energy_records: List[Energy] = [
-                    Energy(timestamp=row["time"], **{k: v for k, v in row.items() if k != "time"})
-                    for _, row in df.iterrows()
-                ]
-                st.session_state["energy_data"] = energy_records
-            except Exception as e:
-                st.warning(f"Energy class conversion skipped due to: {e}")
         else:
             uploaded_file = st.file_uploader("📤 Upload the energy consumption data file（Excel）", type=["xlsx"])
             if uploaded_file is not None:
-                df = pd.read_excel(uploaded_file)
-                st.session_state["df"] = df
-                st.success("File uploaded successfully and stored in session.")
-            elif "df" in st.session_state:
-                df = st.session_state["df"]
+                df = use_uploaded_file(uploaded_file)
+                st.success("File uploaded successfully and shared with all sessions.")
+            elif session_df() is not None:
+                df = session_df()
                 st.info("Using previously loaded dataset from session.")
             else:
                 st.error("No data found. Please upload an Excel file or ensure the default path exists.")
                 st.stop()
 
-        # choose date
+        # choose date (defaults follow the data instead of a fixed year)
+        if partitions is not None:
+            default_start, default_end = partitions.default_range()
+        else:
+            default_start, default_end = date_bounds(df["time"])
         st.markdown("#### 📅 Select Date Range")
-        start_date = st.date_input("Start Date", datetime(2024, 1, 1))
-        end_date = st.date_input("End Date", datetime(2024, 3, 31))
+        start_date = st.date_input("Start Date", default_start)
+        end_date = st.date_input("End Date", default_end)
+        if partitions is not None:
+            df = use_dataset_dir(DATA_PATH, start_date, end_date)
+
+        with st.expander("➕ Append New Readings"):
+            new_readings = st.file_uploader("CSV / Excel with a time column and any meter columns",
+                                            type=["csv", "xlsx"], key="append_uploader")
+            if new_readings is not None and st.button("Append to dataset", key="btn_append"):
+                try:
+                    report = append_to_session(new_readings)
+                    st.success(f"{report.rows_added} rows added, {report.rows_merged} merged, "
+                               f"{report.rows_dropped} dropped.")
+                except (ValueError, KeyError) as e:
+                    st.error(f"Append rejected: {e}")
+
+        time_report = df.attrs.get("time_parse", {})
+        if time_report.get("fallback_rows"):
+            st.caption(f"🕒 {time_report['fallback_rows']} of {time_report['rows']} timestamps did not match "
+                       f"`{time_report['dominant_format']}` and used the fallback parser "
+                       f"({time_report['failed_rows']} unreadable).")
 
         # Energy type selection
         st.markdown("#### 🔍 Choose Energy Type")
         energy_filter = st.multiselect(
             "Select energy category",
-            ["elec", "water", "steam", "gas"],
+            ENERGY_TYPES,
             default=["elec"]
         )
 
@@ -126,7 +125,7 @@ with left:
         st.markdown("#### 🏭 Choose System Type")
         system_type = st.radio(
             "Select system category",
-            ["all_equipments", "utility_system", "equipments"],
+            SYSTEM_TYPES,
             index=0,
             horizontal=True
         )
@@ -146,11 +145,10 @@ with left:
                 st.session_state["selected_devices"] = st.session_state["device_selector"]
 
 
-        if "df" in st.session_state:
-            df = st.session_state["df"]
-            df["time"] = pd.to_datetime(df["time"], errors="coerce")
+        df = session_df()
+        if df is not None:
             # Automatic identification of energy columns
-            energy_cols = [col for col in df.columns if any(col.startswith(e) for e in energy_filter)]
+            energy_cols = energy_columns(df.columns, energy_filter)
 
             if energy_cols:
                 # Initialization: Default values are provided when the page is first loaded.
@@ -178,9 +176,9 @@ with left:
         st.markdown("#### ⏱️ Select Aggregation Period")
         period = st.radio(
             "Aggregation period:",
-            ["Daily", "Weekly", "Monthly"],
+            list(RESOLUTIONS) + ["Daily", "Weekly", "Monthly"],
             horizontal=True,
-            index=0,
+            index=len(RESOLUTIONS),
             key="aggregation_period"
         )
 
@@ -194,24 +192,29 @@ with left:
         st.info("**Tip:** The system will automatically load the data file from your local directory if it exists.")
 
         # Export button
-        if "df" in st.session_state:
-            df = st.session_state["df"]
-            # Filter time range
-            df["time"] = pd.to_datetime(df["time"], errors="coerce")
-            df = df[(df["time"].dt.date >= start_date) & (df["time"].dt.date <= end_date)]
+        df = session_slice(start_date, end_date)
+        if df is not None:
             # Filter columns
-            energy_cols = [col for col in df.columns if any(col.startswith(e) for e in energy_filter)]
-            export_df = df[["time"] + energy_cols]
+            energy_cols = energy_columns(df.columns, energy_filter)
+            exp_col1, exp_col2 = st.columns(2)
+            with exp_col1:
+                export_format = st.selectbox("Export format", available_formats(), key="export_format")
+            with exp_col2:
+                export_level = st.selectbox("Export rows", ["Raw readings", *RESOLUTIONS, "Daily", "Weekly", "Monthly"],
+                                            key="export_level")
 
             if st.button("📁 Generate Export File", key="btn_export_excel"):
-                export_df.to_excel("filtered_energy_data.xlsx", index=False)
-                with open("filtered_energy_data.xlsx", "rb") as f:
-                    st.download_button(
-                        label="⬇️ Download Excel File",
-                        data=f,
-                        file_name="filtered_energy_data.xlsx",
-                        mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-                    )
+                # Built in a per-request buffer: concurrent users never share a file
+                export = export_selection(df, session_rollups(), energy_cols, start_date, end_date,
+                                          export_format, None if export_level == "Raw readings" else export_level,
+                                          resampled=session_resampled(export_level)
+                                          if export_level in RESOLUTIONS else None)
+                st.download_button(
+                    label=f"⬇️ Download {export_format} File ({export.rows} rows)",
+                    data=export.read(),
+                    file_name=export.file_name,
+                    mime=export.mime,
+                )
         else:
             st.warning("No data loaded yet. Please upload data in the main dashboard.")
 
@@ -231,45 +234,33 @@ with left:
 # ========== The right display area ==========
 with right:
     # Load data from session_state first
-    if "df" in st.session_state:
-        df = st.session_state["df"]
-    elif os.path.exists(DATA_PATH):
-        df = pd.read_excel(DATA_PATH)
-        st.session_state["df"] = df
+    df = session_df()
+    if df is None and os.path.isfile(DATA_PATH):
+        df = use_dataset_file(DATA_PATH)
         st.info(f"Loaded data automatically from {os.path.basename(DATA_PATH)}")
-    else:
+    elif df is None:
         st.error("No data available. Please upload a file or make sure the local file exists.")
         st.stop()
 
-    # handle data
-    df.rename(columns={df.columns[0]: "time"}, inplace=True)
-    df["time"] = df["time"].apply(parse_time)
-
-    # filter time
-    start_ts = pd.Timestamp(start_date)
-    end_ts = pd.Timestamp(end_date) + pd.Timedelta(days=1) - pd.Timedelta(seconds=1)
-    df = df[(df["time"] >= start_ts) & (df["time"] <= end_ts)]
+    rollups = session_rollups()
 
     # filter energy type
-    prefixes = [e for e in ["elec", "water", "steam", "gas"] if e in energy_filter]
-    energy_cols = [col for col in df.columns if any(col.startswith(p) for p in prefixes)]
+    energy_cols = energy_columns(df.columns, energy_filter)
 
     if not energy_cols:
         st.error("No matching energy columns found. Please check your Excel headers.")
         st.stop()
 
-    # Daily energy consumption calculation (daily maximum value - minimum value)
-    df["date"] = df["time"].dt.date
-    daily_energy = df.groupby("date")[energy_cols].max() - df.groupby("date")[energy_cols].min()
-    daily_energy["total_energy"] = daily_energy.sum(axis=1)
+    # Daily energy consumption (sum of reading deltas, see meter_deltas), read from the rollups
+    daily = daily_energy(rollups, energy_cols, start_date, end_date)
 
-    # statistical index
-    total_energy = daily_energy["total_energy"].sum()
-    avg_daily = daily_energy["total_energy"].mean()
-    sum_energy = daily_energy.drop(columns=["total_energy"]).sum().sort_values(ascending=False)
-    top_equip = sum_energy.idxmax()
-    top_val = sum_energy.max()
-    top_name = equip_dic.get(top_equip, top_equip)
+    # statistical index (O(1) per meter from the cumulative index)
+    sum_energy = rank_devices(rollups, energy_cols, start_date, end_date)
+    kpi = kpis(rollups, energy_cols, start_date, end_date)
+    total_energy, avg_daily = kpi.total_energy, kpi.avg_daily
+    # no top device when nothing was consumed in the range
+    top_name = "—" if kpi.top_device is None else kpi.top_device_name
+    top_val = "—" if kpi.top_device is None else f"{kpi.top_value:.2f}"
 
     c1, c2, c3 = st.columns(3)
     with c1:
@@ -283,11 +274,41 @@ with right:
     with c3:
         st.markdown(f"<div class='card'><div class='small'>Top Consuming Device</div>"
                     f"<div class='metric'>{top_name}</div>"
-                    f"<div class='small'>Energy used: {top_val:.2f}</div></div>", unsafe_allow_html=True)
+                    f"<div class='small'>Energy used: {top_val}</div></div>", unsafe_allow_html=True)
+
+    # Electricity cost of the date range: time-of-use energy charge + monthly demand charge
+    # Built once per dataset version / range / meters (kept on the shared dataset)
+    costs = session_costs(start_date, end_date, energy_columns(df.columns, ["elec"], system_type))
+    cost_totals = costs.totals()
+    k1, k2, k3, k4 = st.columns(4)
+    k1.metric("Electricity cost (yuan)", f"{cost_totals['total cost']:,.0f}")
+    k2.metric("Energy charge (yuan)", f"{cost_totals['energy cost']:,.0f}")
+    k3.metric("Demand charge (yuan)", f"{cost_totals['demand cost']:,.0f}")
+    k4.metric("Peak demand (kW)", f"{cost_totals['peak kW']:,.1f}")
+    with st.expander(f"💰 Cost breakdown ({costs.tariff.name})"):
+        st.dataframe(costs.by_group().round(1), use_container_width=True)
+        st.caption(f"'{NOT_ADDITIVE}' are measured again by their sub-meters and are not part of the totals.")
+        st.dataframe(costs.demand().round({"peak kW": 1, "demand cost": 1}), use_container_width=True)
+        st.dataframe(costs.by_day().round(1), use_container_width=True)
+    # Main / section meters are not added to the totals; their difference to the sub-meters is shown here
+    with st.expander("🔌 Meter reconciliation (parent vs. sub-meters)"):
+        st.dataframe(session_reconciliation().summary(start_date, end_date).round(1), use_container_width=True)
+        st.caption("Inferred branches are a heuristic fitted on the 2024 readings, not the panel documentation: "
+                   "their residual % is the fit on the selected range. A parent whose residual is above "
+                   f"{RECONCILE_TOLERANCE:.0%} is counted in totals instead of its branches.")
+    # Days whose consumption needed a correction (resets, dropped readings) or bridged missing readings
+    quality = data_quality(rollups, energy_cols, start_date, end_date)
+    with st.expander(f"🩺 Data quality ({len(quality)} meters with flagged days)"):
+        if quality.empty:
+            st.caption("No gaps, resets or rollovers in the selected range.")
+        else:
+            st.dataframe(quality, use_container_width=True)
 
     st.markdown("---")
 
     st.markdown("### 📊 Visualization Overview")
+    # The preview charts are rendered once per dataset version / range / energy filter (figure_cache)
+    chart_inputs = (session_dataset_version(), start_date, end_date, energy_filter)
     # ================= 左右两列主布局 =================
     col1, col2 = st.columns([1.2, 1])
 
@@ -295,48 +316,55 @@ with right:
     with col1:
         st.markdown("#### 📈 Daily Energy Trend (Preview)")
 
-        fig1, ax1 = plt.subplots(figsize=(6, 2.2))
-        ax1.plot(daily_energy.index, daily_energy.sum(axis=1), color="#1E88E5", linewidth=2)
-        ax1.set_title("Daily Energy Trend (Preview)", fontsize=10, color="#003366")
-        ax1.set_xlabel("")
-        ax1.set_ylabel("")
-        ax1.set_xticks([])
-        ax1.set_yticks([])
-        ax1.spines["top"].set_visible(False)
-        ax1.spines["right"].set_visible(False)
-        ax1.spines["bottom"].set_visible(False)
-        ax1.spines["left"].set_visible(False)
-        ax1.grid(True, linestyle="--", alpha=0.25)
-
-        st.pyplot(fig1, use_container_width=True)
+        def draw_trend():
+            fig1, ax1 = plt.subplots(figsize=(6, 2.2))
+            plot_lines(ax1, daily["total_energy"], PREVIEW_POINTS, color="#1E88E5", linewidth=2)
+            ax1.set_title("Daily Energy Trend (Preview)", fontsize=10, color="#003366")
+            ax1.set_xlabel("")
+            ax1.set_ylabel("")
+            ax1.set_xticks([])
+            ax1.set_yticks([])
+            ax1.spines["top"].set_visible(False)
+            ax1.spines["right"].set_visible(False)
+            ax1.spines["bottom"].set_visible(False)
+            ax1.spines["left"].set_visible(False)
+            ax1.grid(True, linestyle="--", alpha=0.25)
+            return fig1
+
+        st.image(figure_cache.get(figure_key("trend_preview", *chart_inputs), draw_trend),
+                 use_container_width=True)
 
     # ===== Right side: Energy Consumption Preview =====
     with col2:
         st.markdown("#### 📊 Energy Overview (Preview)")
 
-        if isinstance(sum_energy, pd.DataFrame):
-            sum_energy_plot = sum_energy["total_energy"].sort_values(ascending=False)
-        else:
-            sum_energy_plot = sum_energy.sort_values(ascending=False)
-
+        sum_energy_plot = sum_energy
         top10 = sum_energy_plot.head(10)
         top5 = sum_energy_plot.head(5)
 
         # Two small graphs: bar chart + pie chart
         bar_col, pie_col = st.columns([1.2, 1])
         with bar_col:
-            fig_bar, ax_bar = plt.subplots(figsize=(3.5, 2.2))
-            top10.plot(kind="barh", color="#42A5F5", ax=ax_bar)
-            ax_bar.invert_yaxis()
-            ax_bar.set_title("Top Devices", fontsize=9, color="#003366")
-            ax_bar.axis("off")
-            st.pyplot(fig_bar, use_container_width=True)
+            def draw_bar():
+                fig_bar, ax_bar = plt.subplots(figsize=(3.5, 2.2))
+                top10.plot(kind="barh", color="#42A5F5", ax=ax_bar)
+                ax_bar.invert_yaxis()
+                ax_bar.set_title("Top Devices", fontsize=9, color="#003366")
+                ax_bar.axis("off")
+                return fig_bar
+
+            st.image(figure_cache.get(figure_key("top_devices", *chart_inputs), draw_bar),
+                     use_container_width=True)
 
         with pie_col:
-            fig_pie, ax_pie = plt.subplots(figsize=(3, 2.2))
-            ax_pie.pie(top5, labels=None, autopct=None, startangle=140, colors=plt.cm.Paired.colors)
-            ax_pie.set_title("Energy Share", fontsize=9, color="#003366")
-            st.pyplot(fig_pie, use_container_width=True)
+            def draw_pie():
+                fig_pie, ax_pie = plt.subplots(figsize=(3, 2.2))
+                ax_pie.pie(top5, labels=None, autopct=None, startangle=140, colors=plt.cm.Paired.colors)
+                ax_pie.set_title("Energy Share", fontsize=9, color="#003366")
+                return fig_pie
+
+            st.image(figure_cache.get(figure_key("energy_share", *chart_inputs), draw_pie),
+                     use_container_width=True)
 
     btn_col1, btn_col2 = st.columns([1.2, 1])
 
@@ -353,35 +381,37 @@ with right:
     # On the right side, it shows the daily energy consumption trend of the equipment.
     st.markdown("#### ⚡ Device Daily Energy Trend (Preview)")
 
-    if "df" not in st.session_state or "selected_devices" not in st.session_state:
+    if session_df() is None or "selected_devices" not in st.session_state:
         st.info("Please select one or more devices from the left sidebar first.")
     else:
-        df = st.session_state["df"]
+        rollups = session_rollups()
         selected_devices = st.session_state["selected_devices"]
         start_date = st.session_state.get("start_date")
         end_date = st.session_state.get("end_date")
 
         if selected_devices:
-            df["time"] = pd.to_datetime(df["time"], errors="coerce")
-            df["date"] = df["time"].dt.date
-            df = df[(df["date"] >= start_date) & (df["date"] <= end_date)]
-            # Calculate daily energy consumption
-            daily_energy = df.groupby("date")[selected_devices].agg(lambda x: x.max() - x.min())
+            # Daily energy consumption
+            device_daily = rollups.consumption("Daily", selected_devices, start_date, end_date)
 
             preview_devices = selected_devices[:5]
-            fig_device, ax_device = plt.subplots(figsize=(2.2, 1.4))
-            daily_energy[preview_devices].plot(ax=ax_device, linewidth=0.3)
-            ax_device.set_title("")
-            ax_device.set_xlabel("")
-            ax_device.set_ylabel("")
-            ax_device.set_xticks([])
-            ax_device.set_yticks([])
-            ax_device.legend().set_visible(False)
-            for spine in ax_device.spines.values():
-                spine.set_visible(False)
-
-            ax_device.grid(True, linestyle="--", alpha=0.25)
-            st.pyplot(fig_device, use_container_width=False)
+
+            def draw_devices():
+                fig_device, ax_device = plt.subplots(figsize=(2.2, 1.4))
+                plot_lines(ax_device, device_daily[preview_devices], PREVIEW_POINTS, linewidth=0.3)
+                ax_device.set_title("")
+                ax_device.set_xlabel("")
+                ax_device.set_ylabel("")
+                ax_device.set_xticks([])
+                ax_device.set_yticks([])
+                for spine in ax_device.spines.values():
+                    spine.set_visible(False)
+
+                ax_device.grid(True, linestyle="--", alpha=0.25)
+                return fig_device
+
+            key = figure_key("device_preview", session_dataset_version(), start_date, end_date,
+                             devices=preview_devices)
+            st.image(figure_cache.get(key, draw_devices), use_container_width=False)
 
         else:
             st.info("No devices selected.")
@@ -397,39 +427,28 @@ with right:
     st.subheader("📋 Data Preview")
 
     # Read the selection in the left sidebar from the session_state
-    if "df" not in st.session_state:
+    if session_df() is None:
         st.error("Please load dataset in the main dashboard first.")
         st.stop()
 
-    df = st.session_state["df"]
     start_date = st.session_state.get("start_date")
     end_date = st.session_state.get("end_date")
     energy_filter = st.session_state.get("energy_filter", ["elec"])
-    # filter time range
-    df = filter_by_date(st.session_state.get("energy_data", st.session_state["df"]), start_date, end_date)
+    rollups = session_rollups()
 
     # filter energy type
-    energy_cols = [col for col in df.columns if any(col.startswith(e) for e in energy_filter)]
+    energy_cols = energy_columns(rollups.columns, energy_filter)
     if not energy_cols:
         st.warning("No matching energy columns found for current selection.")
         st.stop()
 
-    # Select the aggregation period
+    # Select the aggregation period (filtered by the selected date range)
     period = st.session_state.get("aggregation_period", "Daily")
-    if period == "Daily":
-        df["date"] = df["time"].dt.date
-        df_grouped = df.groupby("date")[energy_cols].agg(lambda x: x.max() - x.min()).reset_index()
-        df_grouped.rename(columns={"date": "Date"}, inplace=True)
-
-    elif period == "Weekly":
-        df["week_start"] = df["time"].dt.to_period("W").apply(lambda r: r.start_time.date())
-        df_grouped = df.groupby("week_start")[energy_cols].agg(lambda x: x.max() - x.min()).reset_index()
-        df_grouped.rename(columns={"week_start": "Week Start"}, inplace=True)
-
-    else:  # Monthly
-        df["month"] = df["time"].dt.to_period("M").apply(lambda r: r.start_time.date())
-        df_grouped = df.groupby("month")[energy_cols].agg(lambda x: x.max() - x.min()).reset_index()
-        df_grouped.rename(columns={"month": "Month"}, inplace=True)
+    if period in RESOLUTIONS:
+        # fixed-interval slots, resampled once per resolution for the shared dataset
+        df_grouped = interval_table(session_resampled(period), energy_cols, start_date, end_date)
+    else:
+        df_grouped = period_table(rollups, period, energy_cols, start_date, end_date)
 
     # display result
     st.markdown(f"**Period:** `{period}` | **Energy Type:** `{', '.join(energy_filter)}`")
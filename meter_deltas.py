@@ -0,0 +1,234 @@
+# ============================================
+# Consumption engine for cumulative meter readings
+# Consumption is built from the differences of consecutive readings (never
+# max - min), after cleaning the cumulative series of each meter:
+#   - dropouts: a few readings that fall and then come back to the level
+#     before the fall (e.g. a 0 from a logger restart) are discarded
+#   - reset: the reading falls below half of the previous one and stays
+#     there -> the register restarted from 0, the new reading is the use
+#   - rollover: with a register width, a fall from the top of the register
+#     to its bottom -> use = reading + width - previous
+#   - jitter: any smaller fall counts 0 until the reading passes its high again
+#   - gaps: missing readings are interpolated linearly in time on the
+#     corrected cumulative, so a gap never hides consumption
+# Every meter gets a quality mask (bit flags per reading). One pass of array
+# operations per meter column.
+# ============================================
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Sequence
+
+import numpy as np
+import pandas as pd
+
+from config_equipment import register_rollover
+from models_energy import EnergyTable
+
+# Quality flags (bits of the mask)
+GAP = 1           # no valid reading, value interpolated
+LONG_GAP = 2      # inside / closing a gap longer than MAX_GAP_HOURS
+RESET = 4         # counter reset or meter replacement
+ROLLOVER = 8      # register wrapped around
+DROPPED = 16      # reading discarded as a dropout
+NO_DATA = 32      # before the first / after the last reading of the meter
+QUALITY_FLAGS = {GAP: "gap", LONG_GAP: "long gap", RESET: "reset", ROLLOVER: "rollover",
+                 DROPPED: "dropped", NO_DATA: "no data"}
+
+RESET_DROP = 0.5          # a fall to below half of the previous reading is a reset
+ROLLOVER_MARGIN = 0.1     # rollover: from the top 10% of the register to its bottom 10%
+DROPOUT_READINGS = 3      # longest dropout (readings) that is discarded
+MAX_GAP_HOURS = 2.0
+
+
+def _dropouts(x, starts):
+    """Rows of the short falls (starting at `starts`) that come back to the level before them"""
+    dropped = np.zeros(len(x), dtype=bool)
+    ref = x[starts - 1]
+    pending = np.ones(len(starts), dtype=bool)
+    for k in range(1, DROPOUT_READINGS + 1):
+        j = starts + k
+        ok = pending & (j < len(x))
+        nxt = np.where(ok, x[np.minimum(j, len(x) - 1)], np.nan)
+        with np.errstate(invalid="ignore"):
+            back = ok & (nxt >= ref)
+            pending = ok & (nxt < ref * (1 - RESET_DROP))
+        for m in range(k):
+            dropped[starts[back] + m] = True
+    return np.flatnonzero(dropped)
+
+
+def _missing_runs(rows):
+    """(first, last) row of each run of consecutive row numbers"""
+    breaks = np.flatnonzero(np.diff(rows) > 1)
+    return rows[np.r_[0, breaks + 1]], rows[np.r_[breaks, len(rows) - 1]]
+
+
+def _fill_forward(c, rows, n):
+    """Missing rows take the previous reading; rows before the first reading take the first one"""
+    first, last = _missing_runs(rows)
+    source = np.where(first > 0, first - 1, np.minimum(last + 1, n - 1))
+    c[rows] = np.repeat(c[source], last - first + 1)
+
+
+def seconds_since_start(times):
+    """Seconds of each timestamp from the first one"""
+    times = np.asarray(times, dtype="datetime64[ns]")
+    return (times - times[0]).astype(np.int64) / 1e9 if len(times) else np.zeros(0)
+
+
+def long_gaps(t):
+    """Indices i where the step t[i] -> t[i + 1] (seconds) is longer than MAX_GAP_HOURS"""
+    return np.flatnonzero(np.diff(t) > MAX_GAP_HOURS * 3600)
+
+
+def correct_readings(t, values, register=None, row_gaps=None, out=None, high=None):
+    """
+    corrected_cumulative() on times as seconds from the first row. Works in
+    place on one full-length buffer: missing readings are carried forward,
+    the series is corrected, then the missing rows are interpolated.
+    `row_gaps` (long_gaps(t)) can be passed in when many meters share the
+    rows, `out` = (cumulative, flags) buffers to write into. `high` is the
+    highest reading since the last reset before the rows, for rows cut out
+    of a longer series: a first reading below it is inside a jitter dip.
+    """
+    n = len(values)
+    c, flags = out if out is not None else (np.empty(n), np.empty(n, dtype=np.uint8))
+    flags[:] = 0
+    missing = np.isnan(values)
+    rows = np.flatnonzero(missing) if missing.any() else np.zeros(0, dtype=np.int64)
+    if len(rows) == n:
+        c[:] = 0.0
+        flags[:] = NO_DATA
+        return c, flags
+    c[:] = values
+    if len(rows):
+        _fill_forward(c, rows, n)
+
+    dip = high is not None and c[0] < high    # the rows start inside a jitter dip
+    jitter = dip
+    if n > 1 and (c[1:] < c[:-1]).any():
+        fall = c[1:] < c[:-1] * (1 - RESET_DROP)
+        if fall.any():
+            dropped = _dropouts(c, np.flatnonzero(fall) + 1)
+            if len(dropped):
+                flags[dropped] |= DROPPED
+                rows = np.union1d(rows, dropped)
+                _fill_forward(c, rows, n)
+                fall = c[1:] < c[:-1] * (1 - RESET_DROP)
+        if fall.any():
+            # Resets and rollovers start new segments; each segment is offset so
+            # the series continues from the high of the one before it
+            event = np.flatnonzero(fall) + 1
+            prev, cur = c[event - 1], c[event]
+            roll = np.zeros(len(event), dtype=bool)
+            if register:
+                roll = (prev >= register * (1 - ROLLOVER_MARGIN)) & (cur <= register * ROLLOVER_MARGIN)
+            flags[event[~roll]] |= RESET
+            flags[event[roll]] |= ROLLOVER
+            seg_starts = np.r_[0, event]
+            seg_high = np.maximum.reduceat(c, seg_starts)
+            if dip:
+                seg_high[0] = max(seg_high[0], high)
+            offset = np.cumsum(np.where(roll, register or 0.0, seg_high[:-1]))
+            c += np.repeat(np.r_[0.0, offset], np.diff(np.r_[seg_starts, n]))
+        jitter = True
+    if jitter:
+        if dip:
+            c[0] = high   # falls are found on the readings; the high only holds use back
+        np.maximum.accumulate(c, out=c)   # jitter: no use until the reading passes its high
+    c -= c[0]
+
+    # Missing rows: interpolate in time between the readings around them
+    if len(rows):
+        first, last = _missing_runs(rows)
+        head = last[0] if first[0] == 0 else -1          # rows before the first reading
+        tail = first[-1] if last[-1] == n - 1 else n     # rows after the last reading
+        inner = (first > head) & (last < tail)
+        p, q = first[inner] - 1, last[inner] + 1         # the readings around each inner run
+        between = rows[(rows > head) & (rows < tail)]
+        pr, qr = np.repeat(p, q - p - 1), np.repeat(q, q - p - 1)
+        c[between] = c[pr] + (c[qr] - c[pr]) * (t[between] - t[pr]) / (t[qr] - t[pr])
+        flags[rows] |= GAP
+        flags[:head + 1] = NO_DATA | (flags[:head + 1] & DROPPED)
+        flags[tail:] = NO_DATA | (flags[tail:] & DROPPED)
+        far = t[q] - t[p] > MAX_GAP_HOURS * 3600
+        for lo, hi in zip(p[far], q[far]):
+            flags[lo + 1:hi + 1] |= LONG_GAP
+    flags[(long_gaps(t) if row_gaps is None else row_gaps) + 1] |= LONG_GAP
+    return c, flags
+
+
+def corrected_cumulative(times, values, register: Optional[float] = None):
+    """
+    (corrected cumulative, quality flags) of one meter at every row.
+    times: sorted datetime64[ns]; values: cumulative readings, NaN = missing.
+    The corrected cumulative starts at 0 and never decreases; its difference
+    between two times is the consumption in between.
+    """
+    return correct_readings(seconds_since_start(times), values, register)
+
+
+def day_edges(times, keys):
+    """Midnight before and after each day with rows (keys), as seconds from the first row"""
+    edges = np.stack([keys, keys + 1]).astype("datetime64[ns]")
+    return (edges - np.asarray(times[0], dtype="datetime64[ns]")).astype(np.int64) / 1e9
+
+
+def day_totals(t, cumulative, flags, day_starts, edges):
+    """
+    Consumption and OR-ed quality flags per day with rows (first rows
+    `day_starts`, midnights `edges` from day_edges). A day runs from midnight
+    to midnight on the interpolated cumulative; the part of a gap that falls
+    on days without rows is not counted anywhere. Days entirely outside the
+    meter's readings are NaN.
+    """
+    if not len(t):
+        return np.zeros(0), np.zeros(0, dtype=np.uint8)
+    start, end = np.interp(edges, t, cumulative)
+    use = end - start
+    day_flags = np.bitwise_or.reduceat(flags, day_starts)
+    if flags[0] & NO_DATA or flags[-1] & NO_DATA:
+        use[np.logical_and.reduceat((flags & NO_DATA) > 0, day_starts)] = np.nan
+    return use, day_flags
+
+
+def describe(flags) -> str:
+    """Names of the quality flags set in a mask value"""
+    return ", ".join(name for bit, name in QUALITY_FLAGS.items() if int(flags) & bit)
+
+
+@dataclass
+class MeterDeltas:
+    timestamps: np.ndarray       # datetime64[ns], sorted
+    meters: List[str]
+    cumulative: np.ndarray       # rows x meters, corrected cumulative (0 at the first reading)
+    quality: np.ndarray          # rows x meters, uint8 quality flags
+
+    def intervals(self):
+        """(interval starts, interval hours, consumption matrix intervals x meters)"""
+        hours = np.diff(self.timestamps).astype(np.int64) / 3.6e12
+        return self.timestamps[:-1], hours, np.diff(self.cumulative, axis=0)
+
+    def flagged(self, flag) -> pd.DataFrame:
+        """Rows x meters boolean frame of the readings carrying a flag"""
+        return pd.DataFrame((self.quality & flag) > 0, index=self.timestamps, columns=self.meters)
+
+    def summary(self) -> pd.DataFrame:
+        """Number of readings per quality flag and meter"""
+        return pd.DataFrame({name: ((self.quality & bit) > 0).sum(axis=0) for bit, name in QUALITY_FLAGS.items()},
+                            index=pd.Index(self.meters, name="meter"))
+
+
+def meter_deltas(table: EnergyTable, columns: Optional[Sequence[str]] = None,
+                 registers: Optional[Dict[str, float]] = None) -> MeterDeltas:
+    """Corrected cumulative and quality mask of the meters of a table (sorted by time)"""
+    columns = list(table.columns) if columns is None else list(columns)
+    registers = register_rollover if registers is None else registers
+    n = len(table.timestamps)
+    t = seconds_since_start(table.timestamps)
+    row_gaps = long_gaps(t)
+    # column-major, so each meter is written as one contiguous run
+    cumulative = np.empty((len(columns), n)).T
+    quality = np.empty((len(columns), n), dtype=np.uint8).T
+    for j, col in enumerate(columns):
+        correct_readings(t, table.columns[col], registers.get(col), row_gaps, out=(cumulative[:, j], quality[:, j]))
+    return MeterDeltas(table.timestamps, columns, cumulative, quality)
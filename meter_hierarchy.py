@@ -0,0 +1,180 @@
+# ============================================
+# Meter hierarchy + sub-meter reconciliation
+# Parent (main / section) meters measure the sum of the meters they feed, so
+# totals must only add leaf meters. A parent whose sub-meters do not add up
+# to it (unmetered loads, or a branch that is not really below it) is counted
+# itself instead of them, so no load drops out of the totals. Reconciliation compares every parent
+# with the sum of its children: residual = parent - children (unmetered
+# loads and losses), as one matrix product over a (rows x meters) table.
+# ============================================
+from dataclasses import dataclass, field
+from typing import Dict, List, Sequence
+
+import numpy as np
+import pandas as pd
+
+from config_equipment import distribution_hierarchy, inferred_branches
+
+# Share of a parent's consumption its selected children may miss and still
+# replace it in totals
+RECONCILE_TOLERANCE = 0.1
+
+
+class MeterHierarchy:
+    """parent -> children tree of meter ids"""
+
+    def __init__(self, tree: Dict[str, Sequence[str]], inferred=()):
+        self.tree = {parent: list(children) for parent, children in tree.items()}
+        self.inferred = set(inferred)   # parents whose children are a heuristic, not documented
+        self.parent_of = {}
+        for parent, children in self.tree.items():
+            for child in children:
+                if child in self.parent_of:
+                    raise ValueError(f"Meter {child!r} is fed by both {self.parent_of[child]!r} and {parent!r}")
+                self.parent_of[child] = parent
+        for meter in self.parent_of:
+            seen = {meter}
+            while meter in self.parent_of:
+                meter = self.parent_of[meter]
+                if meter in seen:
+                    raise ValueError(f"Meter hierarchy has a cycle through {meter!r}")
+                seen.add(meter)
+
+    @property
+    def parents(self) -> List[str]:
+        return list(self.tree)
+
+    def descendants(self, meter) -> List[str]:
+        out, stack = [], list(self.tree.get(meter, ()))
+        while stack:
+            child = stack.pop()
+            out.append(child)
+            stack.extend(self.tree.get(child, ()))
+        return out
+
+    def leaves(self, columns: Sequence[str], whole=()) -> List[str]:
+        """
+        The columns whose load is not also measured by another selected column
+        below them; a parent in `whole` is counted instead of the meters below it
+        """
+        present = set(columns)
+        below_whole = {d for parent in whole for d in self.descendants(parent)}
+        return [c for c in columns if c not in below_whole
+                and (c in whole or not any(d in present for d in self.descendants(c)))]
+
+    def unreconciled(self, columns: Sequence[str], totals, tolerance=RECONCILE_TOLERANCE) -> set:
+        """Selected parents whose selected direct children differ from them by more than `tolerance`"""
+        present = set(columns)
+        value = lambda c: float(np.nan_to_num(totals.get(c, 0.0)))
+        out = set()
+        for parent, children in self.tree.items():
+            if parent not in present:
+                continue
+            kwh = value(parent)
+            if kwh > 0 and abs(kwh - sum(value(c) for c in children if c in present)) > tolerance * kwh:
+                out.add(parent)
+        return out
+
+    def matrix(self, columns: Sequence[str]):
+        """(parents with a column, parents x columns 0/1 matrix of their direct children)"""
+        pos = {c: i for i, c in enumerate(columns)}
+        parents = [p for p in self.tree if p in pos]
+        m = np.zeros((len(parents), len(columns)))
+        for i, parent in enumerate(parents):
+            for child in self.tree[parent]:
+                if child in pos:
+                    m[i, pos[child]] = 1.0
+        return parents, m
+
+
+hierarchy = MeterHierarchy(distribution_hierarchy, inferred_branches)
+
+
+def leaf_columns(columns: Sequence[str], totals=None, tolerance=RECONCILE_TOLERANCE) -> List[str]:
+    """
+    Columns of a selection that can be added up without double counting.
+    `totals` (consumption per column over the range: Series or dict) counts a
+    parent whose children do not reconcile within `tolerance` as a leaf.
+    """
+    columns = list(columns)
+    whole = () if totals is None else hierarchy.unreconciled(columns, totals, tolerance)
+    return hierarchy.leaves(columns, whole)
+
+
+@dataclass
+class Reconciliation:
+    keys: np.ndarray             # days (datetime64[D]) or interval starts (datetime64[ns])
+    parents: List[str]
+    children: List[List[str]]    # direct children of each parent found in the data
+    parent_kwh: np.ndarray       # rows x parents
+    children_kwh: np.ndarray     # rows x parents, sum of the direct children
+    inferred: List[bool] = field(default_factory=list)   # per parent: children inferred from the readings
+
+    @classmethod
+    def from_matrix(cls, keys, values, columns, tree: MeterHierarchy = hierarchy):
+        """values: rows x columns consumption (NaN counts as 0)"""
+        parents, m = tree.matrix(list(columns))
+        values = np.nan_to_num(np.asarray(values, dtype=np.float64))
+        pos = {c: i for i, c in enumerate(columns)}
+        children = [[c for c in tree.tree[p] if c in pos] for p in parents]
+        return cls(np.asarray(keys), parents, children, values[:, [pos[p] for p in parents]], values @ m.T,
+                   [p in tree.inferred for p in parents])
+
+    @classmethod
+    def from_rollups(cls, rollups, tree: MeterHierarchy = hierarchy):
+        """Per day, from the daily rollup (computed once per dataset)"""
+        daily = rollups.level("D")
+        columns = [c for c in daily.columns if c in tree.parent_of or c in tree.tree]
+        values = daily.stats["use"][:, [daily.col_pos[c] for c in columns]]
+        return cls.from_matrix(daily.keys, values, columns, tree)
+
+    @property
+    def residual_kwh(self):
+        return self.parent_kwh - self.children_kwh
+
+    def _rows(self, start=None, end=None):
+        keys = self.keys.astype("datetime64[D]")
+        lo = 0 if start is None else int(np.searchsorted(keys, np.datetime64(pd.Timestamp(start).date(), "D"), "left"))
+        hi = len(keys) if end is None else int(np.searchsorted(keys, np.datetime64(pd.Timestamp(end).date(), "D"), "right"))
+        return slice(lo, hi)
+
+    def table(self, start=None, end=None) -> pd.DataFrame:
+        """One row per key and parent: parent, children sum, residual"""
+        rows = self._rows(start, end)
+        n, k = len(self.keys[rows]), len(self.parents)
+        return pd.DataFrame({
+            "time": np.repeat(self.keys[rows], k),
+            "parent": np.tile(self.parents, n),
+            "parent kWh": self.parent_kwh[rows].ravel(),
+            "children kWh": self.children_kwh[rows].ravel(),
+            "residual kWh": self.residual_kwh[rows].ravel(),
+        })
+
+    def summary(self, start=None, end=None, tolerance=RECONCILE_TOLERANCE) -> pd.DataFrame:
+        """
+        Per parent over [start, end]: totals, the residual share of the parent
+        (how well the children fit it), whether the children are documented or
+        inferred, and what totals count (the children, or the parent when the
+        residual is above `tolerance`, as leaf_columns does)
+        """
+        rows = self._rows(start, end)
+        parent, children = self.parent_kwh[rows].sum(axis=0), self.children_kwh[rows].sum(axis=0)
+        residual = parent - children
+        share = np.divide(residual, parent, out=np.full(len(parent), np.nan), where=parent > 0)
+        inferred = np.array(self.inferred or [False] * len(self.parents), dtype=bool)
+        return pd.DataFrame({
+            "children": [", ".join(c) for c in self.children],
+            "branches": np.where(inferred, "inferred (heuristic)", "documented"),
+            "parent kWh": parent, "children kWh": children, "residual kWh": residual,
+            "residual %": share * 100,
+            "totals count": np.where((parent > 0) & (np.abs(residual) > tolerance * parent), "parent", "children"),
+        }, index=pd.Index(self.parents, name="parent"))
+
+
+def interval_reconciliation(table, tree: MeterHierarchy = hierarchy) -> Reconciliation:
+    """Per reading interval, from the deltas of the cumulative readings"""
+    from energy_cost import interval_deltas   # energy_cost uses this module for its leaf meters
+
+    columns = [c for c in table.columns if c in tree.parent_of or c in tree.tree]
+    starts, _, kwh = interval_deltas(table, columns)
+    return Reconciliation.from_matrix(starts, kwh, columns, tree)
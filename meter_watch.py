@@ -0,0 +1,272 @@
+# ============================================
+# Streaming anomaly / leak detection over meter deltas
+# Each meter keeps an EWMA baseline (mean and variance of its hourly rate)
+# per hour of the week, plus a few run counters: memory does not grow with
+# the readings. A batch of new readings is scored against the state as of
+# the batch start, then folded into it, so every step is an array operation
+# over (rows x meters).
+# Events:
+#   spike     rate far above the hour-of-week baseline (z score)
+#   sustained rate above the baseline for a long run (leak, valve left open)
+#   stuck     no consumption for a long run where the baseline expects some
+#   reset     meter reset / replacement, as classified by the delta engine
+#   rollover  register wrapped around (info)
+# Consumption comes from the delta engine (meter_deltas), fed with the last
+# few readings of each meter so falls are classified across batches: jitter
+# counts 0, dropouts are discarded. A fall is only classified once
+# DROPOUT_READINGS readings follow it, so it can be reported one batch late.
+# ============================================
+import copy
+from typing import Optional, Sequence
+
+import numpy as np
+import pandas as pd
+
+from config_equipment import equip_dic, register_rollover
+from meter_deltas import correct_readings, seconds_since_start, RESET, ROLLOVER, DROPPED, DROPOUT_READINGS
+from models_energy import EnergyTable
+
+HOURS_OF_WEEK = 168
+ALPHA = 0.05               # EWMA weight of one interval in its hour-of-week cell
+WARMUP = 8                 # intervals a cell needs before it can flag
+MAX_GAP_HOURS = 6          # longer gaps are not scored (and not learned)
+SPIKE_LEVELS = {"info": 4.0, "warning": 6.0, "critical": 10.0}   # z score
+SUSTAINED_Z = 2.0
+SUSTAINED_MINUTES = 120
+STUCK_MINUTES = 180
+REPLAY_BATCH = np.timedelta64(1, "D")   # replay feeds one day of readings at a time
+RECENT_READINGS = DROPOUT_READINGS + 1   # readings kept per meter to classify falls across batches
+FALL_LEVELS = {RESET: ("reset", "critical"), ROLLOVER: ("rollover", "info")}
+
+
+def _level(score, thresholds):
+    """Severity level of each score: the highest threshold it reaches"""
+    names = list(thresholds)
+    idx = np.searchsorted(np.array(list(thresholds.values())), score, side="right") - 1
+    return np.array(names, dtype=object)[np.clip(idx, 0, len(names) - 1)]
+
+
+def _run_minutes(flag, minutes, carry):
+    """Length (minutes) of the current run of True per cell, continuing the runs carried in"""
+    c = np.cumsum(np.where(flag, minutes, 0.0), axis=0)
+    base = np.maximum.accumulate(np.where(flag, 0.0, c), axis=0)
+    continuing = np.logical_and.accumulate(flag, axis=0)
+    return c - base + np.where(continuing, carry, 0.0)
+
+
+def _crossed(run, carry, limit):
+    """Rows where a run reaches `limit` minutes"""
+    prev = np.vstack([carry[None, :], run[:-1]])
+    return (run >= limit) & (prev < limit)
+
+
+class MeterWatch:
+    """Online detector for a fixed list of meters"""
+
+    def __init__(self, meters: Sequence[str]):
+        self.meters = list(meters)
+        m = len(self.meters)
+        self.mean = np.zeros((HOURS_OF_WEEK, m))
+        self.var = np.zeros((HOURS_OF_WEEK, m))
+        self.count = np.zeros((HOURS_OF_WEEK, m), dtype=np.int64)
+        self.last_value = np.full(m, np.nan)
+        self.last_time = np.full(m, np.datetime64("NaT"), dtype="datetime64[ns]")
+        self.spike_run = np.zeros(m)
+        self.sustained_run = np.zeros(m)
+        self.stuck_run = np.zeros(m)
+        # delta engine state: the last readings, the highest reading since the
+        # last reset before them, and the time up to which falls are classified
+        self.recent_value = np.full((m, RECENT_READINGS), np.nan)
+        self.recent_time = np.full((m, RECENT_READINGS), np.datetime64("NaT"), dtype="datetime64[ns]")
+        self.high = np.full(m, np.nan)
+        self.classified = np.full(m, np.datetime64("NaT"), dtype="datetime64[ns]")
+
+    @property
+    def nbytes(self):
+        return sum(a.nbytes for a in vars(self).values() if isinstance(a, np.ndarray))
+
+    @property
+    def last_seen(self):
+        """Time of the newest reading processed, None before the first one"""
+        seen = self.last_time[~np.isnat(self.last_time)]
+        return seen.max() if len(seen) else None
+
+    def typical_rate(self):
+        """Average rate per meter over all hour-of-week cells"""
+        seen = self.count.sum(axis=0)
+        return np.divide((self.mean * self.count).sum(axis=0), seen, out=np.zeros(len(self.meters)), where=seen > 0)
+
+    def copy(self):
+        return copy.deepcopy(self)
+
+    def _deltas(self, times, values):
+        """Interval hours and hour-of-week of every reading against the previous valid one"""
+        has = ~np.isnan(values)
+        t = np.where(has, times[:, None], np.datetime64("NaT"))
+        prev_time = pd.DataFrame(np.vstack([self.last_time[None, :], t])).ffill().to_numpy("datetime64[ns]")[:-1]
+        hours = (times[:, None] - prev_time).astype("timedelta64[s]").astype(np.float64) / 3600
+        days = times.astype("datetime64[D]")
+        hour_of_week = ((days.astype(np.int64) + 3) % 7) * 24 + (times - days).astype("timedelta64[h]").astype(np.int64)
+        return hours, hour_of_week
+
+    def _corrected(self, times, values):
+        """
+        Consumption of every reading since the previous valid one, from the
+        delta engine, and the falls classified by this batch as (time, meter,
+        flag). Updates the delta engine state.
+        """
+        delta = np.full(values.shape, np.nan)
+        falls = []
+        for j, meter in enumerate(self.meters):
+            rows = np.flatnonzero(~np.isnan(values[:, j]))
+            if not len(rows):
+                continue
+            kept = ~np.isnan(self.recent_value[j])
+            x = np.r_[self.recent_value[j, kept], values[rows, j]]
+            t = np.r_[self.recent_time[j, kept], times[rows]]
+            high = None if np.isnan(self.high[j]) else self.high[j]
+            c, flags = correct_readings(seconds_since_start(t), x, register_rollover.get(meter), high=high)
+            delta[rows, j] = np.diff(c, prepend=np.nan)[int(kept.sum()):]
+
+            # falls with DROPOUT_READINGS readings after them are final
+            last = len(x) - RECENT_READINGS
+            if last < 0:
+                self.recent_value[j, -len(x):], self.recent_time[j, -len(x):] = x, t
+                continue
+            event = (flags[:last + 1] & (RESET | ROLLOVER)) > 0
+            new = event if np.isnat(self.classified[j]) else event & (t[:last + 1] > self.classified[j])
+            falls += [(t[r], j, flags[r] & (RESET | ROLLOVER)) for r in np.flatnonzero(new)]
+            self.classified[j] = t[last]
+            # high of the readings before the kept ones, since the last reset
+            readings = np.where(flags[:last] & DROPPED, np.nan, x[:last])
+            events = np.flatnonzero(event)
+            if len(events):
+                since = readings[events[-1]:]
+                self.high[j] = np.nanmax(since) if np.isfinite(since).any() else np.nan
+            elif np.isfinite(readings).any():
+                self.high[j] = np.fmax(self.high[j], np.nanmax(readings))
+            self.recent_value[j], self.recent_time[j] = x[last:], t[last:]
+        return delta, falls
+
+    def process(self, times, values) -> pd.DataFrame:
+        """
+        Score a batch of cumulative readings (rows sorted by time, columns in
+        meter order, NaN = no reading) and learn from it. Returns the events.
+        """
+        times = np.asarray(times, dtype="datetime64[ns]")
+        values = np.asarray(values, dtype=np.float64)
+        if not len(times):
+            return _events([])
+        hours, how = self._deltas(times, values)
+        delta, falls = self._corrected(times, values)
+        with np.errstate(invalid="ignore"):
+            gap_ok = (hours > 0) & (hours <= MAX_GAP_HOURS)
+            valid = gap_ok & ~np.isnan(delta)
+        rate = np.where(valid, delta / np.where(gap_ok, hours, 1.0), np.nan)
+
+        # Score against the state at the batch start; the scale never drops below
+        # half the meter's average rate (cells that only ever saw 0 would flag any use)
+        mean, count = self.mean[how], self.count[how]
+        typical = self.typical_rate()
+        scale = np.maximum(np.sqrt(self.var[how]), np.maximum(0.5 * typical, 1e-3))
+        z = np.where(valid & (count >= WARMUP), (rate - mean) / scale, 0.0)
+        # Rows without a reading neither extend nor break a run
+        idle = np.isnan(values)
+        minutes = np.where(idle, 0.0, hours * 60)
+
+        spike = _run_minutes((z >= SPIKE_LEVELS["info"]) | idle, np.where(idle, 0.0, 1.0), self.spike_run)
+        spike_start = _crossed(spike, self.spike_run, 1)
+        sustained = _run_minutes((z >= SUSTAINED_Z) | idle, minutes, self.sustained_run)
+        sustained_start = _crossed(sustained, self.sustained_run, SUSTAINED_MINUTES)
+        zero = valid & (delta == 0) & (count >= WARMUP) & (mean > 0.5 * typical)
+        stuck = _run_minutes(zero | idle, minutes, self.stuck_run)
+        stuck_start = _crossed(stuck, self.stuck_run, STUCK_MINUTES)
+
+        events = []
+        for kind, mask, score, level in (
+            ("spike", spike_start, z, lambda s: _level(s, SPIKE_LEVELS)),
+            ("sustained", sustained_start, z, lambda s: np.full(len(s), "warning", dtype=object)),
+            ("stuck", stuck_start, stuck / STUCK_MINUTES, lambda s: np.full(len(s), "warning", dtype=object)),
+        ):
+            rows, cols = np.nonzero(mask)
+            if len(rows):
+                events.append(pd.DataFrame({
+                    "time": times[rows], "meter": np.array(self.meters, dtype=object)[cols], "kind": kind,
+                    "rate": rate[rows, cols], "expected": mean[rows, cols], "score": score[rows, cols],
+                    "level": level(score[rows, cols]),
+                }))
+        if falls:
+            fall_time, cols, flags = zip(*falls)
+            events.append(pd.DataFrame({
+                "time": np.array(fall_time, dtype="datetime64[ns]"),
+                "meter": np.array(self.meters, dtype=object)[list(cols)],
+                "kind": [FALL_LEVELS[f][0] for f in flags], "rate": np.nan, "expected": np.nan, "score": 0.0,
+                "level": [FALL_LEVELS[f][1] for f in flags],
+            }))
+
+        self._learn(how, rate, valid, mean, scale, count)
+        last = ~np.isnan(values)
+        seen = last.any(axis=0)
+        last_row = len(values) - 1 - np.argmax(last[::-1], axis=0)
+        self.last_value = np.where(seen, values[last_row, np.arange(len(self.meters))], self.last_value)
+        self.last_time = np.where(seen, times[last_row], self.last_time)
+        self.spike_run, self.sustained_run, self.stuck_run = spike[-1], sustained[-1], stuck[-1]
+        return _events(events)
+
+    def _learn(self, how, rate, valid, mean, scale, count):
+        """Fold the batch into the hour-of-week baselines (values clipped to +-3 scale once warm)"""
+        warm = count >= WARMUP
+        clipped = np.where(warm, np.clip(rate, mean - 3 * scale, mean + 3 * scale), rate)
+        m = len(self.meters)
+        cell = (how[:, None] * m + np.arange(m)[None, :])[valid]
+        size = HOURS_OF_WEEK * m
+        k = np.bincount(cell, minlength=size).reshape(HOURS_OF_WEEK, m)
+        total = np.bincount(cell, weights=clipped[valid], minlength=size).reshape(HOURS_OF_WEEK, m)
+        dev2 = np.bincount(cell, weights=(clipped - mean)[valid] ** 2, minlength=size).reshape(HOURS_OF_WEEK, m)
+        seen = k > 0
+        k_safe = np.maximum(k, 1)
+        # EWMA over k intervals, plain running mean while the cell is young
+        w = np.maximum(1 - (1 - ALPHA) ** k, k / np.maximum(self.count + k, 1))
+        self.mean = np.where(seen, self.mean + w * (total / k_safe - self.mean), self.mean)
+        self.var = np.where(seen, (1 - w) * self.var + w * dev2 / k_safe, self.var)
+        self.count = self.count + k
+
+    def process_frame(self, df: pd.DataFrame, time_col="time") -> pd.DataFrame:
+        """process() for a frame of readings; meters missing from the frame count as no reading"""
+        values = np.column_stack([df[m].to_numpy(np.float64) if m in df else np.full(len(df), np.nan)
+                                  for m in self.meters])
+        return self.process(df[time_col].to_numpy("datetime64[ns]"), values)
+
+
+def _events(frames) -> pd.DataFrame:
+    columns = ["time", "meter", "name", "kind", "rate", "expected", "score", "level"]
+    if not frames:
+        return pd.DataFrame(columns=columns).astype({"time": "datetime64[ns]", "rate": float,
+                                                     "expected": float, "score": float})
+    events = pd.concat(frames, ignore_index=True).sort_values(["time", "meter"], kind="stable")
+    events["name"] = events["meter"].map(lambda m: equip_dic.get(m, m))
+    return events[columns].reset_index(drop=True)
+
+
+def replay(table: EnergyTable, meters: Optional[Sequence[str]] = None, batch=REPLAY_BATCH,
+           watch: Optional[MeterWatch] = None, since=None):
+    """
+    Feed historical readings through a detector one time batch (default a
+    day) at a time, as if they arrived live. `watch` continues an existing
+    detector; `since` skips the readings it has already seen.
+    Returns (detector, events).
+    """
+    watch = watch or MeterWatch(meters or list(table.columns))
+    times = table.timestamps
+    lo = 0 if since is None else int(np.searchsorted(times, np.datetime64(since, "ns"), "right"))
+    period = times[lo:].astype(np.int64) // batch.astype("timedelta64[ns]").astype(np.int64)
+    bounds = np.r_[lo + np.flatnonzero(np.r_[True, period[1:] != period[:-1]]), len(times)] if len(period) else []
+    columns = [table.columns.get(m) for m in watch.meters]
+    events = []
+    for start, stop in zip(bounds[:-1], bounds[1:]):
+        rows = slice(int(start), int(stop))
+        values = np.column_stack([c[rows] if c is not None else np.full(rows.stop - rows.start, np.nan)
+                                  for c in columns])
+        events.append(watch.process(times[rows], values))
+    events = [e for e in events if len(e)]
+    return watch, (pd.concat(events, ignore_index=True) if events else _events([]))
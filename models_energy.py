@@ -1,6 +1,11 @@
-from typing import Optional
+from typing import Dict, Iterable, List, Optional
 from datetime import datetime
-from dataclasses import dataclass, field
+from dataclasses import dataclass, field, fields
+
+import numpy as np
+import pandas as pd
+
+from time_utils import date_range_slice
 
 @dataclass
 class Energy:
@@ -69,6 +74,128 @@ class Energy:
     gas3: Optional[float] = None
 
 
+METER_FIELDS = [f.name for f in fields(Energy) if f.name != "timestamp"]
+
+
+class EnergyRow:
+    """Lightweight read-only view of one row of an EnergyTable (same attributes as Energy)"""
+    __slots__ = ("_table", "_i")
+
+    def __init__(self, table, i):
+        self._table = table
+        self._i = i
+
+    @property
+    def timestamp(self):
+        return pd.Timestamp(self._table.timestamps[self._i]).to_pydatetime()
+
+    def __getattr__(self, name):
+        try:
+            value = self._table.columns[name][self._i]
+        except KeyError:
+            raise AttributeError(name) from None
+        return None if np.isnan(value) else float(value)
+
+    def to_energy(self):
+        return Energy(timestamp=self.timestamp, **{m: getattr(self, m) for m in self._table.meters if m in METER_FIELDS})
+
+    def __repr__(self):
+        return f"EnergyRow({self.timestamp:%Y-%m-%d %H:%M:%S}, {len(self._table.columns)} meters)"
+
+
+class EnergyTable:
+    """
+    Columnar replacement for a List[Energy]:
+    one datetime64[ns] timestamp array plus one float array per meter id.
+    Conversion to / from pandas shares the arrays instead of copying them.
+    """
+    __slots__ = ("timestamps", "columns", "attrs")
+
+    def __init__(self, timestamps, columns: Dict[str, np.ndarray]):
+        self.timestamps = np.asarray(timestamps, dtype="datetime64[ns]")
+        self.columns = dict(columns)
+        self.attrs = {}
+        for meter, values in self.columns.items():
+            if len(values) != len(self.timestamps):
+                raise ValueError(f"Column {meter!r} has {len(values)} values for {len(self.timestamps)} timestamps")
+
+    @classmethod
+    def from_frame(cls, df, time_col="time", dtype=np.float64, copy=False):
+        """Take the arrays of a DataFrame (no copy when the column dtype already matches, unless copy=True)"""
+        timestamps = df[time_col].to_numpy("datetime64[ns]", copy=copy)
+        columns = {str(c): df[c].to_numpy(dtype, copy=copy) for c in df.columns if c != time_col}
+        return cls(timestamps, columns)
+
+    @classmethod
+    def from_records(cls, records: Iterable[Energy], dtype=np.float64):
+        """Build from Energy objects (compatibility with the old record list)"""
+        records = list(records)
+        timestamps = np.array([r.timestamp for r in records], dtype="datetime64[ns]")
+        columns = {m: np.array([getattr(r, m) for r in records], dtype=dtype) for m in METER_FIELDS}
+        return cls(timestamps, columns)
+
+    def to_frame(self, time_col="time"):
+        """DataFrame sharing this table's arrays"""
+        data = {time_col: self.timestamps}
+        data.update(self.columns)
+        return pd.DataFrame(data, copy=False)
+
+    @property
+    def meters(self) -> List[str]:
+        return list(self.columns)
+
+    @property
+    def nbytes(self):
+        return int(self.timestamps.nbytes + sum(v.nbytes for v in self.columns.values()))
+
+    def __len__(self):
+        return len(self.timestamps)
+
+    def __getitem__(self, meter):
+        return self.columns[meter]
+
+    def __contains__(self, meter):
+        return meter in self.columns
+
+    def row(self, i):
+        if not -len(self) <= i < len(self):
+            raise IndexError(i)
+        return EnergyRow(self, i % len(self))
+
+    def __iter__(self):
+        return (EnergyRow(self, i) for i in range(len(self)))
+
+    def select(self, meters):
+        """Table restricted to some meters (arrays are shared)"""
+        return EnergyTable(self.timestamps, {m: self.columns[m] for m in meters})
+
+    def take(self, rows):
+        """Rows by slice (view) or index / boolean mask (copy)"""
+        return EnergyTable(self.timestamps[rows], {m: v[rows] for m, v in self.columns.items()})
+
+    @property
+    def is_sorted(self):
+        ts = self.timestamps
+        return bool(len(ts) < 2 or (ts[1:] >= ts[:-1]).all())
+
+    def sorted(self):
+        """Table ordered by timestamp (itself when already sorted); NaT rows go last"""
+        if self.is_sorted:
+            return self
+        return self.take(np.argsort(self.timestamps, kind="stable"))
+
+    def between(self, start=None, end=None):
+        """Rows whose day lies in [start, end] as views; the table must be sorted"""
+        return self.take(date_range_slice(self.timestamps, start, end))
+
+    def freeze(self):
+        """Mark every array read-only"""
+        self.timestamps.flags.writeable = False
+        for values in self.columns.values():
+            values.flags.writeable = False
+        return self
+
+
 @dataclass
 class Process:
     process_id: int = field(default=0)
@@ -3,6 +3,10 @@ import pandas as pd
 import streamlit as st
 import matplotlib.pyplot as plt
 from datetime import datetime
+from time_utils import date_bounds
+from session_data import use_dataset_file, session_df, session_rollups, session_resampled
+from energy_analytics import energy_columns, daily_energy, interval_energy, load_profile, peak_demand
+from chart_downsample import plot_lines
 import matplotlib.dates as mdates
 
 DATA_PATH = r"E:\homework\9001\9001-final\energy_data_2024.xlsx"
@@ -11,19 +15,17 @@ st.set_page_config(page_title="📈 Energy Trend", layout="wide")
 st.markdown("<h1 style='text-align:center;color:#003366;'>📈 Daily Energy Consumption Trend</h1>", unsafe_allow_html=True)
 st.caption("Energy variation analysis within selected period")
 
-if "df" in st.session_state:
-    df = st.session_state["df"]
-    start_date = st.session_state.get("start_date", datetime(2024, 1, 1))
-    end_date = st.session_state.get("end_date", datetime(2024, 3, 31))
+df = session_df()
+if df is not None:
+    first_day, last_day = date_bounds(df["time"])
+    start_date = st.session_state.get("start_date", first_day)
+    end_date = st.session_state.get("end_date", last_day)
     energy_filter = st.session_state.get("energy_filter", ["elec"])
     system_type = st.session_state.get("system_type", "all_equipments")
 
-elif os.path.exists(DATA_PATH):
-    df = pd.read_excel(DATA_PATH)
-    df.rename(columns={df.columns[0]: "time"}, inplace=True)
-    df["time"] = pd.to_datetime(df["time"])
-    start_date = datetime(2024, 1, 1)
-    end_date = datetime(2024, 3, 31)
+elif os.path.isfile(DATA_PATH):
+    df = use_dataset_file(DATA_PATH)
+    start_date, end_date = date_bounds(df["time"])
     energy_filter = ["elec"]
     system_type = "all_equipments"
     st.info("💾 Loaded data from local file instead of session.")
@@ -31,10 +33,8 @@ else:
     st.error("No dataset found. Please upload data in the main dashboard first.")
     st.stop()
 
-df["time"] = pd.to_datetime(df["time"], errors="coerce")
-df["date"] = df["time"].dt.date
 
-energy_cols = [col for col in df.columns if any(col.startswith(e) for e in energy_filter)]
+energy_cols = energy_columns(df.columns, energy_filter)
 if not energy_cols:
     st.error("No matching energy columns found. Please check your selected energy types.")
     st.stop()
@@ -45,24 +45,58 @@ if isinstance(end_date, datetime):
     end_date = end_date.date()
 
 
-df = df[(df["date"] >= start_date) & (df["date"] <= end_date)]
-
-daily_energy = df.groupby("date")[energy_cols].max() - df.groupby("date")[energy_cols].min()
-daily_energy["total_energy"] = daily_energy.sum(axis=1)
+daily_df = daily_energy(session_rollups(), energy_cols, start_date, end_date)
 
 st.markdown(f"**🗓 Selected Period:** `{start_date}` → `{end_date}`")
 st.markdown(f"**🔋 Energy Type:** `{', '.join(energy_filter)}` | **🏭 System Type:** `{system_type}`")
 
+trend_resolution = st.radio("Trend resolution:", ["Daily", "Hourly", "15 min"], horizontal=True,
+                            key="trend_resolution")
+if trend_resolution == "Daily":
+    trend = daily_df["total_energy"]
+else:
+    trend = interval_energy(session_resampled(trend_resolution), energy_cols, start_date, end_date)["total_energy"]
+
 fig, ax = plt.subplots(figsize=(10, 4))
-ax.plot(daily_energy.index, daily_energy["total_energy"], marker='o', color="#007acc")
-num_points = len(daily_energy)
+# LTTB keeps at most a few thousand points of the selected range; markers only while every point is drawn
+plot_lines(ax, trend, method="lttb", marker="o" if len(trend) <= 120 else None, color="#007acc")
+num_points = len(daily_df)
 interval = max(1, num_points // 7)
 ax.xaxis.set_major_locator(mdates.DayLocator(interval=interval))
 fig.autofmt_xdate(rotation=30)
 ax.set_xlabel("Date")
 ax.set_ylabel("Energy Consumption")
-ax.set_title("Daily Energy Consumption Trend")
+ax.set_title(f"{trend_resolution} Energy Consumption Trend")
 ax.grid(True, linestyle="--", alpha=0.5)
 st.pyplot(fig)
+plt.close(fig)
+
+# ===== Load profile and peak demand (fixed-interval slots) =====
+st.markdown("### ⚡ Load Profile and Peak Demand")
+resolution = st.radio("Resolution:", ["15 min", "Hourly"], horizontal=True, key="profile_resolution")
+resampled = session_resampled(resolution)
+profile = load_profile(resampled, energy_cols, start_date, end_date)
+peaks = peak_demand(resampled, energy_cols, start_date, end_date)
+
+site = peaks.loc["total"]
+pc1, pc2 = st.columns(2)
+pc1.metric("Peak demand (all selected leaf meters)", "—" if pd.isna(site["peak load"]) else f"{site['peak load']:,.1f}")
+pc2.metric("Peak at", "—" if pd.isna(site["peak at"]) else f"{site['peak at']:%Y-%m-%d %H:%M}")
+
+fig2, ax2 = plt.subplots(figsize=(10, 3.5))
+hours = profile.index.total_seconds() / 3600
+ax2.step(hours, profile["total_load"], where="post", color="#ff7f0e")
+ax2.set_xlim(0, 24)
+ax2.set_xticks(range(0, 25, 3))
+ax2.set_xlabel("Hour of day")
+ax2.set_ylabel("Average load per hour")
+ax2.set_title(f"Average Daily Load Profile ({resolution})")
+ax2.grid(True, linestyle="--", alpha=0.5)
+st.pyplot(fig2)
+plt.close(fig2)
+
+with st.expander("Peak demand per meter"):
+    st.dataframe(peaks.dropna(subset=["peak load"]).sort_values("peak load", ascending=False)
+                 .round({"peak load": 2}), use_container_width=True)
 
 st.page_link("main.py", label="⬅️ Back to Dashboard", icon="🏠")
\ No newline at end of file
@@ -1,32 +1,30 @@
 import streamlit as st
-import pandas as pd
+from session_data import session_rollups, session_events
 import matplotlib.pyplot as plt
-from datetime import datetime
+from time_utils import date_bounds
+from chart_downsample import plot_lines
 
 st.set_page_config(page_title="⚡ Device Energy Trend", layout="wide")
 st.markdown("<h1 style='text-align:center;color:#003366;'>⚡ Device Daily Energy Trend</h1>", unsafe_allow_html=True)
 st.caption("View daily energy consumption trend for selected devices.")
 
-if "df" not in st.session_state:
+rollups = session_rollups()
+if rollups is None:
     st.warning("Please load dataset from the main dashboard first.")
     st.stop()
 
-df = st.session_state["df"]
 selected_devices = st.session_state.get("selected_devices", [])
-start_date = st.session_state.get("start_date", datetime(2024, 1, 1).date())
-end_date = st.session_state.get("end_date", datetime(2024, 3, 31).date())
+first_day, last_day = date_bounds(rollups.level("D").keys)
+start_date = st.session_state.get("start_date", first_day)
+end_date = st.session_state.get("end_date", last_day)
 
 if not selected_devices:
     st.info("Please select one or more devices from the left sidebar on the main dashboard.")
     st.stop()
 
-df["time"] = pd.to_datetime(df["time"], errors="coerce")
-df["date"] = df["time"].dt.date
-df = df[(df["date"] >= start_date) & (df["date"] <= end_date)]
-
 # Daily energy consumption
 try:
-    daily_energy = df.groupby("date")[selected_devices].agg(lambda x: x.max() - x.min())
+    daily_energy = rollups.consumption("Daily", selected_devices, start_date, end_date)
 except KeyError:
     st.error("Selected devices not found in current dataset.")
     st.stop()
@@ -34,12 +32,27 @@ except KeyError:
 st.markdown(f"**📅 Period:** `{start_date}` → `{end_date}` | **Devices:** `{', '.join(selected_devices)}`")
 
 fig, ax = plt.subplots(figsize=(9, 4))
-daily_energy.plot(ax=ax)
+plot_lines(ax, daily_energy)   # min / max per bucket: every device keeps its peaks
 ax.set_title("Daily Energy Consumption (Selected Devices)", fontsize=12, color="#003366")
 ax.set_xlabel("Date")
 ax.set_ylabel("Energy Usage (kWh / m³)")
 ax.grid(True, linestyle="--", alpha=0.4)
 ax.legend(bbox_to_anchor=(1.02, 1), loc="upper left", fontsize=7)
 st.pyplot(fig, use_container_width=True)
+plt.close(fig)
+
+# Anomalies flagged by the streaming detector (meter_watch) for the selected devices
+st.subheader("🚨 Flagged Events")
+events = session_events(start_date, end_date, selected_devices)
+if events is None or events.empty:
+    st.info("No anomalies flagged for the selected devices in this period.")
+else:
+    levels = st.multiselect("Severity", ["critical", "warning", "info"], default=["critical", "warning"],
+                            key="event_levels")
+    shown = events[events["level"].isin(levels)]
+    cols = st.columns(4)
+    for col, kind in zip(cols, ["spike", "sustained", "stuck", "reset"]):
+        col.metric(kind, int((shown["kind"] == kind).sum()))
+    st.dataframe(shown.round({"rate": 3, "expected": 3, "score": 2}), use_container_width=True, hide_index=True)
 
 st.page_link("main.py", label="⬅️ Back to Dashboard", icon="🏠")
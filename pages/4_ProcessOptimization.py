@@ -1,150 +1,22 @@
 import streamlit as st
 import pandas as pd
 import plotly.express as px
-from datetime import datetime, date
+from datetime import datetime
 
-from config_equipment import utility_system, equipments
+from config_equipment import utility_system, equipments, product_process_map
 from models_energy import Process
-
-def _parse_equips(equip_str):
-    """Parse the device field into a list"""
-    if not equip_str or str(equip_str).strip() == "":
-        return ["<Unnamed device>"]
-    parts = [p.strip() for p in str(equip_str).replace("，", ",").split(",") if p.strip()]
-    return parts or ["<Unnamed device>"]
-
-def _merged_total_hours(intervals):
-    """Total duration of the union"""
-    if not intervals:
-        return 0.0
-    ivs = sorted(intervals, key=lambda x: x[0])
-    merged = []
-    cs, ce = ivs[0]
-    for s, e in ivs[1:]:
-        if s <= ce:
-            ce = max(ce, e)
-        else:
-            merged.append((cs, ce))
-            cs, ce = s, e
-    merged.append((cs, ce))
-    return sum((e - s).total_seconds() / 3600 for s, e in merged)
-
-def compute_parallel_saving_by_day(processes, energy_df, utility_cols):
-    """
-    - Parallel duration: The union length of all process time periods within a day (ignoring equipment constraints)
-    - Fully parallel duration: When the same equipment cannot be concurrently operated → Add up the process durations of each equipment for the day; Optimized duration = The maximum value of the total durations of all equipment
-    - Energy saving rate = 1 - (Fully parallel / Original parallel)
-    - Utility system energy consumption: Cumulate (maximum - minimum) by da
-    """
-    if energy_df is None or energy_df.empty:
-        return pd.DataFrame(), 0.0
-    if not utility_cols:
-        return pd.DataFrame(), 0.0
-
-    df = energy_df.copy()
-    if "time" not in df.columns:
-        df.rename(columns={df.columns[0]: "time"}, inplace=True)
-    df["time"] = pd.to_datetime(df["time"], errors="coerce")
-    df["date"] = df["time"].dt.date
-
-    by_day = {}
-    for p in processes:
-        if not hasattr(p, "start_time") or not hasattr(p, "end_time"):
-            continue
-        if p.start_time is None or p.end_time is None:
-            continue
-        d = p.process_date if isinstance(p.process_date, date) else getattr(p.process_date, "date", lambda: None)()
-        if d is None:
-            getattr(p.start_time, "date", lambda: None)()
-        if d is None:
-            continue
-        by_day.setdefault(d, []).append(p)
-
-    results, total_saving = [], 0.0
-
-    for d, plist in by_day.items():
-        if not plist:
-            continue
-
-        intervals = []
-        for p in plist:
-            s = pd.to_datetime(p.start_time, errors="coerce")
-            e = pd.to_datetime(p.end_time, errors="coerce")
-            if pd.isna(s) or pd.isna(e) or e <= s:
-                continue
-            intervals.append((s, e))
-        if not intervals:
-            continue
-        original_hours = _merged_total_hours(intervals)
-
-        # Fully Parallel: Devices with the same name cannot run concurrently → Calculate the total duration for each device and take the maximum value
-        # Note: If a process uses multiple devices, its duration should be included in the total duration of each device
-        equip_total_hours = {}
-        for p in plist:
-            s = pd.to_datetime(p.start_time, errors="coerce")
-            e = pd.to_datetime(p.end_time, errors="coerce")
-            if pd.isna(s) or pd.isna(e) or e <= s:
-                continue
-            dur_h = (e - s).total_seconds() / 3600
-            for equip in _parse_equips(getattr(p, "equipments", "")):
-                equip_total_hours[equip] = equip_total_hours.get(equip, 0.0) + dur_h
-        optimized_hours = max(equip_total_hours.values()) if equip_total_hours else 0.0
-
-        day_df = df[df["date"] == d]
-        if day_df.empty:
-            continue
-
-        cols_utility = [c for c in utility_cols if c in day_df.columns]
-        if not cols_utility:
-            continue
-
-        day_use_utility = day_df.groupby("date")[cols_utility].max() - day_df.groupby("date")[cols_utility].min()
-        public_kwh = float(day_use_utility.sum(axis=1).iloc[0]) if not day_use_utility.empty else 0.0
-
-        # Total plant energy consumption
-        all_cols = [c for c in day_df.columns if any(c.startswith(e) for e in ["elec"])]
-        day_use_total = day_df.groupby("date")[all_cols].max() - day_df.groupby("date")[all_cols].min() if all_cols else pd.DataFrame()
-        total_kwh = float(day_use_total.sum(axis=1).iloc[0]) if not day_use_total.empty else 0.0
-
-        # Energy-saving conversion
-        if original_hours > 0:
-            ratio = max(0.0, 1.0 - optimized_hours / original_hours)
-            saving_kwh = public_kwh * ratio
-            optimized_kwh = public_kwh - saving_kwh
-        else:
-            ratio, saving_kwh, optimized_kwh = 0.0, 0.0, public_kwh
-
-        total_saving += saving_kwh
-        public_ratio = (public_kwh / total_kwh * 100.0) if total_kwh > 0 else 0.0
-
-        # record
-        results.append({
-            "date": d,
-            "Original parallel duration(h)": round(original_hours, 2),
-            "Total parallel duration(h)": round(optimized_hours, 2),
-            "Total parallel duration(%)": round(ratio * 100.0, 2),
-            "Energy consumption of public system(kWh)": round(public_kwh, 2),
-            "Total plant energy consumption(kWh)": round(total_kwh, 2),
-            "The proportion of public systems(%)": round(public_ratio, 2),
-            "Save electricity(kWh)": round(saving_kwh, 2),
-            "Optimized expected energy consumption(kWh)": round(optimized_kwh, 2)
-        })
-
-    return pd.DataFrame(results), float(total_saving)
-
+from session_data import session_rollups, session_df
+from energy_analytics import compute_parallel_saving_by_day, parse_equips
+from schedule_optimizer import optimize_schedule, schedule_table
+from process_table import ProcessTable, import_schedule
+from scenarios import run_scenarios, standard_scenarios
+from schedule_cost import schedule_costs
+from time_utils import date_bounds
 
 # New process entry (form) - All keys must be unique
 # ===== 页面标题 =====
 st.markdown("## ✏️ Add New Process Record")
 
-product_process_map = {
-    "ganoderma lucidum spore powder": ["sieving", "inner packing", "external packing", "Linked packaging"],
-    "Ironwood Maple Bark Granules": ["weigh-batching hopper", "One-step granulation", "inner packing", "external packing", "Linked packaging"],
-    "American Ginseng Granules": ["weigh-batching hopper", "One-step granulation", "inner packing", "external packing", "Linked packaging"],
-    "Ganoderma lucidum spore powder capsule": ["weigh-batching hopper", "One-step granulation", "Capsule filling", "inner packing", "external packing", "Linked packaging"],
-    "Ganoderma lucidum spore powder tablets": ["weigh-batching hopper", "wet granulation", "tabletting", "lagging cover", "inner packing", "external packing", "Linked packaging"]
-}
-
 col_a, col_b = st.columns(2)
 with col_a:
     product_type = st.selectbox(
@@ -161,6 +33,10 @@ with col_b:
         key=f"select_process_{product_type}"
     )
 
+# New processes default to the first day of the loaded data
+df = session_df()
+first_day = date_bounds(df["time"] if df is not None else [])[0]
+
 # form :other choice
 with st.form("add_process_form", clear_on_submit=True):
     st.write("### 🧾 Fill in Process Details")
@@ -168,7 +44,7 @@ with st.form("add_process_form", clear_on_submit=True):
     col1, col2, col3 = st.columns(3)
 
     with col1:
-        process_date = st.date_input("process date", value=date(2024, 1, 4), key="inp_process_date")
+        process_date = st.date_input("process date", value=first_day, key="inp_process_date")
         size = st.text_input("specification", placeholder="2*15*16", key="inp_size")
         number = st.number_input("batch number", min_value=1, step=1, key="inp_number")
 
@@ -215,39 +91,43 @@ with st.form("add_process_form", clear_on_submit=True):
             process_time=duration
         )
 
-        st.session_state.setdefault("processes", [])
-        st.session_state["processes"].append(process)
+        table = st.session_state.get("process_table") or ProcessTable.empty()
+        st.session_state["process_table"] = table.concat(ProcessTable.from_processes([process]))
         st.success(
             f"process【{process_name}】have been added！\n\n"
             f"date：{process_date} | time：{duration:.2f} h | equipment：{equip_selected}"
         )
 
 
+# Bulk import of a process schedule (e.g. a month exported from the MES)
+with st.expander("📤 Import Process Schedule (Excel / CSV)"):
+    st.caption("One row per process. Headers as in the process list below (or Process field names); "
+               "start / end may be full date-times or times of day.")
+    schedule_file = st.file_uploader("Schedule file", type=["xlsx", "csv"], key="schedule_uploader")
+    if schedule_file is not None and st.button("Import schedule", key="btn_import_schedule"):
+        try:
+            imported, report = import_schedule(schedule_file)
+        except ValueError as e:
+            st.error(f"Import rejected: {e}")
+        else:
+            table = st.session_state.get("process_table") or ProcessTable.empty()
+            st.session_state["process_table"] = table.concat(imported)
+            st.success(f"{report.rows_imported} of {report.rows_read} rows imported.")
+            if report.rows_rejected:
+                st.warning(f"{report.rows_rejected} rows rejected:")
+                st.dataframe(report.errors, use_container_width=True)
+
 # Current process schedule
 st.markdown("### 📋 Current Process List")
-if st.session_state.get("processes"):
-    data = [{
-        "Process Date": p.process_date.strftime("%Y-%m-%d"),
-        "Process Name": p.process_name,
-        "Product name": p.product_type,
-        "size": p.size,
-        "batch number": p.number,
-        "input": p.investnumber,
-        "Number of positions": p.worker_number,
-        "production quantity": p.pronumber,
-        "start time": p.start_time.strftime("%H:%M"),
-        "end time": p.end_time.strftime("%H:%M"),
-        "equipment": p.equipments,
-        "time(h)": round(p.process_time, 2)
-    } for p in st.session_state["processes"]]
-
-    df_process = pd.DataFrame(data)
-    st.dataframe(df_process, use_container_width=True)
+process_table = st.session_state.get("process_table")
+if process_table:
+    st.dataframe(process_table.display_frame(), use_container_width=True)
 
     delete_index = st.number_input("🗑️ Enter the sequence number of the process to be deleted (starting from 1)", min_value=0, step=1, key="inp_del_idx")
     if st.button("Delete Process", key="btn_delete_process"):
-        if 0 < delete_index <= len(st.session_state["processes"]):
-            deleted = st.session_state["processes"].pop(delete_index - 1)
+        if 0 < delete_index <= len(process_table):
+            deleted = process_table.row(delete_index - 1)
+            st.session_state["process_table"] = process_table = process_table.drop(delete_index - 1)
             st.warning(f"Deleted process【{deleted.process_name}】")
         else:
             st.info("Please enter the correct number")
@@ -255,17 +135,18 @@ else:
     st.info("The process has not been entered yet. Please fill in the information above")
 
 # Process optimization scheduling + Energy-saving analysis
-if st.session_state.get("processes"):
+if process_table:
     st.markdown("### ⚙️ Optimization Result")
+    work_hours = st.slider("Working hours for shift placement", 0, 24, (6, 22), key="work_hours")
 
     if st.button("🚀 Start optimizing the scheduling", key="btn_run_opt"):
-        processes = sorted(st.session_state["processes"], key=lambda p: p.start_time)
+        ordered = process_table.sorted()
 
         # ===== nergy-saving analysis of public systems(important!)
-        energy_df = st.session_state.get("df", None)
+        energy_rollups = session_rollups()
         df_saving, total_saving_kwh = compute_parallel_saving_by_day(
-            processes,
-            energy_df,
+            ordered.arrays(),
+            energy_rollups,
             utility_system
         )
 
@@ -287,31 +168,65 @@ if st.session_state.get("processes"):
             st.dataframe(df_saving, use_container_width=True)
             st.success(f"Estimate the total energy savings: {total_saving_kwh:.2f} kWh")
 
-            # Gantt Chart: Fully Parallel
-            st.markdown("### 📊 Gantt Chart —  Fully Parallel")
-            start_min = min(p.start_time for p in processes)
-            # Calculate the total duration of each device for this day
+            # Optimized schedule: equipment conflicts, product route order and positions respected
+            processes = ordered.to_processes()
+            schedules = optimize_schedule(processes)
+            process_table.set_optimized(processes)
+            st.markdown("### 🗓️ Optimized Schedule")
+            st.dataframe(pd.DataFrame([{
+                "date": s.day,
+                "Original window(h)": round(s.original_window_h, 2),
+                "Optimized window(h)": round(s.optimized_window_h, 2),
+                "Lower bound(h)": round(s.lower_bound_h, 2),
+                "Window reduction(%)": round(s.saving_ratio * 100, 1),
+                "Positions available": s.worker_capacity,
+            } for s in schedules]), use_container_width=True)
+            st.caption("A window longer than the original means the original times ran the same equipment "
+                       "twice at once or broke the product route order.")
+
+            # Time-of-use cost: tariff price of each minute x utility load added by production
+            st.markdown("### 💴 Utility Cost by Shift Placement")
+            df_cost, cost_curves = schedule_costs(process_table, session_df(), utility_cols=utility_system,
+                                                  hours=work_hours)
+            st.dataframe(df_cost.round({c: 2 for c in df_cost.columns if "yuan" in c}), use_container_width=True)
+            if not df_cost.empty:
+                first = df_cost.iloc[0]
+                st.success(f"{first['date']}: starting the optimized schedule at {first['Best start']:%H:%M} "
+                           f"costs {first['Best cost(yuan)']:.2f} yuan of utility power.")
+                st.line_chart(cost_curves[first["date"]].set_index("start")["cost"], height=220)
+
+            # Gantt Chart of the first day
+            st.markdown("### 📊 Gantt Chart — Optimized Schedule")
             day = df_saving.iloc[0]["date"]
-            plist_day = [p for p in processes if (p.process_date if isinstance(p.process_date, date) else p.process_date.date()) == day]
-            equip_hours = {}
-            for p in plist_day:
-                dur_h = (pd.to_datetime(p.end_time) - pd.to_datetime(p.start_time)).total_seconds() / 3600
-                for eq in _parse_equips(getattr(p, "equipments", "")):
-                    equip_hours[eq] = equip_hours.get(eq, 0.0) + dur_h
-
-            df_parallel = pd.DataFrame([{
+            df_day = schedule_table([s for s in schedules if s.day == day])
+            df_gantt = pd.DataFrame([{
                 "Task": f"equipment：{eq}",
-                "Start": start_min,
-                "Finish": start_min + pd.to_timedelta(h, unit="h"),
-                "Type": "Fully parallel"
-            } for eq, h in equip_hours.items()])
+                "Start": row["optimized start"],
+                "Finish": row["optimized end"],
+                "Type": row["process"],
+            } for _, row in df_day.iterrows() for eq in parse_equips(row["equipment"])])
 
-            if not df_parallel.empty:
-                fig2 = px.timeline(df_parallel, x_start="Start", x_end="Finish", y="Task", color="Type")
+            if not df_gantt.empty:
+                fig2 = px.timeline(df_gantt, x_start="Start", x_end="Finish", y="Task", color="Type")
                 fig2.update_yaxes(autorange="reversed")
                 fig2.update_layout(height=420, xaxis_title="time", yaxis_title="Equipment (same equipment cannot be used concurrently)")
                 st.plotly_chart(fig2, use_container_width=True)
+                st.dataframe(df_day, use_container_width=True)
             else:
                 st.info("There are no visible equipment loads available for viewing on that day")
         else:
             st.warning("Unable to match the energy consumption data of the public system or there are no valid processes on that day")
+
+    # What-if comparison: shifted times, merged batches, a second tablet press
+    st.markdown("### 🔀 What-if Scenarios")
+    st.caption("Each scenario changes the process list above and is scored on the public-system energy "
+               "saved, computed like the analysis above, then on the time-of-use cost of its operating "
+               "windows (what a shift changes). Scenarios run in parallel worker processes.")
+    if st.button("Compare scenarios", key="btn_run_scenarios"):
+        base = process_table.sorted()
+        ranked = run_scenarios(base, standard_scenarios(base), session_rollups(), utility_system,
+                               readings=session_df())
+        st.dataframe(ranked, use_container_width=True)
+        best = ranked.iloc[0]
+        st.success(f"Best scenario: {best['scenario']} ({best['vs base(kWh)']:+.2f} kWh, "
+                   f"{best['cost vs base(yuan)']:+.2f} yuan vs the current schedule)")
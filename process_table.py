@@ -0,0 +1,249 @@
+# ============================================
+# Columnar process table + bulk schedule import
+# A month of MES schedule rows is kept as one array per Process field instead
+# of a list of dataclasses; Process objects are only built when needed.
+# ============================================
+import io
+import re
+from dataclasses import dataclass, field, asdict
+from typing import Dict, List
+
+import numpy as np
+import pandas as pd
+
+from config_equipment import product_process_map, utility_system, equipments
+from energy_analytics import ProcessArrays, parse_equips
+from models_energy import Process
+from time_utils import normalize_time
+
+FIELD_DTYPES = {
+    "process_id": "int64", "process_date": "datetime64[ns]", "product_type": object,
+    "process_name": object, "size": object, "number": "int64", "investnumber": "float64",
+    "worker_number": "int64", "pronumber": "float64", "start_time": "datetime64[ns]",
+    "end_time": "datetime64[ns]", "equipments": object, "process_time": "float64",
+    "optimize_start_time": "datetime64[ns]", "optimize_end_time": "datetime64[ns]",
+}
+# Headers of the process list on the optimization page (also accepted on import)
+DISPLAY_COLUMNS = {
+    "process_date": "Process Date", "process_name": "Process Name", "product_type": "Product name",
+    "size": "size", "number": "batch number", "investnumber": "input",
+    "worker_number": "Number of positions", "pronumber": "production quantity",
+    "start_time": "start time", "end_time": "end time", "equipments": "equipment",
+    "process_time": "time(h)",
+}
+DEVICE_IDS = frozenset(utility_system + equipments)
+_TIME_ONLY = re.compile(r"\d{1,2}:\d{2}(:\d{2}(\.\d+)?)?")
+
+
+class ProcessTable:
+    """Process records as column arrays (one per Process field)"""
+
+    __slots__ = ("columns",)
+
+    def __init__(self, columns: Dict[str, np.ndarray]):
+        self.columns = columns
+
+    @classmethod
+    def empty(cls):
+        return cls({name: np.empty(0, dtype=dtype) for name, dtype in FIELD_DTYPES.items()})
+
+    @classmethod
+    def from_frame(cls, df):
+        """Frame with Process field columns (missing ones get the Process defaults)"""
+        n, defaults = len(df), Process.__dataclass_fields__
+        columns = {}
+        for name, dtype in FIELD_DTYPES.items():
+            if name in df:
+                values = df[name]
+            elif np.dtype(dtype).kind == "M":
+                values = pd.Series(pd.NaT, index=range(n))
+            else:
+                values = pd.Series([defaults[name].default] * n)
+            columns[name] = values.to_numpy(dtype)
+        return cls(columns)
+
+    @classmethod
+    def from_processes(cls, processes):
+        return cls.from_frame(pd.DataFrame([asdict(p) for p in processes], columns=list(FIELD_DTYPES)))
+
+    def to_frame(self):
+        return pd.DataFrame(self.columns, copy=False)
+
+    def display_frame(self):
+        """The table as shown on the optimization page"""
+        df = self.to_frame()[list(DISPLAY_COLUMNS)]
+        df["process_date"] = df["process_date"].dt.strftime("%Y-%m-%d")
+        df["start_time"] = df["start_time"].dt.strftime("%H:%M")
+        df["end_time"] = df["end_time"].dt.strftime("%H:%M")
+        df["process_time"] = df["process_time"].round(2)
+        return df.rename(columns=DISPLAY_COLUMNS)
+
+    def __len__(self):
+        return len(self.columns["process_id"])
+
+    def row(self, i) -> Process:
+        """Process object of one row"""
+        values = {}
+        for name, col in self.columns.items():
+            v = col[i]
+            if col.dtype.kind == "M":
+                v = None if np.isnat(v) else pd.Timestamp(v).to_pydatetime()
+            elif isinstance(v, np.generic):
+                v = v.item()
+            values[name] = v
+        if values["process_date"] is not None:
+            values["process_date"] = values["process_date"].date()
+        return Process(**values)
+
+    def to_processes(self) -> List[Process]:
+        return [self.row(i) for i in range(len(self))]
+
+    def concat(self, other):
+        """New table with the rows of `other` appended (process ids renumbered)"""
+        columns = {k: np.concatenate([v, other.columns[k]]) for k, v in self.columns.items()}
+        columns["process_id"] = np.arange(len(columns["process_id"]), dtype="int64")
+        return ProcessTable(columns)
+
+    def drop(self, i):
+        """New table without row i"""
+        return ProcessTable({k: np.delete(v, i) for k, v in self.columns.items()})
+
+    def take(self, rows):
+        return ProcessTable({k: v[rows] for k, v in self.columns.items()})
+
+    def sorted(self):
+        """Rows ordered by start time"""
+        return self.take(np.argsort(self.columns["start_time"], kind="stable"))
+
+    def arrays(self) -> ProcessArrays:
+        """Input of compute_parallel_saving_by_day, without building Process objects"""
+        days = self.columns["process_date"].astype("datetime64[D]")
+        starts, ends = self.columns["start_time"], self.columns["end_time"]
+        days = np.where(np.isnat(days), starts.astype("datetime64[D]"), days)
+        return ProcessArrays(days, starts, ends, [parse_equips(e) for e in self.columns["equipments"]])
+
+    def set_optimized(self, processes):
+        """Copy optimize_start_time / optimize_end_time back from Process objects (matched by process_id)"""
+        pos = {pid: i for i, pid in enumerate(self.columns["process_id"])}
+        opt_start = self.columns["optimize_start_time"].copy()
+        opt_end = self.columns["optimize_end_time"].copy()
+        for p in processes:
+            i = pos.get(p.process_id)
+            if i is not None and p.optimize_start_time is not None:
+                opt_start[i] = np.datetime64(p.optimize_start_time, "ns")
+                opt_end[i] = np.datetime64(p.optimize_end_time, "ns")
+        self.columns["optimize_start_time"] = opt_start
+        self.columns["optimize_end_time"] = opt_end
+
+
+# ============================================
+# Bulk import
+# ============================================
+@dataclass
+class ImportReport:
+    rows_read: int = 0
+    rows_imported: int = 0
+    errors: pd.DataFrame = field(default_factory=lambda: pd.DataFrame(columns=["row", "column", "error"]))
+
+    @property
+    def rows_rejected(self):
+        return self.rows_read - self.rows_imported
+
+
+def read_schedule(source):
+    """CSV / Excel schedule (path, uploaded file or DataFrame) as a raw frame"""
+    if isinstance(source, pd.DataFrame):
+        return source.copy()
+    name = getattr(source, "name", str(source)).lower()
+    data = io.BytesIO(source.getvalue()) if hasattr(source, "getvalue") else source
+    return pd.read_csv(data) if name.endswith(".csv") else pd.read_excel(data)
+
+
+def _rename_headers(df):
+    """Accept Process field names and the page's display headers, case-insensitively"""
+    lookup = {k.lower(): k for k in FIELD_DTYPES}
+    lookup.update({v.lower(): k for k, v in DISPLAY_COLUMNS.items()})
+    return df.rename(columns=lambda c: lookup.get(str(c).strip().lower(), c))
+
+
+def _parse_times(values, dates):
+    """
+    Times in one pass: full date-times are parsed with normalize_time, bare
+    times of day ("08:00", Excel time cells) are added to the process date.
+    """
+    text = values.astype("string").str.strip()
+    time_only = text.str.fullmatch(_TIME_ONLY).fillna(False).astype(bool)
+    clock = text.where(time_only).str.replace(r"^(\d{1,2}:\d{2})$", r"\1:00", regex=True)
+    offsets = pd.to_timedelta(clock, errors="coerce")
+    full, _ = normalize_time(values.where(~time_only & values.notna()))
+    return full.where(~time_only, dates + offsets)
+
+
+def validate_schedule(df):
+    """
+    (valid rows as a Process-field frame, error rows). Checks: product in
+    product_process_map, process on that product's route, every equipment id
+    known, parsable times with end after start.
+    """
+    df = _rename_headers(df).reset_index(drop=True)
+    n = len(df)
+    errors = []
+
+    def reject(mask, column, message):
+        for r in np.flatnonzero(mask):
+            errors.append({"row": int(r) + 2, "column": column, "error": message})  # +2: header + 1-based
+
+    for col in ("product_type", "process_name", "start_time", "end_time", "equipments"):
+        if col not in df:
+            raise ValueError(f"Schedule has no '{DISPLAY_COLUMNS.get(col, col)}' column")
+
+    out = pd.DataFrame(index=df.index)
+    for col in ("product_type", "process_name", "size", "equipments"):
+        out[col] = df[col].astype("string").str.strip().fillna("").astype(object) if col in df else ""
+
+    # Names against the product routes
+    product_ok = out["product_type"].isin(product_process_map)
+    reject(~product_ok, "product_type", "unknown product")
+    routes = out["product_type"].map(lambda p: product_process_map.get(p, ()))
+    route_ok = pd.Series([name in route for name, route in zip(out["process_name"], routes)], index=df.index)
+    reject(product_ok & ~route_ok, "process_name", "process not on the product route")
+
+    # Equipment ids
+    unknown = [", ".join(e for e in parse_equips(v) if e not in DEVICE_IDS) for v in out["equipments"]]
+    equip_ok = pd.Series([u == "" for u in unknown], index=df.index)
+    for r in np.flatnonzero(~equip_ok):
+        errors.append({"row": int(r) + 2, "column": "equipments", "error": f"unknown equipment {unknown[r]}"})
+
+    # Times
+    if "process_date" in df:
+        dates, _ = normalize_time(df["process_date"])
+        dates = dates.dt.normalize()
+    else:
+        dates = pd.Series(pd.NaT, index=df.index, dtype="datetime64[ns]")
+    out["start_time"] = _parse_times(df["start_time"], dates)
+    out["end_time"] = _parse_times(df["end_time"], dates)
+    out["process_date"] = dates.fillna(out["start_time"].dt.normalize())
+    time_ok = out["start_time"].notna() & out["end_time"].notna()
+    reject(~time_ok, "start_time / end_time", "unreadable time")
+    order_ok = ~time_ok | (out["end_time"] > out["start_time"])
+    reject(~order_ok, "end_time", "end is not after start")
+
+    # Numbers
+    for col, default in (("number", 0), ("worker_number", 1), ("investnumber", 0.0), ("pronumber", 0.0)):
+        values = pd.to_numeric(df[col], errors="coerce") if col in df else pd.Series(default, index=df.index)
+        out[col] = values.fillna(default)
+    reject(out["worker_number"] < 0, "worker_number", "negative number of positions")
+
+    ok = product_ok & route_ok & equip_ok & time_ok & order_ok & (out["worker_number"] >= 0)
+    out = out[ok].reset_index(drop=True)
+    out["process_time"] = (out["end_time"] - out["start_time"]).dt.total_seconds() / 3600
+    out["process_id"] = np.arange(len(out))
+    error_frame = pd.DataFrame(errors, columns=["row", "column", "error"]).sort_values("row", kind="stable")
+    return out, error_frame.reset_index(drop=True)
+
+
+def import_schedule(source):
+    """Read and validate a schedule file. Returns (ProcessTable of the valid rows, ImportReport)"""
+    raw = read_schedule(source)
+    valid, errors = validate_schedule(raw)
+    return ProcessTable.from_frame(valid), ImportReport(len(raw), len(valid), errors)
@@ -0,0 +1,135 @@
+# ============================================
+# Fixed-interval resampling of cumulative meter readings
+# Readings arrive at irregular times. Every meter is put on one regular grid
+# (1 min / 15 min / hourly slots of the days that have readings): the
+# corrected cumulative (meter_deltas) is interpolated at the slot edges and
+# differenced, so consumption is conserved and a slot between two readings
+# gets its share by time. The result is plain (slots x meters) arrays.
+# ============================================
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Sequence
+
+import numpy as np
+import pandas as pd
+
+from config_equipment import register_rollover
+from meter_deltas import correct_readings, seconds_since_start, long_gaps, NO_DATA
+from models_energy import EnergyTable
+from time_utils import date_range_slice
+
+# Resolution label -> slot minutes
+RESOLUTIONS = {"1 min": 1, "15 min": 15, "Hourly": 60}
+
+
+@dataclass
+class ResampledTable:
+    minutes: int                 # slot length
+    days: np.ndarray             # datetime64[D], the days with readings
+    columns: List[str]
+    use: np.ndarray              # slots x meters consumption, NaN outside a meter's readings
+    quality: np.ndarray          # slots x meters quality flags of the readings in / closing the slot
+
+    def __post_init__(self):
+        self.col_pos = {c: i for i, c in enumerate(self.columns)}
+
+    @property
+    def slots_per_day(self):
+        return 24 * 60 // self.minutes
+
+    @property
+    def starts(self) -> np.ndarray:
+        """Start time of every slot (datetime64[ns])"""
+        offsets = np.arange(self.slots_per_day) * np.timedelta64(self.minutes, "m")
+        return (self.days.astype("datetime64[ns]")[:, None] + offsets[None, :]).ravel()
+
+    @property
+    def nbytes(self):
+        return self.use.nbytes + self.quality.nbytes
+
+    def _rows(self, start=None, end=None):
+        days = date_range_slice(self.days, start, end)
+        return slice(days.start * self.slots_per_day, days.stop * self.slots_per_day)
+
+    def _idx(self, columns):
+        return [self.col_pos[c] for c in (self.columns if columns is None else columns)]  # KeyError for unknown meters
+
+    def consumption(self, columns=None, start=None, end=None) -> pd.DataFrame:
+        """Consumption per slot within [start, end]"""
+        rows, idx = self._rows(start, end), self._idx(columns)
+        return pd.DataFrame(self.use[rows][:, idx], index=pd.Index(self.starts[rows], name="time"),
+                            columns=[self.columns[i] for i in idx])
+
+    def power(self, columns=None, start=None, end=None) -> pd.DataFrame:
+        """Average load (kW for elec meters) per slot"""
+        return self.consumption(columns, start, end) * (60 / self.minutes)
+
+    def load_profile(self, columns=None, start=None, end=None) -> pd.DataFrame:
+        """Average load per slot of the day over the days in range (rows: time of day)"""
+        rows, idx = self._rows(start, end), self._idx(columns)
+        load = self.use[rows][:, idx].reshape(-1, self.slots_per_day, len(idx)) * (60 / self.minutes)
+        with np.errstate(invalid="ignore"):
+            profile = np.nanmean(load, axis=0) if len(load) else np.full((self.slots_per_day, len(idx)), np.nan)
+        index = pd.timedelta_range(0, periods=self.slots_per_day, freq=f"{self.minutes}min", name="time of day")
+        return pd.DataFrame(profile, index=index, columns=[self.columns[i] for i in idx])
+
+    def peak_demand(self, columns=None, start=None, end=None) -> pd.DataFrame:
+        """Highest slot load and its time per meter, plus the coincident peak of their sum ("total")"""
+        load = self.power(columns, start, end)
+        total = load.sum(axis=1, min_count=1)
+        load["total"] = total
+        has = load.notna().any()
+        peaks = load.loc[:, has].max()
+        at = load.loc[:, has].idxmax()
+        return pd.DataFrame({"peak load": peaks, "peak at": at}).reindex(load.columns)
+
+
+def resample(table: EnergyTable, minutes: int, columns: Optional[Sequence[str]] = None,
+             registers: Optional[Dict[str, float]] = None) -> ResampledTable:
+    """Consumption of every meter of a table (sorted by time) on a grid of `minutes` slots"""
+    if (24 * 60) % minutes:
+        raise ValueError(f"Slot length must divide a day, got {minutes} minutes")
+    columns = list(table.columns) if columns is None else list(columns)
+    registers = register_rollover if registers is None else registers
+    times = table.timestamps
+    days = np.unique(times.astype("datetime64[D]"))
+    spd = 24 * 60 // minutes
+    # column-major and written in full below
+    use = np.empty((len(columns), len(days) * spd)).T
+    quality = np.empty((len(columns), len(days) * spd), dtype=np.uint8).T
+    if not len(times):
+        return ResampledTable(minutes, days, columns, use, quality)
+
+    # Slot edges and the readings around them: the same for every meter
+    t = seconds_since_start(times)
+    edges = (days.astype("datetime64[ns]")[:, None]
+             + np.arange(spd + 1) * np.timedelta64(minutes, "m") - times[0]).astype(np.int64) / 1e9
+    left = np.clip(np.searchsorted(t, edges, "right") - 1, 0, max(len(t) - 2, 0))
+    right = np.minimum(left + 1, len(t) - 1)
+    span = t[right] - t[left]
+    weight = np.clip(np.divide(edges - t[left], span, out=np.zeros_like(edges), where=span > 0), 0.0, 1.0)
+    first_row = np.minimum(np.searchsorted(t, edges[:, :-1].ravel(), "left"), len(t) - 1)
+    one_reading = (np.diff(first_row) <= 1).all()   # no slot holds two readings: gather instead of reduce
+    row_gaps = long_gaps(t)
+
+    # reused by every meter
+    buffers = np.empty(len(t)), np.empty(len(t), dtype=np.uint8)
+    at_edges, step = np.empty(edges.shape), np.empty(edges.shape)
+    for j, col in enumerate(columns):
+        c, flags = correct_readings(t, table.columns[col], registers.get(col), row_gaps, out=buffers)
+        np.take(c, right, out=step)
+        np.take(c, left, out=at_edges)
+        step -= at_edges
+        step *= weight
+        at_edges += step
+        slot_use = use[:, j]
+        np.subtract(at_edges[:, 1:], at_edges[:, :-1], out=slot_use.reshape(len(days), spd))
+        if one_reading:
+            np.take(flags, first_row, out=quality[:, j])
+        else:
+            np.bitwise_or.reduceat(flags, first_row, out=quality[:, j])
+        if flags[0] & NO_DATA or flags[-1] & NO_DATA:
+            if one_reading:
+                slot_use[(quality[:, j] & NO_DATA) > 0] = np.nan
+            else:
+                slot_use[np.logical_and.reduceat((flags & NO_DATA) > 0, first_row)] = np.nan
+    return ResampledTable(minutes, days, columns, use, quality)
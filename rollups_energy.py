@@ -0,0 +1,470 @@
+# ============================================
+# Daily / weekly / monthly rollups of cumulative meter readings
+# Built once when the dataset loads; every page reads consumption from here
+# instead of grouping the raw readings again. Consumption ("use") comes from
+# the delta engine (meter_deltas): resets, rollovers, dropouts and gaps are
+# handled there, and each day carries the quality flags of its readings.
+# ============================================
+import numpy as np
+import pandas as pd
+
+from config_equipment import register_rollover
+from meter_deltas import (correct_readings, seconds_since_start, long_gaps, day_edges, day_totals, QUALITY_FLAGS,
+                          RESET, ROLLOVER, DROPOUT_READINGS)
+from time_utils import to_day, date_range_slice
+
+READING_STATS = ("min", "max", "first", "last", "count")
+STATS = READING_STATS + ("use", "flags")
+# Aggregation period radio value -> level code
+LEVELS = {"Daily": "D", "Weekly": "W", "Monthly": "M"}
+INDEX_NAMES = {"D": "date", "W": "week_start", "M": "month"}
+# Rows per block when scanning raw readings, so memory-mapped stores larger
+# than RAM are aggregated with bounded temporary memory
+BLOCK_ROWS = 4_000_000
+
+
+def _period_start(days, level):
+    """Period start day of every day key (weeks start on Monday, like to_period('W'))"""
+    if level == "D":
+        return days
+    if level == "W":
+        # 1970-01-01 was a Thursday
+        weekday = (days.astype("int64") + 3) % 7
+        return days - weekday.astype("timedelta64[D]")
+    if level == "M":
+        return days.astype("datetime64[M]").astype("datetime64[D]")
+    raise ValueError(f"Unknown rollup level: {level!r}")
+
+
+def _period_end(day, level):
+    """Last day of the period containing `day`"""
+    start = _period_start(np.array([day], dtype="datetime64[D]"), level)[0]
+    if level == "D":
+        return start
+    if level == "W":
+        return start + 6
+    return (start.astype("datetime64[M]") + 1).astype("datetime64[D]") - 1
+
+
+def _segment_stats(values, starts, ends):
+    """min/max/first/last/count of each [start, end) segment, NaN-aware"""
+    valid = ~np.isnan(values)
+    count = np.add.reduceat(valid, starts)
+    has = count > 0
+    pos = np.flatnonzero(valid)
+    first = np.full(len(starts), np.nan)
+    last = np.full(len(starts), np.nan)
+    first[has] = values[pos[np.searchsorted(pos, starts[has])]]
+    last[has] = values[pos[np.searchsorted(pos, ends[has]) - 1]]
+    return {"min": np.fmin.reduceat(values, starts), "max": np.fmax.reduceat(values, starts),
+            "first": first, "last": last, "count": count}
+
+
+def _reading_rollup(times, arrays, columns, block_rows=BLOCK_ROWS):
+    """
+    Daily stats of raw readings sorted by time (no NaT). Days are contiguous row
+    runs, so each block is reduced with reduceat; blocks end on day boundaries.
+    Works directly on memory-mapped arrays.
+    """
+    n = len(times)
+    dtypes = {k: "int64" if k == "count" else "float64" for k in READING_STATS}
+    keys = [np.empty(0, dtype="datetime64[D]")]
+    parts = {k: [np.empty((0, len(columns)), dtype=dtypes[k])] for k in READING_STATS}
+    lo = 0
+    while lo < n:
+        hi = min(n, lo + block_rows)
+        if hi < n:
+            # extend the block to the end of its last day
+            last_day = times[hi - 1].astype("datetime64[D]")
+            hi = int(np.searchsorted(times, (last_day + 1).astype(times.dtype), "left"))
+        days = np.asarray(times[lo:hi]).astype("datetime64[D]")
+        starts = np.flatnonzero(np.r_[True, days[1:] != days[:-1]])
+        ends = np.r_[starts[1:], len(days)]
+        keys.append(days[starts])
+        block = {k: np.empty((len(starts), len(columns)), dtype=dtypes[k]) for k in READING_STATS}
+        for j, col in enumerate(columns):
+            for k, v in _segment_stats(np.asarray(arrays[col][lo:hi], dtype="float64"), starts, ends).items():
+                block[k][:, j] = v
+        for k in READING_STATS:
+            parts[k].append(block[k])
+        lo = hi
+    return np.concatenate(keys), {k: np.concatenate(v) for k, v in parts.items()}
+
+
+def _daily_use(times, arrays, columns, keys):
+    """
+    Consumption and quality flags per day and meter from the delta engine.
+    One meter column at a time: memory is O(rows), not O(rows x meters).
+    """
+    use = np.empty((len(keys), len(columns)))
+    flags = np.empty((len(keys), len(columns)), dtype=np.uint8)
+    if not len(times):
+        return use, flags
+    times = np.asarray(times)
+    days = times.astype("datetime64[D]")
+    day_starts = np.flatnonzero(np.r_[True, days[1:] != days[:-1]])
+    t, edges = seconds_since_start(times), day_edges(times, keys)
+    row_gaps = long_gaps(t)
+    buffers = np.empty(len(times)), np.empty(len(times), dtype=np.uint8)   # reused by every meter
+    for j, col in enumerate(columns):
+        cumulative, quality = correct_readings(t, arrays[col], register_rollover.get(col), row_gaps, out=buffers)
+        use[:, j], flags[:, j] = day_totals(t, cumulative, quality, day_starts, edges)
+    return use, flags
+
+
+def _last_valid(values, row, block=4096):
+    """Row of the last reading before `row` that is not NaN, or -1 (searched backwards in growing blocks)"""
+    hi = row
+    while hi > 0:
+        lo = max(0, hi - block)
+        found = np.flatnonzero(~np.isnan(values[lo:hi]))
+        if len(found):
+            return lo + int(found[-1])
+        hi, block = lo, block * 2
+    return -1
+
+
+def _first_valid(values, row, block=4096):
+    """Row of the first reading from `row` on that is not NaN, or -1"""
+    lo = row
+    while lo < len(values):
+        hi = min(len(values), lo + block)
+        found = np.flatnonzero(~np.isnan(values[lo:hi]))
+        if len(found):
+            return lo + int(found[0])
+        lo, block = hi, block * 2
+    return -1
+
+
+def _first_at_least(values, row, threshold, block=4096):
+    """Row of the first reading from `row` on that is >= threshold, or -1"""
+    lo = row
+    while lo < len(values):
+        hi = min(len(values), lo + block)
+        found = np.flatnonzero(np.asarray(values[lo:hi]) >= threshold)
+        if len(found):
+            return lo + int(found[0])
+        lo, block = hi, block * 2
+    return -1
+
+
+def _nanmax(values):
+    values = np.asarray(values, dtype="float64")
+    values = values[~np.isnan(values)]
+    return float(values.max()) if len(values) else np.nan
+
+
+def _day_row(times, day):
+    """First row of a day, or of the first day after it"""
+    return int(np.searchsorted(times, np.datetime64(day, "D").astype(times.dtype), "left"))
+
+
+def _last_event(times, values, register, lo, hi):
+    """
+    Last reset / rollover row of one meter in [lo, hi), or -1. The reading
+    before lo and DROPOUT_READINGS readings after hi are read too, so a
+    dropout is told from a reset as on the whole column.
+    """
+    start = _last_valid(values, lo)
+    start = lo if start < 0 else start
+    end = hi
+    for _ in range(DROPOUT_READINGS):
+        after = _first_valid(values, end)
+        if after < 0:
+            break
+        end = after + 1
+    window = np.asarray(times[start:end])
+    _, flags = correct_readings(seconds_since_start(window), np.asarray(values[start:end], dtype="float64"), register)
+    events = np.flatnonzero(flags[lo - start:hi - start] & (RESET | ROLLOVER))
+    return lo + int(events[-1]) if len(events) else -1
+
+
+def _segment_high(times, values, register, row, daily, j):
+    """
+    Highest reading of meter j from its last reset / rollover up to `row`: the
+    jitter high the delta engine carries past `row`. Whole days come from the
+    daily "max" stat and flags; only the rows of row's day and of the reset
+    day are read.
+    """
+    high, end = np.nan, row + 1
+    p = int(np.searchsorted(daily.keys, times[row].astype("datetime64[D]"), "left"))
+    while True:
+        start = _day_row(times, daily.keys[p])
+        event = _last_event(times, values, register, start, end)
+        if event >= 0:
+            return np.fmax(high, _nanmax(values[event:end]))
+        high = np.fmax(high, _nanmax(values[start:end]))
+        flagged = np.flatnonzero(daily.stats["flags"][:p, j] & (RESET | ROLLOVER))
+        k = int(flagged[-1]) if len(flagged) else -1
+        high = np.fmax(high, _nanmax(daily.stats["max"][k + 1:p, j]))
+        if k < 0:
+            return high
+        p, end = k, _day_row(times, daily.keys[k] + 1)
+
+
+def _window_use(times, values, register, keys, daily, j):
+    """
+    Consumption and flags of meter j for some consecutive days with rows
+    (keys), matching _daily_use over the whole column. The rows of those days
+    are widened by DROPOUT_READINGS + 1 valid readings on each side (so the
+    dropouts and resets around the edges are classified the same), and the
+    correction starts from the jitter high before the window (_segment_high
+    over the unchanged days of `daily`).
+    """
+    a, b = _day_row(times, keys[0]), _day_row(times, keys[-1] + 1)
+    lo, hi = a, b
+    for _ in range(DROPOUT_READINGS + 1):
+        before = _last_valid(values, lo)
+        if before < 0:
+            break
+        lo = before
+    for _ in range(DROPOUT_READINGS + 1):
+        after = _first_valid(values, hi)
+        if after < 0:
+            break
+        hi = after + 1
+    high = _segment_high(times, values, register, lo, daily, j) if lo < a else None
+    window = np.asarray(times[lo:hi])
+    t = seconds_since_start(window)
+    base = max(lo - 1, 0)   # the step into the first row counts too
+    row_gaps = long_gaps(seconds_since_start(times[base:hi])) + base - lo
+    cumulative, quality = correct_readings(t, np.asarray(values[lo:hi], dtype="float64"), register, row_gaps,
+                                           high=high)
+    days = window[a - lo:b - lo].astype("datetime64[D]")
+    day_starts = np.flatnonzero(np.r_[True, days[1:] != days[:-1]])
+    return day_totals(t, cumulative, quality[a - lo:b - lo], day_starts, day_edges(window, keys))
+
+
+def _daily_rollup(times, arrays, columns, block_rows=BLOCK_ROWS):
+    """Daily rollup: reading stats per block, consumption over whole columns"""
+    keys, stats = _reading_rollup(times, arrays, columns, block_rows)
+    stats["use"], stats["flags"] = _daily_use(times, arrays, columns, keys)
+    return Rollup("D", keys, columns, stats)
+
+
+def _frame_arrays(df, columns):
+    """(sorted timestamps without NaT, column arrays) of a frame of readings"""
+    if not df["time"].is_monotonic_increasing:
+        df = df.sort_values("time", kind="stable")
+    times = df["time"].to_numpy("datetime64[ns]")
+    valid = slice(0, len(times) - int(np.isnat(times).sum()))  # NaT sorts last
+    return times[valid], {c: df[c].to_numpy("float64")[valid] for c in columns}
+
+
+class Rollup:
+    """Reading stats, consumption and quality flags per period and meter, stored as 2-D arrays (periods × meters)"""
+
+    def __init__(self, level, keys, columns, stats):
+        self.level = level
+        self.keys = keys                      # sorted datetime64[D] period starts
+        self.columns = list(columns)
+        self.col_pos = {c: i for i, c in enumerate(self.columns)}
+        self.stats = stats                    # name -> ndarray (len(keys), len(columns))
+
+    def __len__(self):
+        return len(self.keys)
+
+    def _frame(self, stat):
+        return pd.DataFrame(self.stats[stat], index=self.keys, columns=self.columns)
+
+    def regroup(self, level):
+        """Combine the rows of this rollup into a coarser level"""
+        key = _period_start(self.keys, level)
+        stats = {
+            "min": self._frame("min").groupby(key).min(),
+            "max": self._frame("max").groupby(key).max(),
+            "first": self._frame("first").groupby(key).first(),
+            "last": self._frame("last").groupby(key).last(),
+            "count": self._frame("count").groupby(key).sum(),
+            "use": self._frame("use").groupby(key).sum(min_count=1),
+        }
+        keys = stats["min"].index.to_numpy("datetime64[D]")
+        stats = {k: v.to_numpy() for k, v in stats.items()}
+        runs = np.flatnonzero(np.r_[True, key[1:] != key[:-1]]) if len(key) else np.empty(0, dtype=np.int64)
+        stats["flags"] = (np.bitwise_or.reduceat(self.stats["flags"], runs, axis=0) if len(runs)
+                          else self.stats["flags"][:0])
+        return Rollup(level, keys, self.columns, stats)
+
+    def slice(self, start=None, end=None):
+        """Rows whose key lies in [start, end] (binary search on the sorted keys)"""
+        rows = date_range_slice(self.keys, start, end)
+        return Rollup(self.level, self.keys[rows], self.columns,
+                      {k: v[rows] for k, v in self.stats.items()})
+
+    def splice(self, fresh, first_key, last_key):
+        """Replace the rows with keys in [first_key, last_key] by the rows of `fresh`"""
+        a = int(np.searchsorted(self.keys, first_key, "left"))
+        b = int(np.searchsorted(self.keys, last_key, "right"))
+        keys = np.concatenate([self.keys[:a], fresh.keys, self.keys[b:]])
+        stats = {k: np.concatenate([v[:a], fresh.stats[k], v[b:]]) for k, v in self.stats.items()}
+        return Rollup(self.level, keys, self.columns, stats)
+
+    def consumption(self, columns=None):
+        """Consumption per period (from the delta engine) as a DataFrame"""
+        columns = self.columns if columns is None else list(columns)
+        idx = [self.col_pos[c] for c in columns]  # KeyError for unknown meters
+        index = pd.Index(self.keys.astype(object), name=INDEX_NAMES[self.level])
+        return pd.DataFrame(self.stats["use"][:, idx], index=index, columns=columns)
+
+    def quality(self, columns=None) -> pd.DataFrame:
+        """Number of periods per quality flag and meter"""
+        columns = self.columns if columns is None else list(columns)
+        flags = self.stats["flags"][:, [self.col_pos[c] for c in columns]]
+        return pd.DataFrame({name: ((flags & bit) > 0).sum(axis=0) for bit, name in QUALITY_FLAGS.items()},
+                            index=pd.Index(columns, name="meter"))
+
+
+class CumulativeIndex:
+    """
+    Prefix sums of daily consumption per meter.
+    Total of any meter over any [start, end] = two binary searches + one subtraction.
+    """
+
+    def __init__(self, days, columns, daily_values):
+        self.days = days                                   # sorted datetime64[D]
+        self.columns = list(columns)
+        self.col_pos = {c: i for i, c in enumerate(self.columns)}
+        cum = np.zeros((len(days) + 1, len(self.columns)))
+        np.nancumsum(daily_values, axis=0, out=cum[1:])   # missing days count as 0, like sum(skipna)
+        self.cum = cum
+
+    @classmethod
+    def from_rollup(cls, daily):
+        return cls(daily.keys, daily.columns, daily.stats["use"])
+
+    def updated(self, daily, first_day):
+        """Index for a new daily rollup that only differs from `first_day` on; the prefix before it is kept"""
+        p = int(np.searchsorted(self.days, first_day, "left"))
+        index = CumulativeIndex.__new__(CumulativeIndex)
+        index.days = daily.keys
+        index.columns = self.columns
+        index.col_pos = self.col_pos
+        values = daily.stats["use"][p:]
+        cum = np.empty((len(daily.keys) + 1, len(self.columns)))
+        cum[:p + 1] = self.cum[:p + 1]
+        np.nancumsum(values, axis=0, out=cum[p + 1:])
+        cum[p + 1:] += self.cum[p]
+        index.cum = cum
+        return index
+
+    def bounds(self, start=None, end=None):
+        rows = date_range_slice(self.days, start, end)
+        return rows.start, rows.stop
+
+    def n_days(self, start=None, end=None):
+        """Number of days with readings in the range"""
+        lo, hi = self.bounds(start, end)
+        return hi - lo
+
+    def total(self, column, start=None, end=None):
+        lo, hi = self.bounds(start, end)
+        i = self.col_pos[column]
+        return float(self.cum[hi, i] - self.cum[lo, i])
+
+    def totals(self, columns=None, start=None, end=None):
+        """Per-meter totals over the range as a Series"""
+        columns = self.columns if columns is None else list(columns)
+        idx = [self.col_pos[c] for c in columns]
+        lo, hi = self.bounds(start, end)
+        return pd.Series(self.cum[hi, idx] - self.cum[lo, idx], index=columns)
+
+
+class EnergyRollups:
+    """Daily, weekly and monthly rollups of every meter column"""
+
+    def __init__(self, levels, cumulative=None):
+        self.levels = levels  # level code -> Rollup
+        self.columns = levels["D"].columns
+        self.cumulative = cumulative or CumulativeIndex.from_rollup(levels["D"])
+
+    @classmethod
+    def from_frame(cls, df, columns=None):
+        """One pass over the raw readings; weeks and months are combined from days"""
+        if columns is None:
+            columns = [c for c in df.columns if c != "time"]
+        times, arrays = _frame_arrays(df, columns)
+        daily = _daily_rollup(times, arrays, columns)
+        return cls({"D": daily, "W": daily.regroup("W"), "M": daily.regroup("M")})
+
+    @classmethod
+    def from_table(cls, table):
+        """Same as from_frame for an EnergyTable sorted by time without NaT (e.g. memory-mapped)"""
+        daily = _daily_rollup(table.timestamps, table.columns, table.meters)
+        return cls({"D": daily, "W": daily.regroup("W"), "M": daily.regroup("M")})
+
+    def updated(self, table, first_day, last_day):
+        """
+        Rollups after readings between first_day and last_day changed.
+        `table` is the merged EnergyTable sorted by time without NaT. Only the
+        raw rows of the affected days are read again: reading stats for
+        [first_day, last_day], and per meter the consumption of the days a
+        changed reading can reach: from the valid reading before the change
+        (or the DROPOUT_READINGS rows before it, whose dropouts look ahead) to
+        the first reading after it at or above both the old and the new jitter
+        high (until then the changed high holds use back), and at least to the
+        next day with rows.
+        Weeks / months and the prefix sums are re-combined from the first
+        recomputed day on. Falls back to a full rebuild if the meters changed.
+        """
+        columns = list(table.meters)
+        if columns != self.columns:
+            return EnergyRollups.from_table(table)
+        first_day, last_day = to_day(first_day), to_day(last_day)
+        times = table.timestamps
+        rows = date_range_slice(times, first_day, last_day)
+        keys, stats = _reading_rollup(times[rows], {c: table.columns[c][rows] for c in columns}, columns)
+        stats["use"] = np.full((len(keys), len(columns)), np.nan)
+        stats["flags"] = np.zeros((len(keys), len(columns)), dtype=np.uint8)
+        old = self.levels["D"].slice(first_day, last_day)
+        daily = self.levels["D"].splice(Rollup("D", keys, columns, stats), first_day, last_day)
+        if not len(daily):
+            return EnergyRollups({"D": daily, "W": daily.regroup("W"), "M": daily.regroup("M")})
+
+        day_of = lambda row: times[row].astype("datetime64[D]")
+        # the first row after the change may lose its long-gap flag: its day is always redone
+        next_day = day_of(rows.stop) if rows.stop < len(times) else last_day
+        first_changed, last_changed = first_day, next_day
+        for j, col in enumerate(columns):
+            values, register = table.columns[col], register_rollover.get(col)
+            before, after = _last_valid(values, rows.start), _first_valid(values, rows.stop)
+            lo_row = max(rows.start - DROPOUT_READINGS, 0)
+            lo = min(day_of(min(before, lo_row) if before >= 0 else lo_row), first_day)
+            hi = next_day
+            if after >= 0:
+                high = np.fmax(_segment_high(times, values, register, after, daily, j),
+                               _nanmax(old.stats["max"][:, j]) if len(old) else np.nan)
+                clear = _first_at_least(values, after, high) if not np.isnan(high) else after
+                hi = max(day_of(clear) if clear >= 0 else daily.keys[-1], next_day)
+            days = date_range_slice(daily.keys, lo, hi)
+            daily.stats["use"][days, j], daily.stats["flags"][days, j] = _window_use(
+                times, values, register, daily.keys[days], daily, j)
+            first_changed, last_changed = min(first_changed, lo), max(last_changed, hi)
+
+        levels = {"D": daily}
+        for code in ("W", "M"):
+            lo = _period_start(np.array([first_changed]), code)[0]
+            hi = _period_start(np.array([last_changed]), code)[0]
+            fresh = daily.slice(lo, _period_end(last_changed, code)).regroup(code)
+            levels[code] = self.levels[code].splice(fresh, lo, hi)
+        return EnergyRollups(levels, self.cumulative.updated(daily, first_changed))
+
+    def level(self, period):
+        """Rollup for a level code or an aggregation period label ("Daily", ...)"""
+        return self.levels[LEVELS.get(period, period)]
+
+    def consumption(self, period="D", columns=None, start=None, end=None):
+        """
+        Consumption per period within [start, end].
+        Partial weeks / months at the range edges are re-combined from the daily
+        rows, so the result matches grouping the filtered raw readings.
+        """
+        code = LEVELS.get(period, period)
+        daily = self.levels["D"]
+        if code == "D":
+            return daily.slice(start, end).consumption(columns)
+        whole = len(daily) == 0 or (
+            (start is None or to_day(start) <= daily.keys[0])
+            and (end is None or to_day(end) >= daily.keys[-1]))
+        if whole:
+            return self.levels[code].consumption(columns)
+        return daily.slice(start, end).regroup(code).consumption(columns)
@@ -0,0 +1,201 @@
+# ============================================
+# What-if scenarios for the process schedule
+# Each scenario applies perturbations (shift times, merge batches, add a
+# second machine, ...) to a base process table and is scored on the utility
+# energy saved, computed like compute_parallel_saving_by_day, and (given the
+# readings) on the time-of-use cost of its operating windows (schedule_cost),
+# which is what a shift changes. Scenarios run on a process pool; the base
+# table and the read-only rollups are sent to every worker once
+# (initializer), a task only carries its scenario.
+# ============================================
+import os
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field
+from typing import List, Optional, Sequence
+
+import numpy as np
+import pandas as pd
+
+from config_equipment import utility_system
+from energy_analytics import compute_parallel_saving_by_day, parse_equips
+from energy_cost import Tariff
+from process_table import ProcessTable
+from schedule_cost import operating_load, table_cost, utility_load_profile
+
+
+# ============================================
+# Perturbations: ProcessTable -> new ProcessTable
+# ============================================
+def _uses(table, equipment):
+    """Rows whose equipment field contains the id"""
+    return np.array([equipment in parse_equips(e) for e in table.columns["equipments"]], dtype=bool)
+
+
+@dataclass
+class ShiftTimes:
+    """Move processes by some hours (all, or one product / one equipment); a process moved past midnight changes day"""
+    hours: float
+    product: Optional[str] = None
+    equipment: Optional[str] = None
+
+    def apply(self, table):
+        mask = np.ones(len(table), dtype=bool)
+        if self.product is not None:
+            mask &= table.columns["product_type"] == self.product
+        if self.equipment is not None:
+            mask &= _uses(table, self.equipment)
+        delta = np.timedelta64(int(round(self.hours * 3600)), "s")
+        columns = dict(table.columns)
+        for col in ("start_time", "end_time"):
+            columns[col] = np.where(mask, table.columns[col] + delta, table.columns[col])
+        process_date = table.columns["process_date"]
+        shifted_day = columns["start_time"].astype("datetime64[D]").astype(process_date.dtype)
+        columns["process_date"] = np.where(mask, shifted_day, process_date)
+        return ProcessTable(columns)
+
+
+@dataclass
+class MergeBatches:
+    """
+    Run the batches of one product step back to back as a single process per
+    day and equipment (one set-up, starting with the earliest batch)
+    """
+    product: str
+    process_name: Optional[str] = None
+
+    def apply(self, table):
+        df = table.to_frame()
+        mask = df["product_type"] == self.product
+        if self.process_name is not None:
+            mask &= df["process_name"] == self.process_name
+        if not mask.any():
+            return table
+        part = df[mask].assign(day=df.loc[mask, "start_time"].dt.normalize(),
+                               duration=df.loc[mask, "end_time"] - df.loc[mask, "start_time"])
+        merged = part.groupby(["day", "process_name", "equipments"], sort=False).agg(
+            first=("start_time", "min"), duration=("duration", "sum"), worker_number=("worker_number", "max"),
+            number=("number", "first"), pronumber=("pronumber", "sum"), investnumber=("investnumber", "sum"),
+            process_date=("process_date", "first"), size=("size", "first"), product_type=("product_type", "first"),
+        ).reset_index()
+        merged["start_time"] = merged["first"]
+        merged["end_time"] = merged["first"] + merged["duration"]
+        merged["process_time"] = merged["duration"].dt.total_seconds() / 3600
+        return ProcessTable.from_frame(df[~mask]).concat(ProcessTable.from_frame(merged))
+
+
+@dataclass
+class AddEquipment:
+    """A second machine (e.g. tablet press elec53 next to elec52): every other process of the day moves to it"""
+    existing: str
+    added: str
+
+    def apply(self, table):
+        df = table.to_frame()
+        rows = np.flatnonzero(_uses(table, self.existing))
+        if len(rows) == 0:
+            return table
+        part = df.iloc[rows]
+        nth = part.sort_values("start_time").groupby(part["start_time"].dt.normalize()).cumcount()
+        moved = nth.index[nth.to_numpy() % 2 == 1]
+        equips = table.columns["equipments"].copy()
+        for i in moved:
+            equips[i] = ",".join(self.added if e == self.existing else e for e in parse_equips(equips[i]))
+        return ProcessTable({**table.columns, "equipments": equips})
+
+
+@dataclass
+class Scenario:
+    name: str
+    perturbations: list = field(default_factory=list)
+
+    def apply(self, table):
+        for perturbation in self.perturbations:
+            table = perturbation.apply(table)
+        return table
+
+
+# ============================================
+# Evaluation
+# ============================================
+def evaluate(table, rollups, utility_cols=utility_system, costing=None):
+    """
+    Score of one process table: the numbers compute_parallel_saving_by_day
+    reports, and the utility cost of its times when `costing` = (hourly
+    operating load, Tariff) is given (NaN otherwise)
+    """
+    cost = table_cost(table, *costing) if costing is not None else np.nan
+    df, saving = compute_parallel_saving_by_day(table.arrays(), rollups, utility_cols)
+    if df.empty:
+        return {"saving_kwh": 0.0, "original_h": 0.0, "optimized_h": 0.0, "public_kwh": 0.0, "days": 0,
+                "cost_yuan": cost}
+    return {
+        "saving_kwh": saving,
+        "original_h": float(df["Original parallel duration(h)"].sum()),
+        "optimized_h": float(df["Total parallel duration(h)"].sum()),
+        "public_kwh": float(df["Energy consumption of public system(kWh)"].sum()),
+        "days": len(df),
+        "cost_yuan": cost,
+    }
+
+
+# Per-worker read-only state, set once by the pool initializer
+_shared = {}
+
+
+def _init_worker(base, rollups, utility_cols, costing):
+    _shared.update(base=base, rollups=rollups, utility_cols=utility_cols, costing=costing)
+
+
+def _run(scenario):
+    table = scenario.apply(_shared["base"])
+    return {"scenario": scenario.name,
+            **evaluate(table, _shared["rollups"], _shared["utility_cols"], _shared["costing"])}
+
+
+def run_scenarios(base: ProcessTable, scenarios: Sequence[Scenario], rollups,
+                  utility_cols=utility_system, workers: Optional[int] = None,
+                  readings=None, tariff: Optional[Tariff] = None) -> pd.DataFrame:
+    """
+    Evaluate every scenario against the base schedule and rank them by utility
+    energy saved, then by utility cost (needs the meter `readings` for the
+    load profile; the tariff defaults to the configured one). workers=1 runs
+    in this process (no pool start-up cost).
+    """
+    scenarios = [Scenario("base")] + list(scenarios)
+    costing = None
+    if readings is not None:
+        costing = (operating_load(utility_load_profile(readings, utility_cols)), tariff or Tariff.from_config())
+    workers = min(workers or os.cpu_count() or 1, len(scenarios))
+    if workers <= 1:
+        _init_worker(base, rollups, utility_cols, costing)
+        rows = [_run(s) for s in scenarios]
+    else:
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                                 initargs=(base, rollups, utility_cols, costing)) as pool:
+            rows = list(pool.map(_run, scenarios, chunksize=max(1, len(scenarios) // (4 * workers))))
+
+    result = pd.DataFrame(rows)
+    base_row = result.iloc[0]
+    result["vs base(kWh)"] = result["saving_kwh"] - base_row["saving_kwh"]
+    result["window vs base(h)"] = result["optimized_h"] - base_row["optimized_h"]
+    result["cost vs base(yuan)"] = result["cost_yuan"] - base_row["cost_yuan"]
+    result = result.sort_values(["saving_kwh", "cost_yuan", "optimized_h"], ascending=[False, True, True],
+                                kind="stable")
+    result.insert(0, "rank", np.arange(1, len(result) + 1))
+    return result.reset_index(drop=True).round(2)
+
+
+def standard_scenarios(table: ProcessTable) -> List[Scenario]:
+    """
+    Scenarios management asks for first: shift changes, merged batches, a
+    second tablet press. A shift only shows up in the cost, so run these with
+    the readings.
+    """
+    scenarios = [Scenario(f"shift all {h:+g} h", [ShiftTimes(h)]) for h in (-2, -1, 1, 2)]
+    for product in sorted(set(table.columns["product_type"])):
+        scenarios.append(Scenario(f"merge batches: {product}", [MergeBatches(product)]))
+    scenarios.append(Scenario("second tablet press elec53", [AddEquipment("elec52", "elec53")]))
+    scenarios.append(Scenario("second tablet press + merge all",
+                              [AddEquipment("elec52", "elec53")] +
+                              [MergeBatches(p) for p in sorted(set(table.columns["product_type"]))]))
+    return scenarios
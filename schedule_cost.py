@@ -0,0 +1,172 @@
+# ============================================
+# Time-of-use cost of a process schedule
+# The utility system (air compressors, chillers, purified water, ...) runs
+# while any process runs. Its cost for an operating window is read from a
+# per-day lookup: the price of each minute's tariff band (month and weekend
+# calendars included) x utility load added by production (from the
+# historical hourly profile), summed up per minute, so a window costs two
+# lookups and a schedule O(processes).
+# ============================================
+import math
+from dataclasses import dataclass
+from typing import Dict, Optional, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+
+from config_equipment import utility_system
+from energy_cost import Tariff, interval_deltas
+from models_energy import EnergyTable
+
+LOOKUP_HOURS = 48           # least lookup length; longer schedules get a longer lookup
+SHIFT_STEP_MINUTES = 30     # start times tried by shift_curve
+
+
+def utility_load_profile(data, utility_cols: Sequence[str] = utility_system) -> np.ndarray:
+    """Average utility load (kW) per hour of day over the readings (EnergyTable or frame)"""
+    table = data if isinstance(data, EnergyTable) else EnergyTable.from_frame(data)
+    cols = [c for c in utility_cols if c in table.columns]
+    starts, hours, kwh = interval_deltas(table, cols)
+    hour = (starts - starts.astype("datetime64[D]")).astype("timedelta64[h]").astype(np.int64)
+    kwh_by_hour = np.bincount(hour, weights=kwh.sum(axis=1), minlength=24)
+    hours_by_hour = np.bincount(hour, weights=hours, minlength=24)
+    return np.divide(kwh_by_hour, hours_by_hour, out=np.zeros(24), where=hours_by_hour > 0)
+
+
+def operating_load(profile, floor_kw=0.0) -> np.ndarray:
+    """
+    Utility load added by production at each hour: the measured profile above
+    the night base load (its lowest hour), which runs whatever the schedule.
+    `floor_kw` is the least load an hour is costed at; with the default 0 an
+    hour at base load adds nothing.
+    """
+    profile = np.asarray(profile, dtype=np.float64)
+    base = profile.min() if profile.size else 0.0
+    return np.maximum(profile - base, floor_kw)
+
+
+def union_segments(starts, ends) -> Tuple[np.ndarray, np.ndarray]:
+    """Disjoint operating windows covered by the intervals (datetime64[ns])"""
+    order = np.argsort(starts, kind="stable")
+    s, e = starts[order], ends[order]
+    reach = np.maximum.accumulate(e.astype(np.int64)).astype("datetime64[ns]") if len(e) else e
+    new = np.r_[True, s[1:] > reach[:-1]] if len(s) else np.zeros(0, dtype=bool)
+    first = np.flatnonzero(new)
+    last = np.r_[first[1:] - 1, len(s) - 1] if len(first) else first
+    return s[first], reach[last]
+
+
+@dataclass
+class CostLookup:
+    """Cumulative utility cost (yuan) by minute from the start of `origin`, for the schedule of one day"""
+    day: np.datetime64
+    tariff: Tariff
+    load_kw: np.ndarray       # 24 hourly utility loads
+    cumulative: np.ndarray    # one value per minute of the lookup, plus one
+    origin: np.datetime64     # first day covered (the day, or earlier for windows starting before it)
+
+    @classmethod
+    def build(cls, day, tariff: Tariff, load_kw, first=None, last=None):
+        """
+        Lookup over whole days from the day (or the day of `first`, if earlier)
+        to LOOKUP_HOURS after the day starts (or `last`, if later). Every minute
+        is priced with the band of its own timestamp.
+        """
+        day = np.datetime64(pd.Timestamp(day).normalize(), "D")
+        origin = day if first is None else min(day, np.datetime64(pd.Timestamp(first).normalize(), "D"))
+        end = day.astype("datetime64[ns]") + np.timedelta64(LOOKUP_HOURS, "h")
+        if last is not None:
+            end = max(end, np.datetime64(pd.Timestamp(last), "ns"))
+        days = math.ceil((end - origin.astype("datetime64[ns]")) / np.timedelta64(1, "D"))
+        minutes = origin.astype("datetime64[ns]") + np.arange(days * 1440) * np.timedelta64(1, "m")
+        prices = np.array([tariff.prices[b] for b in tariff.bands])[tariff.band_codes(minutes)]
+        load = np.tile(np.repeat(np.asarray(load_kw, dtype=np.float64), 60), days)
+        cumulative = np.r_[0.0, np.cumsum(prices * load / 60)]
+        return cls(day, tariff, np.asarray(load_kw), cumulative, origin)
+
+    @property
+    def hours(self):
+        return (len(self.cumulative) - 1) // 60
+
+    def _minutes(self, times):
+        offset = (np.asarray(times, dtype="datetime64[ns]") - self.origin.astype("datetime64[ns]"))
+        minutes = offset.astype(np.int64) / 6e10
+        if minutes.size and (minutes.min() < 0 or minutes.max() > len(self.cumulative) - 1):
+            raise ValueError(f"Operating window outside the {self.hours} h cost lookup from {self.origin}")
+        return minutes
+
+    def window_cost(self, starts, ends):
+        """Cost of running the utility system over each [start, end)"""
+        grid = np.arange(len(self.cumulative))
+        return (np.interp(self._minutes(ends), grid, self.cumulative)
+                - np.interp(self._minutes(starts), grid, self.cumulative))
+
+    def schedule_cost(self, starts, ends) -> float:
+        """Cost of the operating windows of a schedule (overlapping processes count once)"""
+        seg_starts, seg_ends = union_segments(np.asarray(starts, "datetime64[ns]"), np.asarray(ends, "datetime64[ns]"))
+        return float(self.window_cost(seg_starts, seg_ends).sum())
+
+    def shift_curve(self, starts, ends, step_minutes=SHIFT_STEP_MINUTES, hours=(0, 24)) -> pd.DataFrame:
+        """Cost of the same schedule moved to start at every step, staying within the working hours"""
+        seg_starts, seg_ends = union_segments(np.asarray(starts, "datetime64[ns]"), np.asarray(ends, "datetime64[ns]"))
+        if not len(seg_starts):
+            return pd.DataFrame(columns=["start", "cost"])
+        span = int((seg_ends[-1] - seg_starts[0]) / np.timedelta64(1, "m"))
+        first, last = hours[0] * 60, max(hours[0] * 60, hours[1] * 60 - span)
+        day0 = self.day.astype("datetime64[ns]")
+        candidates = day0 + np.arange(first, last + 1, step_minutes) * np.timedelta64(1, "m")
+        shift = candidates - seg_starts[0]
+        cost = self.window_cost(seg_starts[None, :] + shift[:, None], seg_ends[None, :] + shift[:, None]).sum(axis=1)
+        return pd.DataFrame({"start": candidates, "cost": cost})
+
+
+def table_cost(table, load_kw, tariff: Tariff) -> float:
+    """Utility cost (yuan) of the original times of a ProcessTable, summed over its days"""
+    arrays = table.arrays()
+    total = 0.0
+    for day in np.unique(arrays.days[arrays.valid]):
+        rows_of_day = (arrays.days == day) & arrays.valid
+        starts, ends = arrays.starts[rows_of_day], arrays.ends[rows_of_day]
+        lookup = CostLookup.build(day, tariff, load_kw, starts.min(), ends.max())
+        total += lookup.schedule_cost(starts, ends)
+    return total
+
+
+def schedule_costs(table, data, tariff: Optional[Tariff] = None, utility_cols: Sequence[str] = utility_system,
+                   step_minutes=SHIFT_STEP_MINUTES, hours=(0, 24)) -> Tuple[pd.DataFrame, Dict[object, pd.DataFrame]]:
+    """
+    Utility cost per day of a ProcessTable: original times, optimized times
+    (when set), and the start time within the working `hours` that makes the
+    optimized (else original) schedule cheapest. Returns (table per day,
+    shift curve per day).
+    """
+    tariff = tariff or Tariff.from_config()
+    profile = operating_load(utility_load_profile(data, utility_cols))
+    arrays = table.arrays()
+    opt_starts, opt_ends = table.columns["optimize_start_time"], table.columns["optimize_end_time"]
+    rows, curves = [], {}
+    for day in np.unique(arrays.days[arrays.valid]):
+        rows_of_day = (arrays.days == day) & arrays.valid
+        starts, ends = arrays.starts[rows_of_day], arrays.ends[rows_of_day]
+        has_optimized = not np.isnat(opt_starts[rows_of_day]).any()
+        if has_optimized:
+            windows = (np.r_[starts, opt_starts[rows_of_day]], np.r_[ends, opt_ends[rows_of_day]])
+        else:
+            windows = (starts, ends)
+        # long enough for every window, and for the last start tried by shift_curve
+        span = windows[1].max() - windows[0].min()
+        last = max(windows[1].max(), day.astype("datetime64[ns]") + np.timedelta64(hours[1], "h") + span)
+        lookup = CostLookup.build(day, tariff, profile, windows[0].min(), last)
+        original = lookup.schedule_cost(starts, ends)
+        optimized = np.nan
+        if has_optimized:
+            starts, ends = opt_starts[rows_of_day], opt_ends[rows_of_day]
+            optimized = lookup.schedule_cost(starts, ends)
+        curve = lookup.shift_curve(starts, ends, step_minutes, hours)
+        best = curve.loc[curve["cost"].idxmin()]
+        key = pd.Timestamp(day).date()
+        curves[key] = curve
+        rows.append({"date": key, "Original cost(yuan)": original, "Optimized cost(yuan)": optimized,
+                     "Best start": best["start"], "Best cost(yuan)": best["cost"],
+                     "Saving vs original(yuan)": original - best["cost"]})
+    return pd.DataFrame(rows), curves
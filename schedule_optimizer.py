@@ -0,0 +1,237 @@
+# ============================================
+# Constraint-aware process schedule optimizer
+# Compresses each day's processes into the shortest window, so the utility
+# system (air compressors, chillers, purified water, ...) runs for less time.
+# Constraints:
+#   - the same equipment never runs two processes at once (parse_equips)
+#   - steps of one batch follow the product route (product_process_map)
+#   - concurrent positions (worker_number) stay within the day's capacity
+# Method: serial list scheduler on a time grid + bounded local search over the
+# priority list. Results are written back with Process.set_optimized_time().
+# ============================================
+import time
+import random
+from dataclasses import dataclass, field
+from typing import Dict, List
+
+import numpy as np
+import pandas as pd
+
+from config_equipment import product_process_map
+from energy_analytics import ProcessArrays, day_hours, parse_equips, process_day
+
+STEP_MINUTES = 5          # grid resolution of the scheduler
+MAX_ITERS = 300           # local search moves per day
+TIME_LIMIT = 0.5          # seconds of local search per day
+
+
+@dataclass
+class DaySchedule:
+    day: object
+    processes: list                 # the scheduled processes (optimized times set)
+    original_window_h: float        # union of the original process times
+    optimized_window_h: float       # union of the optimized process times
+    lower_bound_h: float            # no schedule can be shorter than this
+    worker_capacity: int
+    iterations: int = 0
+    skipped: list = field(default_factory=list)   # processes without a valid time span
+
+    @property
+    def saving_ratio(self):
+        if self.original_window_h <= 0:
+            return 0.0
+        return max(0.0, 1.0 - self.optimized_window_h / self.original_window_h)
+
+
+def route_step(p):
+    """Position of the process in its product route, None when not on a route"""
+    route = product_process_map.get(getattr(p, "product_type", ""), [])
+    name = getattr(p, "process_name", "")
+    return route.index(name) if name in route else None
+
+
+class _Problem:
+    """Slot-based view of one day's processes (durations rounded up to the grid)"""
+
+    def __init__(self, processes, step_minutes, worker_capacity):
+        self.processes = processes
+        self.step = pd.Timedelta(minutes=step_minutes)
+        starts = [pd.Timestamp(p.start_time) for p in processes]
+        ends = [pd.Timestamp(p.end_time) for p in processes]
+        self.origin = min(starts)   # the optimized day starts where the original one did
+        self.durations = [e - s for s, e in zip(starts, ends)]
+        self.slots = np.array([int(np.ceil(d / self.step)) for d in self.durations])
+        self.workers = np.array([max(0, int(getattr(p, "worker_number", 0) or 0)) for p in processes])
+        names = sorted({e for p in processes for e in parse_equips(getattr(p, "equipments", ""))})
+        code = {e: i for i, e in enumerate(names)}
+        self.equips = [[code[e] for e in parse_equips(getattr(p, "equipments", ""))] for p in processes]
+        self.n_equips = len(names)
+
+        # Route precedence inside a batch (same product and batch number)
+        self.batch = [(getattr(p, "product_type", ""), getattr(p, "number", 0)) for p in processes]
+        self.step_of = [route_step(p) for p in processes]
+        self.preds: List[List[int]] = [[] for _ in processes]
+        for i in range(len(processes)):
+            for j in range(len(processes)):
+                if (self.batch[i] == self.batch[j] and self.step_of[i] is not None
+                        and self.step_of[j] is not None and self.step_of[j] < self.step_of[i]):
+                    self.preds[i].append(j)
+
+        if worker_capacity is None:
+            worker_capacity = self._original_peak_workers(starts, ends)
+        self.capacity = max(int(worker_capacity), int(self.workers.max(initial=0)))
+        self.horizon = int(self.slots.sum()) + 1   # fully serial schedule always fits
+
+    def _original_peak_workers(self, starts, ends):
+        """Most positions staffed at once in the original schedule"""
+        events = sorted([(s, w) for s, w in zip(starts, self.workers)] + [(e, -w) for e, w in zip(ends, self.workers)],
+                        key=lambda x: (x[0], x[1]))
+        peak = level = 0
+        for _, delta in events:
+            level += delta
+            peak = max(peak, level)
+        return peak
+
+    def lower_bound(self):
+        """max(busiest equipment, longest route chain, total positions / capacity) in slots"""
+        load = np.zeros(self.n_equips, dtype=np.int64)
+        for i, eq in enumerate(self.equips):
+            load[eq] += self.slots[i]
+        chain = {}
+        for i in range(len(self.slots)):
+            if self.step_of[i] is not None:
+                key = (self.batch[i], self.step_of[i])
+                chain[key] = max(chain.get(key, 0), self.slots[i])
+        chains = {}
+        for (batch, _), slots in chain.items():
+            chains[batch] = chains.get(batch, 0) + slots
+        work = int(np.ceil((self.slots * self.workers).sum() / self.capacity)) if self.capacity else 0
+        return max(int(load.max(initial=0)), max(chains.values(), default=0), work, int(self.slots.max(initial=0)))
+
+    def initial_order(self):
+        """Longest remaining route first, then longest process (critical path / LPT rule)"""
+        tail = self.slots.astype(np.int64).copy()
+        for i in sorted(range(len(self.slots)), key=lambda k: -(self.step_of[k] or 0)):
+            for j in self.preds[i]:
+                tail[j] = max(tail[j], self.slots[j] + tail[i])
+        return sorted(range(len(self.slots)), key=lambda k: (-tail[k], -self.slots[k], k))
+
+    def decode(self, order):
+        """
+        Serial schedule generation: take the first process of `order` whose route
+        predecessors are placed and put it at the earliest slot where all its
+        equipment is free and the positions fit. Returns (start slots, makespan, sum of ends).
+        """
+        n, h = len(self.slots), self.horizon
+        busy = np.zeros((self.n_equips, h), dtype=bool)
+        used = np.zeros(h, dtype=np.int64)
+        start = np.full(n, -1, dtype=np.int64)
+        makespan = 0
+        pending = list(order)
+        while pending:
+            for k, i in enumerate(pending):
+                if all(start[j] >= 0 for j in self.preds[i]):
+                    break
+            pending.pop(k)
+            d = int(self.slots[i])
+            release = max((int(start[j] + self.slots[j]) for j in self.preds[i]), default=0)
+            # everything is free after the current makespan, so only that window is searched
+            stop = max(release, makespan) + d
+            window = slice(release, stop)
+            free = ~busy[self.equips[i], window].any(axis=0) & (used[window] + self.workers[i] <= self.capacity)
+            runs = np.concatenate([[0], np.cumsum(free)])
+            ok = np.flatnonzero(runs[d:] - runs[:-d] == d) if d else np.array([0])
+            t = release + int(ok[0])
+            makespan = max(makespan, t + d)
+            start[i] = t
+            busy[self.equips[i], t:t + d] = True
+            used[t:t + d] += self.workers[i]
+        ends = start + self.slots
+        return start, int(ends.max(initial=0)), int(ends.sum())
+
+
+def _local_search(problem, order, best, bound, max_iters, time_limit, rng):
+    """
+    Insert / swap moves on the priority list; a move is kept when the schedule is
+    not worse (shorter window first, then earlier completions). Bounded by moves,
+    time, and stops at the lower bound.
+    """
+    n = len(order)
+    deadline = time.perf_counter() + time_limit
+    iterations = 0
+    while iterations < max_iters and best[1] > bound and n > 1 and time.perf_counter() < deadline:
+        iterations += 1
+        candidate = list(order)
+        a, b = sorted(rng.sample(range(n), 2))
+        if rng.random() < 0.5:
+            candidate.insert(a, candidate.pop(b))
+        else:
+            candidate[a], candidate[b] = candidate[b], candidate[a]
+        result = problem.decode(candidate)
+        if (result[1], result[2]) <= (best[1], best[2]):
+            order, best = candidate, result
+    return order, best, iterations
+
+
+def optimize_day(processes, step_minutes=STEP_MINUTES, worker_capacity=None,
+                 max_iters=MAX_ITERS, time_limit=TIME_LIMIT, seed=0) -> DaySchedule:
+    """Optimized schedule of one day's processes, written back with set_optimized_time()"""
+    arrays = ProcessArrays.from_processes(processes)
+    valid = arrays.valid
+    plist = [p for p, ok in zip(processes, valid) if ok]
+    skipped = [p for p, ok in zip(processes, valid) if not ok]
+    day = process_day(plist[0]) if plist else None
+    if not plist:
+        return DaySchedule(day, [], 0.0, 0.0, 0.0, 0, skipped=skipped)
+
+    problem = _Problem(plist, step_minutes, worker_capacity)
+    bound = problem.lower_bound()
+    order = problem.initial_order()
+    best = problem.decode(order)
+    order, best, iterations = _local_search(problem, order, best, bound, max_iters, time_limit, random.Random(seed))
+
+    opt_starts = np.array([problem.origin + int(slot) * problem.step for slot in best[0]], dtype="datetime64[ns]")
+    opt_ends = opt_starts + np.array(problem.durations, dtype="timedelta64[ns]")
+    for p, start, end in zip(plist, pd.to_datetime(opt_starts), pd.to_datetime(opt_ends)):
+        p.set_optimized_time(start.to_pydatetime(), end.to_pydatetime())
+
+    return DaySchedule(day, plist,
+                       original_window_h=_union_hours(arrays.starts[valid], arrays.ends[valid]),
+                       optimized_window_h=_union_hours(opt_starts, opt_ends),
+                       lower_bound_h=bound * step_minutes / 60,
+                       worker_capacity=problem.capacity, iterations=iterations, skipped=skipped)
+
+
+def _union_hours(starts, ends):
+    """Hours covered by at least one of the intervals"""
+    n = len(starts)
+    arrays = ProcessArrays(np.zeros(n, dtype="datetime64[D]"), starts, ends, [["-"]] * n)
+    return float(day_hours(arrays)[1].sum())
+
+
+def optimize_schedule(processes, **kwargs) -> List[DaySchedule]:
+    """Optimize every day of a process list independently (see optimize_day for the options)"""
+    by_day: Dict[object, list] = {}
+    for p in processes:
+        by_day.setdefault(process_day(p), []).append(p)
+    return [optimize_day(plist, **kwargs) for d, plist in sorted(by_day.items(), key=lambda x: str(x[0]))
+            if d is not None]
+
+
+def schedule_table(schedules: List[DaySchedule]) -> pd.DataFrame:
+    """Original vs optimized times of every scheduled process"""
+    rows = []
+    for s in schedules:
+        for p in s.processes:
+            rows.append({
+                "date": s.day,
+                "process": p.process_name,
+                "product": p.product_type,
+                "equipment": p.equipments,
+                "positions": p.worker_number,
+                "original start": p.start_time,
+                "original end": p.end_time,
+                "optimized start": p.optimize_start_time,
+                "optimized end": p.optimize_end_time,
+            })
+    return pd.DataFrame(rows)
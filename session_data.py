@@ -0,0 +1,122 @@
+# ============================================
+# Session glue for the shared dataset registry
+# A session keeps only a lease on the shared dataset plus its own filter state.
+# ============================================
+import pandas as pd
+import streamlit as st
+
+from data_store import (registry, dataset_file_source, dataset_bytes_source,
+                        append_readings, append_readings_to)
+from dataset_partitions import dataset_dir_source
+from resample_energy import RESOLUTIONS
+
+LEASE_KEY = "dataset_lease"
+
+
+def _use_source(key, loader, fingerprint):
+    lease = st.session_state.get(LEASE_KEY)
+    if lease is not None and lease.key == key and not lease.released:
+        registry.refresh(key, loader, fingerprint)
+        return lease.df
+    new_lease = registry.acquire(key, loader, fingerprint)
+    if lease is not None:
+        lease.release()
+    st.session_state[LEASE_KEY] = new_lease
+    return new_lease.df
+
+
+def use_dataset_file(path):
+    """Attach this session to the shared dataset of a workbook on disk"""
+    return _use_source(*dataset_file_source(path))
+
+
+def use_dataset_dir(data_dir, start_date, end_date):
+    """Attach this session to the months of a partitioned directory overlapping the date range"""
+    return _use_source(*dataset_dir_source(data_dir, start_date, end_date))
+
+
+def use_uploaded_file(uploaded_file):
+    """Attach this session to the shared dataset of an uploaded workbook"""
+    return _use_source(*dataset_bytes_source(uploaded_file.getvalue()))
+
+
+def append_to_session(source):
+    """
+    Append new readings to the session's dataset. Persisted when it comes from a
+    workbook on disk; uploads and directory partitions are updated in memory only.
+    """
+    lease = st.session_state.get(LEASE_KEY)
+    if lease is None or lease.released:
+        raise KeyError("No dataset loaded")
+    if lease.key.startswith("file:"):
+        return append_readings(lease.key[len("file:"):], source)
+    return append_readings_to(lease.key, source)
+
+
+def _session_dataset():
+    lease = st.session_state.get(LEASE_KEY)
+    if lease is None or lease.released:
+        return None
+    try:
+        return lease.dataset
+    except KeyError:
+        return None
+
+
+def session_df():
+    """Read-only frame of the dataset this session is attached to, or None"""
+    dataset = _session_dataset()
+    return None if dataset is None else dataset.df
+
+
+def session_slice(start_date=None, end_date=None):
+    """Readings of the session's dataset within [start_date, end_date] (view), or None"""
+    dataset = _session_dataset()
+    return None if dataset is None else dataset.slice_dates(start_date, end_date)
+
+
+def session_dataset_version():
+    """(registry key, version) of the session's dataset, or None; changes on every reload or append"""
+    dataset = _session_dataset()
+    return None if dataset is None else (dataset.key, dataset.version)
+
+
+def session_rollups():
+    """Daily/weekly/monthly rollups of the session's dataset, or None"""
+    dataset = _session_dataset()
+    return None if dataset is None else dataset.rollups
+
+
+def session_reconciliation():
+    """Daily parent / children / residual per parent meter of the session's dataset, or None"""
+    dataset = _session_dataset()
+    return None if dataset is None else dataset.reconciliation
+
+
+def session_costs(start_date=None, end_date=None, columns=None):
+    """Electricity cost breakdown of the session's dataset within [start_date, end_date], or None"""
+    dataset = _session_dataset()
+    return None if dataset is None else dataset.costs(start_date, end_date, columns)
+
+
+def session_resampled(resolution):
+    """Consumption of the session's dataset on a fixed grid ("1 min" / "15 min" / "Hourly"), or None"""
+    dataset = _session_dataset()
+    return None if dataset is None else dataset.resampled(RESOLUTIONS[resolution])
+
+
+def session_events(start_date=None, end_date=None, meters=None):
+    """Anomaly events of the session's dataset within [start_date, end_date], or None"""
+    dataset = _session_dataset()
+    if dataset is None:
+        return None
+    events = dataset.watch()[1]
+    days = events["time"].dt.date
+    keep = pd.Series(True, index=events.index)
+    if start_date is not None:
+        keep &= days >= start_date
+    if end_date is not None:
+        keep &= days <= end_date
+    if meters is not None:
+        keep &= events["meter"].isin(meters)
+    return events[keep]
@@ -0,0 +1,26 @@
+import numpy as np
+import pandas as pd
+
+from energy_analytics import kpis
+from rollups_energy import EnergyRollups
+
+
+def _rollups():
+    times = pd.date_range("2024-01-01", periods=4 * 24, freq="h")
+    df = pd.DataFrame({"time": times, "elec31": np.arange(len(times), dtype=float),
+                       "elec30": np.arange(len(times), dtype=float) * 3})
+    df.loc[df["time"] >= "2024-01-03", ["elec31", "elec30"]] = np.nan
+    return EnergyRollups.from_frame(df)
+
+
+def test_kpis_rank_the_top_device():
+    kpi = kpis(_rollups(), ["elec31", "elec30"], "2024-01-01", "2024-01-01")
+    assert kpi.top_device == "elec30"
+    assert kpi.top_value == 3 * 24
+    assert kpi.total_energy == 4 * 24
+
+
+def test_kpis_have_no_top_device_without_consumption():
+    kpi = kpis(_rollups(), ["elec31", "elec30"], "2024-01-03", "2024-01-04")
+    assert kpi.top_device is None and kpi.top_device_name is None
+    assert np.isnan(kpi.top_value)
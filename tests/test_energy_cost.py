@@ -0,0 +1,62 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from energy_cost import NOT_ADDITIVE, Tariff, compute_costs
+from models_energy import EnergyTable
+
+
+def _table(days, kwh_per_slot):
+    """Quarter-hour readings of one leaf meter over some days; kwh_per_slot(times) -> kWh of each slot"""
+    times = np.concatenate([pd.date_range(day, periods=97, freq="15min").to_numpy() for day in days])
+    times = np.unique(times)
+    use = np.r_[0.0, kwh_per_slot(pd.DatetimeIndex(times[:-1]))]
+    return EnergyTable(times, {"elec44": 1000 + np.cumsum(use)})
+
+
+def test_energy_is_split_by_band():
+    tariff = Tariff.from_config("industrial_tou")
+    costs = compute_costs(_table(["2024-01-15"], lambda t: np.ones(len(t))), tariff)
+    day = costs.by_day().loc[pd.Timestamp("2024-01-15")]
+    # standard calendar: 10 h valley, 7 h peak, 7 h flat at 4 kW
+    assert day["valley kWh"] == pytest.approx(40)
+    assert day["peak kWh"] == pytest.approx(28)
+    assert day["flat kWh"] == pytest.approx(28)
+    assert day["sharp kWh"] == pytest.approx(0)
+    assert day["energy cost"] == pytest.approx(40 * 0.31 + 28 * 1.05 + 28 * 0.66)
+    assert costs.totals()["kWh"] == pytest.approx(96)
+
+
+def test_summer_months_use_their_calendar():
+    costs = compute_costs(_table(["2024-07-15"], lambda t: np.ones(len(t))), Tariff.from_config())
+    day = costs.by_day().loc[pd.Timestamp("2024-07-15")]
+    assert day["sharp kWh"] == pytest.approx(12)
+    assert day["peak kWh"] == pytest.approx(16)
+
+
+def test_demand_is_the_highest_block_of_each_month():
+    def use(t):
+        kwh = np.ones(len(t))
+        kwh[(t.day == 15) & (t.month == 1) & (t.hour == 9) & (t.minute == 0)] = 3      # 12 kW
+        kwh[(t.day == 15) & (t.month == 2) & (t.hour == 18) & (t.minute == 30)] = 2    # 8 kW
+        return kwh
+
+    tariff = Tariff.from_config()
+    costs = compute_costs(_table(["2024-01-15", "2024-02-15"], use), tariff)
+    demand = costs.demand()
+    np.testing.assert_allclose(demand["peak kW"], [12, 8])
+    assert list(demand["peak at"]) == [pd.Timestamp("2024-01-15 09:00"), pd.Timestamp("2024-02-15 18:30")]
+    np.testing.assert_allclose(demand["demand cost"], [12 * tariff.demand_charge, 8 * tariff.demand_charge])
+    assert costs.totals()["demand cost"] == pytest.approx(20 * tariff.demand_charge)
+
+
+def test_groups_add_up_to_the_site_without_the_main_meters():
+    table = _table(["2024-01-15"], lambda t: np.ones(len(t)))
+    table.columns["elec32"] = table.columns["elec44"] * 1.05   # main above elec44, reconciles
+    costs = compute_costs(table, Tariff.from_config())
+    groups = costs.by_group()
+    assert groups.index[-1] == NOT_ADDITIVE
+    assert costs.by_meter().loc["elec32", "group"] == NOT_ADDITIVE
+    additive = groups.drop(index=NOT_ADDITIVE)
+    assert additive["kWh"].sum() == pytest.approx(costs.totals()["kWh"])
+    assert additive["total cost"].sum() == pytest.approx(costs.totals()["total cost"])
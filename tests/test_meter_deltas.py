@@ -0,0 +1,76 @@
+import numpy as np
+import pandas as pd
+
+from meter_deltas import (GAP, LONG_GAP, RESET, ROLLOVER, DROPPED, NO_DATA, correct_readings,
+                          corrected_cumulative, seconds_since_start)
+
+
+def _times(n, minutes=15):
+    return pd.date_range("2024-01-01", periods=n, freq=f"{minutes}min").to_numpy()
+
+
+def _correct(values, register=None, times=None):
+    values = np.asarray(values, dtype=float)
+    return corrected_cumulative(_times(len(values)) if times is None else times, values, register)
+
+
+def test_increasing_readings_are_differenced():
+    c, flags = _correct([10, 11, 13, 16])
+    np.testing.assert_allclose(c, [0, 1, 3, 6])
+    assert not flags.any()
+
+
+def test_reset_counts_the_new_reading_as_use():
+    c, flags = _correct([10, 11, 12, 2, 3])
+    np.testing.assert_allclose(c, [0, 1, 2, 4, 5])
+    assert flags[3] & RESET
+    assert not (flags[[0, 1, 2, 4]] & RESET).any()
+
+
+def test_rollover_adds_the_register_width():
+    c, flags = _correct([95, 98, 3, 6], register=100)
+    np.testing.assert_allclose(c, [0, 3, 8, 11])
+    assert flags[2] & ROLLOVER and not flags[2] & RESET
+
+
+def test_dropout_is_discarded_and_interpolated():
+    c, flags = _correct([10, 11, 0, 12, 13])
+    np.testing.assert_allclose(c, [0, 1, 1.5, 2, 3])
+    assert flags[2] & DROPPED and flags[2] & GAP
+    assert not (flags & RESET).any()
+
+
+def test_jitter_counts_nothing_until_the_high_is_passed():
+    c, flags = _correct([10, 11, 10.9, 10.95, 11.5])
+    np.testing.assert_allclose(c, [0, 1, 1, 1, 1.5])
+    assert not flags.any()
+
+
+def test_gaps_are_interpolated_in_time_and_flagged():
+    c, flags = _correct([10, np.nan, np.nan, 13])
+    np.testing.assert_allclose(c, [0, 1, 2, 3])
+    assert (flags[1:3] & GAP).all() and not flags[[0, 3]].any()
+
+
+def test_long_gap_flags_the_reading_that_closes_it():
+    times = np.array(["2024-01-01T00:00", "2024-01-01T00:15", "2024-01-01T03:15", "2024-01-01T03:30"],
+                     dtype="datetime64[ns]")
+    c, flags = _correct([10, 11, 14, 15], times=times)
+    np.testing.assert_allclose(c, [0, 1, 4, 5])
+    assert flags[2] & LONG_GAP
+    assert not (flags[[0, 1, 3]] & LONG_GAP).any()
+
+
+def test_rows_outside_the_readings_have_no_data():
+    c, flags = _correct([np.nan, 10, 11, np.nan])
+    assert flags[0] & NO_DATA and flags[3] & NO_DATA
+    assert not flags[1:3].any()
+    np.testing.assert_allclose(c[1:3], [0, 1])
+
+
+def test_high_continues_a_series_cut_inside_a_jitter_dip():
+    values = np.array([10, 12, 11.5, 11.8, 13.0])
+    whole, _ = _correct(values)
+    t = seconds_since_start(_times(5)[2:])
+    part, _ = correct_readings(t, values[2:], high=12.0)
+    np.testing.assert_allclose(part, whole[2:] - whole[2])
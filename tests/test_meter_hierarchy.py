@@ -0,0 +1,26 @@
+import numpy as np
+
+from meter_hierarchy import MeterHierarchy, Reconciliation, leaf_columns
+
+TREE = MeterHierarchy({"main": ["a", "b"], "a": ["a1"]}, inferred={"a"})
+
+
+def test_leaves_skip_parents_of_selected_meters():
+    assert TREE.leaves(["main", "a", "b", "a1"]) == ["b", "a1"]
+    assert TREE.leaves(["main", "a", "b", "a1"], whole={"a"}) == ["a", "b"]
+
+
+def test_summary_marks_inferred_branches_and_what_totals_count():
+    days = np.arange("2024-01-01", "2024-01-03", dtype="datetime64[D]")
+    # main = a + b exactly; a1 only covers half of a
+    values = np.array([[10.0, 6, 4, 3], [10, 6, 4, 3]])
+    summary = Reconciliation.from_matrix(days, values, ["main", "a", "b", "a1"], TREE).summary()
+    assert list(summary["branches"]) == ["documented", "inferred (heuristic)"]
+    np.testing.assert_allclose(summary["residual %"], [0, 50])
+    assert list(summary["totals count"]) == ["children", "parent"]
+
+
+def test_leaf_columns_count_an_unreconciled_main_itself():
+    columns = list(leaf_columns(["elec32", "elec44"], {"elec32": 100.0, "elec44": 50.0}))
+    assert columns == ["elec32"]
+    assert leaf_columns(["elec32", "elec44"], {"elec32": 100.0, "elec44": 95.0}) == ["elec44"]
@@ -0,0 +1,31 @@
+import numpy as np
+import pandas as pd
+
+from meter_watch import MeterWatch, register_rollover
+
+
+def _feed(values, batch=4):
+    """Events of one meter's readings fed a few at a time"""
+    times = pd.date_range("2024-01-01", periods=len(values), freq="15min").to_numpy()
+    values = np.asarray(values, dtype=float)[:, None]
+    watch = MeterWatch(["m"])
+    events = [watch.process(times[i:i + batch], values[i:i + batch]) for i in range(0, len(values), batch)]
+    return pd.concat(events, ignore_index=True), times
+
+
+def test_reset_is_reported_once_when_confirmed():
+    events, times = _feed([10, 11, 12, 13, 1, 2, 3, 4, 5, 6], batch=5)
+    assert list(events["kind"]) == ["reset"]
+    assert events["time"][0] == times[4] and events["level"][0] == "critical"
+
+
+def test_dropouts_and_jitter_are_not_resets():
+    events, _ = _feed([10, 11, 0, 12, 13, 12.9, 13.5, 14, 15, 16, 17, 0])
+    assert events.empty
+
+
+def test_rollover_is_info(monkeypatch):
+    monkeypatch.setitem(register_rollover, "m", 10000)
+    events, times = _feed([9990, 9995, 3, 8, 12, 15, 18, 21])
+    assert list(events["kind"]) == ["rollover"] and events["level"][0] == "info"
+    assert events["time"][0] == times[2]
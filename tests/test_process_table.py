@@ -0,0 +1,52 @@
+import pandas as pd
+import pytest
+
+from process_table import validate_schedule
+
+ROUTE = "American Ginseng Granules"
+
+
+def _row(**values):
+    row = {"product_type": ROUTE, "process_name": "inner packing", "number": 1, "worker_number": 2,
+           "equipments": "elec52", "start_time": "2024-03-01 08:00:00", "end_time": "2024-03-01 10:30:00"}
+    row.update(values)
+    return row
+
+
+def test_valid_rows_are_parsed():
+    valid, errors = validate_schedule(pd.DataFrame([_row(), _row(start_time="13:00", end_time="14:00",
+                                                             process_date="2024-03-02")]))
+    assert errors.empty
+    assert list(valid["start_time"]) == [pd.Timestamp("2024-03-01 08:00"), pd.Timestamp("2024-03-02 13:00")]
+    assert list(valid["process_time"]) == [2.5, 1.0]
+    assert list(valid["process_date"]) == [pd.Timestamp("2024-03-01"), pd.Timestamp("2024-03-02")]
+
+
+def test_display_headers_are_accepted():
+    frame = pd.DataFrame([_row()]).rename(columns={"product_type": "Product name", "process_name": "Process Name",
+                                                   "start_time": "start time", "end_time": "end time",
+                                                   "equipments": "equipment"})
+    valid, errors = validate_schedule(frame)
+    assert errors.empty and len(valid) == 1
+
+
+def test_invalid_rows_are_reported_with_their_sheet_row():
+    valid, errors = validate_schedule(pd.DataFrame([
+        _row(),
+        _row(product_type="unknown product"),
+        _row(process_name="tabletting"),
+        _row(equipments="elec52, nope"),
+        _row(end_time="2024-03-01 07:00:00"),
+        _row(start_time="not a time"),
+        _row(worker_number=-1),
+    ]))
+    assert len(valid) == 1
+    assert list(zip(errors["row"], errors["column"])) == [
+        (3, "product_type"), (4, "process_name"), (5, "equipments"), (6, "end_time"),
+        (7, "start_time / end_time"), (8, "worker_number")]
+    assert errors.loc[2, "error"] == "unknown equipment nope"
+
+
+def test_missing_required_column_raises():
+    with pytest.raises(ValueError, match="equipment"):
+        validate_schedule(pd.DataFrame([_row()]).drop(columns="equipments"))
@@ -0,0 +1,99 @@
+import numpy as np
+import pandas as pd
+
+from models_energy import EnergyTable
+from rollups_energy import EnergyRollups
+
+
+def _table(seed=0, days=20, meters=3):
+    """Half-hourly readings with jitter dips and missing readings"""
+    rng = np.random.default_rng(seed)
+    times = pd.date_range("2024-01-01", periods=days * 48, freq="30min").to_numpy()
+    values = np.cumsum(rng.uniform(0, 1, (len(times), meters)), axis=0) + 50
+    values -= rng.uniform(0, 1.5, values.shape) * (rng.random(values.shape) < 0.3)
+    values[rng.random(values.shape) < 0.05] = np.nan
+    return EnergyTable(times, {f"m{j}": values[:, j].copy() for j in range(meters)})
+
+
+def _days(table):
+    return table.timestamps.astype("datetime64[D]")
+
+
+def _assert_same(updated, full):
+    for code in "DWM":
+        a, b = updated.level(code), full.level(code)
+        np.testing.assert_array_equal(a.keys, b.keys)
+        for stat in b.stats:
+            np.testing.assert_allclose(a.stats[stat].astype(float), b.stats[stat].astype(float),
+                                       atol=1e-9, err_msg=f"{code} {stat}")
+    np.testing.assert_allclose(updated.cumulative.cum, full.cumulative.cum, atol=1e-9)
+
+
+def test_updated_matches_rebuild_after_tail_append():
+    table = _table()
+    days = _days(table)
+    first = days[-1] - 2
+    cut = int(np.searchsorted(days, first))
+    # a jitter dip over the whole day before the append, into the appended rows
+    values = table.columns["m0"]
+    dip = int(np.searchsorted(days, first - 1)) - 3
+    high = np.nanmax(values[:dip]) + 1
+    values[dip - 1], values[dip:cut + 2] = high, np.linspace(high - 0.05, high - 0.01, cut + 2 - dip)
+    values[cut + 2:] += high - np.nanmin(values[cut + 2:]) + 0.5
+    base = EnergyRollups.from_table(table.take(np.arange(cut)))
+    _assert_same(base.updated(table, first, days[-1]), EnergyRollups.from_table(table))
+
+
+def test_updated_matches_rebuild_after_mid_overwrite():
+    table = _table(1)
+    days = _days(table)
+    first, last = days[0] + 5, days[0] + 6
+    old = {c: v.copy() for c, v in table.columns.items()}
+    changed = (days >= first) & (days <= last)
+    old["m0"][changed] *= 1.2    # the old high held back the use of the days after it
+    old["m1"][changed] *= 0.9
+    base = EnergyRollups.from_table(EnergyTable(table.timestamps, old))
+    _assert_same(base.updated(table, first, last), EnergyRollups.from_table(table))
+
+
+def test_updated_matches_rebuild_across_a_reset():
+    table = _table(2)
+    days = _days(table)
+    first = days[-1] - 3
+    cut = int(np.searchsorted(days, first))
+    values = table.columns["m2"]
+    values[cut - 40:] -= np.nanmin(values[cut - 40:]) - 1     # reset before the append
+    values[cut + 30:] -= np.nanmin(values[cut + 30:]) - 1     # and one inside it
+    base = EnergyRollups.from_table(table.take(np.arange(cut)))
+    _assert_same(base.updated(table, first, days[-1]), EnergyRollups.from_table(table))
+
+
+def test_rollups_match_a_groupby_of_the_readings():
+    # Increasing hourly readings from midnight: the use of a day is the reading
+    # at the next midnight minus the one at its own (the last day: its last reading)
+    rng = np.random.default_rng(3)
+    times = pd.date_range("2024-01-29", periods=40 * 24, freq="h")
+    values = np.cumsum(rng.uniform(0, 2, (len(times), 2)), axis=0)
+    values[(rng.random(values.shape) < 0.1) & (times.hour != 0)[:, None]] = np.nan
+    df = pd.DataFrame(values, columns=["m0", "m1"])
+    df.insert(0, "time", times)
+    rollups = EnergyRollups.from_frame(df, ["m0", "m1"])
+
+    readings = df.set_index("time")
+    midnight = readings[times.hour == 0]
+    day_use = midnight.shift(-1) - midnight
+    day_use.iloc[-1] = readings.ffill().iloc[-1] - midnight.iloc[-1]
+    day_use.index = day_use.index.normalize()
+    periods = {"D": lambda index: index.normalize(),
+               "W": lambda index: index.to_period("W").start_time,
+               "M": lambda index: index.to_period("M").start_time}
+    for code, period in periods.items():
+        grouped = readings.groupby(period(readings.index))
+        oracle = {"min": grouped.min(), "max": grouped.max(), "first": grouped.first(),
+                  "last": grouped.last(), "count": grouped.count(),
+                  "use": day_use.groupby(period(day_use.index)).sum()}
+        level = rollups.level(code)
+        np.testing.assert_array_equal(level.keys, oracle["min"].index.to_numpy().astype("datetime64[D]"))
+        for stat, expected in oracle.items():
+            np.testing.assert_allclose(level.stats[stat].astype(float), expected.to_numpy(dtype=float),
+                                       err_msg=f"{code} {stat}")
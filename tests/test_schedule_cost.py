@@ -0,0 +1,35 @@
+import numpy as np
+import pytest
+
+from energy_cost import Tariff
+from schedule_cost import CostLookup
+
+FLAT_LOAD = np.ones(24)   # 1 kW all day
+
+
+def _cost(lookup, start, end):
+    return float(lookup.window_cost(np.array([start], dtype="datetime64[ns]"),
+                                    np.array([end], dtype="datetime64[ns]"))[0])
+
+
+def test_weekend_calendar_prices_the_weekend():
+    tariff = Tariff("t", {"peak": 1.0, "valley": 0.5}, 0.0,
+                    {"standard": [("00:00", "12:00", "valley"), ("12:00", "24:00", "peak")],
+                     "weekend": [("00:00", "24:00", "valley")]}, {}, weekend_calendar="weekend")
+    lookup = CostLookup.build("2024-03-01", tariff, FLAT_LOAD)     # a Friday
+    assert _cost(lookup, "2024-03-01T12:00", "2024-03-01T13:00") == pytest.approx(1.0)
+    assert _cost(lookup, "2024-03-02T12:00", "2024-03-02T13:00") == pytest.approx(0.5)
+
+
+def test_month_calendar_applies_across_the_month_edge():
+    lookup = CostLookup.build("2024-06-30", Tariff.from_config("industrial_tou"), FLAT_LOAD)
+    assert _cost(lookup, "2024-06-30T10:00", "2024-06-30T11:00") == pytest.approx(1.05)   # standard peak
+    assert _cost(lookup, "2024-07-01T10:00", "2024-07-01T11:00") == pytest.approx(1.27)   # summer sharp
+
+
+def test_lookup_covers_windows_before_the_day_and_past_two_days():
+    lookup = CostLookup.build("2024-03-01", Tariff.from_config("flat_rate"), FLAT_LOAD * 2,
+                              first="2024-02-29T22:00", last="2024-03-04T01:00")
+    assert _cost(lookup, "2024-02-29T22:00", "2024-03-04T01:00") == pytest.approx(0.72 * 2 * 75)
+    with pytest.raises(ValueError):
+        _cost(lookup, "2024-03-05T00:00", "2024-03-05T01:00")
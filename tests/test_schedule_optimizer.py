@@ -0,0 +1,72 @@
+from datetime import datetime, timedelta
+
+import numpy as np
+
+from config_equipment import product_process_map
+from energy_analytics import parse_equips
+from models_energy import Process
+from schedule_optimizer import optimize_day, route_step
+
+PRODUCT = "American Ginseng Granules"
+
+
+def _processes():
+    """Three batches of one route on shared equipment, spread over the day"""
+    route = product_process_map[PRODUCT]
+    equipment = {"weigh-batching hopper": "elec52", "One-step granulation": "elec53", "inner packing": "elec54",
+                 "external packing": "elec55", "Linked packaging": "elec55"}
+    processes, start = [], datetime(2024, 3, 1, 6)
+    for batch in range(3):
+        for k, name in enumerate(route):
+            duration = timedelta(minutes=40 + 10 * k)
+            processes.append(Process(process_id=len(processes), process_date=datetime(2024, 3, 1),
+                                     product_type=PRODUCT, process_name=name, number=batch,
+                                     worker_number=1 + k % 2, equipments=equipment[name],
+                                     start_time=start, end_time=start + duration))
+            start += duration + timedelta(minutes=20)
+    return processes
+
+
+def test_optimized_schedule_keeps_the_constraints():
+    processes = _processes()
+    schedule = optimize_day(processes, max_iters=200, time_limit=2.0)
+    assert schedule.optimized_window_h < schedule.original_window_h
+    assert schedule.optimized_window_h >= schedule.lower_bound_h - 1e-9
+    for p in processes:
+        assert p.optimize_end_time - p.optimize_start_time == p.end_time - p.start_time
+
+    # no equipment runs two processes at once
+    for a in processes:
+        for b in processes:
+            if a is not b and set(parse_equips(a.equipments)) & set(parse_equips(b.equipments)):
+                assert a.optimize_end_time <= b.optimize_start_time or b.optimize_end_time <= a.optimize_start_time
+
+    # each batch follows the route
+    for batch in range(3):
+        steps = sorted((route_step(p), p) for p in processes if p.number == batch)
+        for (_, before), (_, after) in zip(steps, steps[1:]):
+            assert before.optimize_end_time <= after.optimize_start_time
+
+    # positions staffed at once stay within the capacity
+    edges = sorted({p.optimize_start_time for p in processes})
+    for t in edges:
+        staffed = sum(p.worker_number for p in processes if p.optimize_start_time <= t < p.optimize_end_time)
+        assert staffed <= schedule.worker_capacity
+
+
+def test_explicit_capacity_is_respected():
+    processes = _processes()
+    schedule = optimize_day(processes, worker_capacity=2, max_iters=50)
+    assert schedule.worker_capacity == 2
+    for t in {p.optimize_start_time for p in processes}:
+        assert sum(p.worker_number for p in processes if p.optimize_start_time <= t < p.optimize_end_time) <= 2
+
+
+def test_processes_without_a_time_span_are_skipped():
+    processes = _processes()[:2]
+    broken = Process(product_type=PRODUCT, process_name="inner packing", equipments="elec54",
+                     start_time=datetime(2024, 3, 1, 9), end_time=datetime(2024, 3, 1, 8))
+    schedule = optimize_day(processes + [broken])
+    assert schedule.skipped == [broken]
+    assert broken.optimize_start_time is None
+    assert np.all([p.optimize_start_time is not None for p in processes])
@@ -0,0 +1,33 @@
+import numpy as np
+import pandas as pd
+
+from time_utils import date_range_slice, normalize_time
+
+
+def test_text_times_use_the_dominant_format_and_fall_back_per_row():
+    values = ["2024-01-02 08:00:00"] * 5 + ["2024/01/03 09:30:00", "2024-01-04 01:15:00 PM", "not a time", None]
+    parsed, report = normalize_time(values)
+    assert report.rows == 9
+    assert report.dominant_format == "%Y-%m-%d %H:%M:%S"
+    assert report.fallback_rows == 3
+    assert report.failed_rows == 1
+    assert parsed[0] == pd.Timestamp("2024-01-02 08:00")
+    assert parsed[5] == pd.Timestamp("2024-01-03 09:30")
+    assert parsed[6] == pd.Timestamp("2024-01-04 13:15")
+    assert pd.isna(parsed[7]) and pd.isna(parsed[8])
+
+
+def test_datetime_columns_are_only_cast():
+    values = pd.Series(pd.to_datetime(["2024-01-02 08:00", "2024-01-03 09:00"]))
+    parsed, report = normalize_time(values)
+    assert parsed.dtype == "datetime64[ns]"
+    assert report.dominant_format is None and report.failed_rows == 0
+    assert (parsed == values).all()
+
+
+def test_date_range_slice_covers_whole_days():
+    times = pd.date_range("2024-01-01", periods=96, freq="h").to_numpy()
+    rows = date_range_slice(times, "2024-01-02", "2024-01-03")
+    assert times[rows][0] == np.datetime64("2024-01-02T00:00")
+    assert times[rows][-1] == np.datetime64("2024-01-03T23:00")
+    assert date_range_slice(times, "2024-02-01", None) == slice(96, 96)
@@ -0,0 +1,108 @@
+# ============================================
+# Vectorized timestamp normalization for meter exports
+# ============================================
+from dataclasses import dataclass, asdict
+from datetime import date
+from typing import Optional
+
+import numpy as np
+import pandas as pd
+
+# Formats seen in the factory exports, most specific first
+TIME_FORMATS = ["%Y-%m-%d %I:%M:%S %p", "%Y/%m/%d %I:%M:%S %p",
+                "%Y-%m-%d %H:%M:%S", "%Y/%m/%d %H:%M:%S"]
+
+SAMPLE_SIZE = 256
+
+
+@dataclass
+class TimeParseReport:
+    rows: int = 0
+    dominant_format: Optional[str] = None   # None when the column was already datetime
+    fallback_rows: int = 0                  # rows not matching the dominant format
+    failed_rows: int = 0                    # rows left as NaT after every fallback
+
+    def as_dict(self):
+        return asdict(self)
+
+
+def detect_format(text, formats=TIME_FORMATS, sample_size=SAMPLE_SIZE):
+    """Pick the format that parses most of a small sample of the column"""
+    sample = text.dropna().head(sample_size)
+    if sample.empty:
+        return None
+    best, best_hits = None, 0
+    for fmt in formats:
+        hits = int(pd.to_datetime(sample, format=fmt, errors="coerce").notna().sum())
+        if hits > best_hits:
+            best, best_hits = fmt, hits
+    return best
+
+
+def normalize_time(values, formats=TIME_FORMATS):
+    """
+    Parse a time column in one vectorized pass.
+    - datetime columns are only cast to datetime64[ns]
+    - text: the dominant format is detected once and applied to the whole column,
+      only the leftover rows go through the other formats and then a generic parse
+    Returns (datetime64[ns] Series, TimeParseReport)
+    """
+    values = pd.Series(values)
+    report = TimeParseReport(rows=len(values))
+    if pd.api.types.is_datetime64_any_dtype(values.dtype):
+        return values.astype("datetime64[ns]"), report
+
+    # Excel can mix datetime cells with text cells; str() of a datetime cell
+    # is "%Y-%m-%d %H:%M:%S", so both go through the same text path
+    parsed = pd.Series(pd.NaT, index=values.index, dtype="datetime64[ns]")
+    text = values[values.notna()].astype(str).str.strip()
+    fmt = detect_format(text, formats)
+    report.dominant_format = fmt
+    if fmt is not None:
+        parsed[text.index] = pd.to_datetime(text, format=fmt, errors="coerce")
+
+    left = text[parsed[text.index].isna()]
+    report.fallback_rows = int(len(left))
+    for other in formats:
+        if left.empty:
+            break
+        if other == fmt:
+            continue
+        hit = pd.to_datetime(left, format=other, errors="coerce")
+        parsed[hit.index] = parsed[hit.index].fillna(hit)
+        left = left[hit.isna()]
+    if not left.empty:
+        parsed[left.index] = pd.to_datetime(left, format="mixed", errors="coerce")
+        left = left[parsed[left.index].isna()]
+    report.failed_rows = int(len(left))
+    return parsed, report
+
+
+# ============================================
+# Range slicing on sorted time arrays
+# ============================================
+def to_day(value):
+    """date / datetime / Timestamp / string -> numpy datetime64[D]"""
+    return np.datetime64(pd.Timestamp(value).date(), "D")
+
+
+def date_bounds(sorted_times):
+    """(first day, last day) of sorted timestamps as dates; today for both when there are none"""
+    times = np.asarray(sorted_times, dtype="datetime64[ns]")
+    if not len(times):
+        return date.today(), date.today()
+    return pd.Timestamp(times[0]).date(), pd.Timestamp(times[-1]).date()
+
+
+def date_range_slice(sorted_times, start=None, end=None):
+    """
+    slice of the rows whose calendar day lies in [start, end], found by binary
+    search on a sorted datetime64 array (readings or day keys). Slicing with the
+    result gives views, no mask is built.
+    """
+    unit = np.datetime_data(sorted_times.dtype)[0]
+    lo = 0 if start is None else int(np.searchsorted(
+        sorted_times, to_day(start).astype(f"datetime64[{unit}]"), "left"))
+    hi = len(sorted_times) if end is None else int(np.searchsorted(
+        sorted_times, (to_day(end) + 1).astype(f"datetime64[{unit}]"), "left"))
+    return slice(lo, max(lo, hi))